@@ -0,0 +1,25 @@
+"""Builds the compact emoji index that utils.discord.emoji loads, from Discord's emoji.json.
+
+Run with `python scripts/build_emoji_index.py` from the repository root after updating emoji.json.
+"""
+
+import json
+import pathlib
+
+SOURCE = pathlib.Path("src/utils/discord/emoji.json")
+TARGET = pathlib.Path("src/utils/discord/emoji.tsv")
+
+
+def build(source: pathlib.Path = SOURCE, target: pathlib.Path = TARGET) -> None:
+    """Writes one line per emoji: its string without variation selectors, then its names, tab-separated."""
+    with open(source) as f:
+        emojis = json.load(f)
+
+    with open(target, "w", encoding="utf-8", newline="\n") as f:
+        for emoji in emojis:
+            string = emoji["strings"][0].replace("\ufe0f", "")
+            f.write("\t".join([string, *emoji["names"]]) + "\n")
+
+
+if __name__ == "__main__":
+    build()
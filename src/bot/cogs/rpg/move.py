@@ -5,6 +5,9 @@ from utils.discord.bot import is_response
 from utils.discord.responses import HanalonEmbed
 from utils.rpg.dungeon import Dungeon, InsufficientSpeed, MergedWalls, Movement, Turn
 from utils.rpg.dungeon.piece import MovementMode
+from utils.rpg.dungeon.service import DungeonService
+from utils.rpg.dungeon.sessions import MongoStore, SessionManager
+from utils.rpg.dungeon.snapshot import Library
 from utils.rpg.prefabs import protohero
 
 
@@ -30,13 +33,24 @@ class GameAction(commands.Cog):
         self.maze = MergedWalls(self.maze, wall_token="X")
 
         self.maze.loc = (5, 5)
+        # the maze is a template, shared read-only by every dungeon instead of being linked to the latest one
+        self.maze.freeze()
+
+        # every dungeon shares the maze's layer, so spilled sessions refer to it rather than copy it
+        self.walls = [self.maze]
+        self.library = Library()
+        self.library.add(self.walls)
+
+        # moves and renders run on worker threads, so one slow board doesn't hold up the whole shard
+        self.service = DungeonService()
+        self.sessions = SessionManager(
+            MongoStore(bot.db["dungeons"]), library=self.library, service=self.service
+        )
 
-        self.dungeons = dict()
-
-    def board(self, hash) -> str:
-        return self.dungeons[hash].render_str
+    def cog_unload(self):
+        self.service.close()
 
-    def create_dungeon(self, hash):
+    async def create_dungeon(self, hash) -> Dungeon:
         charas = [
             protohero.PrototypePecorine(loc=(0, 0), speed=10),
             protohero.PrototypeYuni(loc=(-2, 0), speed=10),
@@ -45,102 +59,154 @@ class GameAction(commands.Cog):
             protohero.PrototypeKyaru(loc=(0, -4), speed=10),
         ]
 
-        self.dungeons[hash] = Dungeon(
+        dungeon = Dungeon(
             [
-                [self.maze],
+                self.walls,
                 [*charas],
-            ]
+            ],
+            reach=":blue_square:",
         )
 
         for c in charas:
-            self.dungeons[hash].turns.put(Turn(c))
+            dungeon.turns.put(Turn(c))
+
+        dungeon.render_origin = dungeon.turns.turn.focus.loc
 
-        self.dungeons[hash].render_origin = self.dungeons[hash].turns.turn.focus.loc
+        await self.sessions.put(hash, dungeon)
+        return dungeon
+
+    @commands.command(name="session-stats")
+    @commands.is_owner()
+    async def session_stats(self, ctx) -> None:
+        """Shows how many dungeon sessions are live and how often they were spilled."""
+        embed = HanalonEmbed(ctx)
+        for name, value in self.sessions.metrics.items():
+            embed.add_field(name=name.capitalize(), value=value)
+        await embed.respond(True)
 
     @commands.command()
     async def show(self, ctx) -> None:
         """Test command?"""
-        embed = HanalonEmbed(ctx)
-        embed.add_field(
-            name="Character",
-            value=self.dungeons[ctx.author.id].turns.turn.focus.__class__.__name__,
-            inline=False,
-        )
-        embed.add_field(
-            name="Remaining Distance",
-            value=float(self.dungeons[ctx.author.id].turns.turn.focus.speed),
-            inline=False,
-        )
-        embed.description = self.board(ctx.author.id)
-        await embed.respond(True)
+        async with self.sessions.use(ctx.author.id) as dungeon:
+            embed = HanalonEmbed(ctx)
+            embed.add_field(
+                name="Character",
+                value=dungeon.turns.turn.focus.__class__.__name__,
+                inline=False,
+            )
+            embed.add_field(
+                name="Remaining Distance",
+                value=float(dungeon.turns.turn.focus.speed),
+                inline=False,
+            )
+            embed.description = await self.service.render_str(dungeon)
+            await embed.respond(True)
 
         return embed
 
     @commands.command(name="start-turn")
     async def start_turn(self, ctx):
-        if ctx.author.id not in self.dungeons:
-            self.create_dungeon(ctx.author.id)
-
-        self.dungeons[ctx.author.id].start_turn()
-
-        embed = await self.show(ctx)
+        if await self.sessions.get(ctx.author.id) is None:
+            await self.create_dungeon(ctx.author.id)
 
-        while True:
-            j = await self.bot.wait_for(
-                "message",
-                check=lambda message: is_response(ctx, message, embed.response),
-            )
+        # the session is held for as long as the player is taking turns, so it isn't spilled mid-command
+        async with self.sessions.use(ctx.author.id) as dungeon:
+            await self.service.start_turn(dungeon)
 
-            contents = j.content.split()
+            embed = await self.show(ctx)
 
-            if contents[0] == "move":
-                embed = await self.move(
-                    await self.bot.get_context(j), int(contents[1]), int(contents[2])
-                )
-            elif contents[0] == "pan":
-                embed = await self.pan(
-                    await self.bot.get_context(j), int(contents[1]), int(contents[2])
+            while True:
+                j = await self.bot.wait_for(
+                    "message",
+                    check=lambda message: is_response(ctx, message, embed.response),
                 )
-            elif contents[0] == "next":
-                self.dungeons[ctx.author.id].resolve_turn()
-                self.dungeons[ctx.author.id].start_turn()
-                embed = await self.show(await self.bot.get_context(j))
-            else:
-                del self.dungeons[ctx.author.id]
-                return
+
+                contents = j.content.split()
+
+                if contents[0] == "move":
+                    embed = await self.move(
+                        await self.bot.get_context(j),
+                        int(contents[1]),
+                        int(contents[2]),
+                    )
+                elif contents[0] == "goto":
+                    embed = await self.goto(
+                        await self.bot.get_context(j),
+                        int(contents[1]),
+                        int(contents[2]),
+                    )
+                elif contents[0] == "pan":
+                    embed = await self.pan(
+                        await self.bot.get_context(j),
+                        int(contents[1]),
+                        int(contents[2]),
+                    )
+                elif contents[0] == "next":
+                    await self.service.resolve_turn(dungeon)
+                    await self.service.start_turn(dungeon)
+                    embed = await self.show(await self.bot.get_context(j))
+                else:
+                    await self.sessions.delete(ctx.author.id)
+                    return
 
     async def move(self, ctx, delta_x: int, delta_y: int) -> None:
+        dungeon = await self.sessions.get(ctx.author.id)
         error = True
         embed = HanalonEmbed(ctx)
         try:
-            self.dungeons[ctx.author.id].move(
+            await self.service.move(
+                dungeon,
                 Movement(
                     (delta_x, delta_y),
-                    piece=self.dungeons[ctx.author.id].turns.turn.focus,
-                    dungeon=self.dungeons[ctx.author.id],
+                    piece=dungeon.turns.turn.focus,
+                    dungeon=dungeon,
                     mode=MovementMode.WALKING,
-                )
+                ),
             )
             error = False
 
-            self.dungeons[ctx.author.id].resolve_turn()
+            await self.service.resolve_turn(dungeon)
+
+        except InsufficientSpeed:
+            embed.add_field(
+                name="Notice", value="Cannot reach the destination!", inline=False
+            )
+
+        return await self.respond(ctx, embed, error)
+
+    async def goto(self, ctx, x: int, y: int) -> None:
+        dungeon = await self.sessions.get(ctx.author.id)
+        error = True
+        embed = HanalonEmbed(ctx)
+        try:
+            await self.service.move_to(
+                dungeon,
+                dungeon.turns.turn.focus,
+                (x, y),
+                mode=MovementMode.WALKING,
+            )
+            error = False
 
         except InsufficientSpeed:
             embed.add_field(
                 name="Notice", value="Cannot reach the destination!", inline=False
             )
 
+        return await self.respond(ctx, embed, error)
+
+    async def respond(self, ctx, embed: HanalonEmbed, error: bool) -> HanalonEmbed:
+        dungeon = await self.sessions.get(ctx.author.id)
         embed.add_field(
             name="Character",
-            value=self.dungeons[ctx.author.id].turns.turn.focus.__class__.__name__,
+            value=dungeon.turns.turn.focus.__class__.__name__,
             inline=False,
         )
         embed.add_field(
             name="Remaining Distance",
-            value=float(self.dungeons[ctx.author.id].turns.turn.focus.speed),
+            value=float(dungeon.turns.turn.focus.speed),
             inline=False,
         )
-        embed.description = f"**View**\n{self.board(ctx.author.id)}"
+        embed.description = f"**View**\n{await self.service.render_str(dungeon)}"
         if error:
             await embed.respond(False)
         else:
@@ -149,10 +215,16 @@ class GameAction(commands.Cog):
         return embed
 
     async def pan(self, ctx, delta_x: int, delta_y: int) -> None:
-        origin = numpy.array(self.dungeons[ctx.author.id].render_origin)
-        self.dungeons[ctx.author.id].render_origin = tuple(
-            int(i) for i in origin + numpy.array([delta_x, delta_y])
-        )
+        dungeon = await self.sessions.get(ctx.author.id)
+
+        def pan():
+            origin = numpy.array(dungeon.render_origin)
+            dungeon.render_origin = tuple(
+                int(i) for i in origin + numpy.array([delta_x, delta_y])
+            )
+
+        # a render of the dungeon may be running on a worker, and must see one origin throughout
+        await self.service.call(dungeon, pan)
 
         embed = await self.show(ctx)
 
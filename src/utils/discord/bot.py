@@ -35,7 +35,8 @@ def prefix(bot: BotBase, message: discord.Message) -> set[str]:
     return {"$", f"<@{bot.user.id}> ", f"<@!{bot.user.id}> "}
 
 
-intents = discord.Intents(guilds=True, messages=True, reactions=True)
+# emojis: condensing tiles looks custom emojis up, and the palette forgets them when they change
+intents = discord.Intents(guilds=True, emojis=True, messages=True, reactions=True)
 
 bot = commands.AutoShardedBot(
     activity=discord.Activity(
@@ -1,52 +1,62 @@
-import itertools
-import json
+import functools
 import pathlib
 import re
 
 from discord.ext.commands import EmojiNotFound
-import discord.utils
 
 from utils.discord.bot import bot
 
-with open(pathlib.Path("utils/discord/emoji.json")) as defaults:
-    EMOJI = json.load(defaults)
+# built from emoji.json by scripts/build_emoji_index.py; each line is an emoji's string, then its names
+INDEX = pathlib.Path("utils/discord/emoji.tsv")
 
 
 def _unfe0f(emoji: str) -> str:
     return emoji.replace("\ufe0f", "")
 
 
-EMOJI_DICT = {
-    _[0]: _[1]
-    for _ in itertools.chain(
-        *[
-            [
-                _
-                for _ in itertools.product(
-                    emoji["names"], [_unfe0f(emoji["strings"][0])]
-                )
-            ]
-            for emoji in EMOJI
-        ]
-    )
-}
+@functools.cache
+def _index() -> tuple[dict[str, str], frozenset[str]]:
+    """Loads the emoji index the first time an emoji is looked up."""
+    names = dict()
+    strings = set()
 
-EMOJI_NAMES = EMOJI_DICT.keys()
-EMOJI_STRS = EMOJI_DICT.values()
+    with open(INDEX, encoding="utf-8") as index:
+        for line in index:
+            string, *aliases = line.rstrip("\n").split("\t")
+            strings.add(string)
+            names.update(dict.fromkeys(aliases, string))
+
+    return names, frozenset(strings)
+
+
+def __getattr__(name: str):
+    if name == "EMOJI_DICT":
+        return _index()[0]
+    if name == "EMOJI_NAMES":
+        return _index()[0].keys()
+    if name == "EMOJI_STRS":
+        return _index()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+CUSTOM_EMOJI = re.compile(r"<a?:[a-zA-Z0-9\_]{1,32}:([0-9]{15,20})>$")
 
 
 def condense(emoji: str) -> str:
-    match = re.match(r"<a?:[a-zA-Z0-9\_]{1,32}:([0-9]{15,20})>$", emoji)
+    match = CUSTOM_EMOJI.match(emoji)
 
     if match:
         emoji_id = int(match.group(1))
 
-        if discord.utils.get(bot.emojis, id=int(match.group(1))) is not None:
+        # the client keeps its custom emojis keyed by id, up to date with the gateway's events
+        if bot.get_emoji(emoji_id) is not None:
             return f"<:_:{emoji_id}>"
 
-    if emoji in EMOJI_NAMES:
-        return _unfe0f(EMOJI_DICT[emoji][0])
-    elif _unfe0f(emoji.replace("\ufe0f", "")) in EMOJI_STRS:
-        return _unfe0f(emoji.replace("\ufe0f", ""))
+    names, strings = _index()
+
+    if (string := names.get(emoji)) is not None:
+        return string
+    elif (string := _unfe0f(emoji)) in strings:
+        return string
 
-    raise EmojiNotFound
+    raise EmojiNotFound(emoji)
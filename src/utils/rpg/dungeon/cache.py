@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import threading
+from typing import Any
+
+
+class VersionedCache(object):
+    """LRU cache keyed by tuples that start with a version; putting a newer version evicts the older ones.
+
+    Caches on shared skins and templates are used by dungeons on different worker threads, so it's locked.
+    """
+
+    __slots__ = ("size", "hits", "misses", "_entries", "_lock")
+
+    def __init__(self, size: int = 64):
+        self.size = size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, bounds: tuple[int, int, int, int] = None) -> Any:
+        """Gets a cached entry, or None if there is none or it doesn't cover the given bounds."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or (bounds is not None and not entry.covers(bounds)):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def peek(self, key: tuple) -> Any:
+        """Gets a cached entry without counting it as a use."""
+        return self._entries.get(key)
+
+    def put(self, key: tuple, entry: Any) -> None:
+        """Caches an entry, evicting entries from older versions and the least recently used ones."""
+        with self._lock:
+            for old in [k for k in self._entries if k[0] < key[0]]:
+                del self._entries[old]
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
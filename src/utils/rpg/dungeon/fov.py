@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import numpy
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.piece import Piece
+
+# (row, col) -> (dx, dy) for each of the four quadrants: north, east, south, west
+QUADRANTS = (((0, 1), (1, 0)), ((1, 0), (0, 1)), ((0, -1), (1, 0)), ((-1, 0), (0, 1)))
+
+
+class VisibilityMap(object):
+    """A field of view over a rectangle of cells (min x, min y, max x, max y), inclusive."""
+
+    __slots__ = ("bounds", "field")
+
+    def __init__(self, bounds: tuple[int, int, int, int], field: numpy.ndarray):
+        self.bounds = bounds
+        self.field = field
+
+    def covers(self, bounds: tuple[int, int, int, int]) -> bool:
+        x0, y0, x1, y1 = self.bounds
+        return (
+            x0 <= bounds[0] and y0 <= bounds[1] and bounds[2] <= x1 and bounds[3] <= y1
+        )
+
+    def union(self, bounds: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        x0, y0, x1, y1 = self.bounds
+        return (
+            min(x0, bounds[0]),
+            min(y0, bounds[1]),
+            max(x1, bounds[2]),
+            max(y1, bounds[3]),
+        )
+
+    def window(self, bounds: tuple[int, int, int, int]) -> numpy.ndarray:
+        """Copies out the field over the given (covered) bounds, indexed [y][x]."""
+        x0, y0 = self.bounds[:2]
+        return self.field[
+            bounds[1] - y0 : bounds[3] - y0 + 1, bounds[0] - x0 : bounds[2] - x0 + 1
+        ].copy()
+
+
+class CornerTable(VisibilityMap):
+    """Visibility of cell corners; corner (i, j) lies at (i - 0.5, j - 0.5), so the lattice is exact."""
+
+    __slots__ = ()
+
+    UNKNOWN, HIDDEN, VISIBLE = -1, 0, 1
+
+    def __init__(self, bounds: tuple[int, int, int, int], field: numpy.ndarray = None):
+        if field is None:
+            field = numpy.full(
+                (bounds[3] - bounds[1] + 1, bounds[2] - bounds[0] + 1),
+                CornerTable.UNKNOWN,
+                dtype=numpy.int8,
+            )
+        super().__init__(bounds, field)
+
+    def resized(self, bounds: tuple[int, int, int, int]) -> CornerTable:
+        """Creates a table over new bounds, keeping the corners already traced."""
+        table = CornerTable(bounds)
+        x0, y0 = bounds[:2]
+        ox, oy, ox1, oy1 = self.bounds
+        table.field[oy - y0 : oy1 - y0 + 1, ox - x0 : ox1 - x0 + 1] = self.field
+        return table
+
+
+def is_grid_point(point: Iterable[float]) -> bool:
+    """Checks whether a point sits on the center of a grid cell."""
+    return all(float(i).is_integer() for i in point)
+
+
+def stamp(
+    grid: numpy.ndarray,
+    bounds: tuple[int, int, int, int],
+    origin: tuple[int, int],
+    mask: numpy.ndarray,
+) -> None:
+    """ORs a mask whose lower-left cell is at the origin into a grid spanning the bounds, clipping it."""
+    x0, y0, x1, y1 = bounds
+    ox, oy = origin
+    h, w = mask.shape
+
+    left, right = max(ox, x0), min(ox + w, x1 + 1)
+    bottom, top = max(oy, y0), min(oy + h, y1 + 1)
+
+    if left >= right or bottom >= top:
+        return
+
+    grid[bottom - y0 : top - y0, left - x0 : right - x0] |= mask[
+        bottom - oy : top - oy, left - ox : right - ox
+    ]
+
+
+def rasterize(
+    pieces: Iterable[Piece],
+    bounds: tuple[int, int, int, int],
+    ignore: Iterable[Piece] = (),
+) -> Optional[numpy.ndarray]:
+    """Rasterizes opaque pieces into an occupancy grid spanning (min x, min y, max x, max y), inclusive.
+
+    Returns None if some piece affects sight but can't be represented on the grid.
+    """
+    x0, y0, x1, y1 = bounds
+    grid = numpy.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+
+    for obj in pieces:
+        if obj in ignore or not obj.affects_sight:
+            continue
+        if not obj.opaque:
+            return None
+
+        raster = obj.raster()
+        if raster is None:
+            return None
+
+        stamp(grid, bounds, *raster)
+
+    return grid
+
+
+def shadowcast(opaque: numpy.ndarray, origin: tuple[int, int]) -> numpy.ndarray:
+    """Computes symmetric shadowcasting field of view over an occupancy grid.
+
+    The origin is given in grid indices (x, y); the result is indexed like the grid, [y][x].
+    """
+    height, width = opaque.shape
+    ox, oy = origin
+
+    walls = opaque.tolist()
+    seen = [[False] * width for _ in range(height)]
+
+    if 0 <= ox < width and 0 <= oy < height:
+        seen[oy][ox] = True
+
+    for (rx, ry), (cx, cy) in QUADRANTS:
+        # the furthest row in this quadrant that still lies on the grid
+        if rx:
+            max_depth = width - 1 - ox if rx > 0 else ox
+        else:
+            max_depth = height - 1 - oy if ry > 0 else oy
+
+        # rows are (depth, start slope numerator, start denominator, end numerator, end denominator)
+        rows = [(1, -1, 1, 1, 1)]
+
+        while rows:
+            depth, sn, sd, en, ed = rows.pop()
+            if depth > max_depth:
+                continue
+
+            min_col = (2 * depth * sn + sd) // (2 * sd)
+            max_col = -((ed - 2 * depth * en) // (2 * ed))
+
+            prev_wall = None
+            for col in range(min_col, max_col + 1):
+                x = ox + rx * depth + cx * col
+                y = oy + ry * depth + cy * col
+
+                on_grid = 0 <= x < width and 0 <= y < height
+                wall = on_grid and walls[y][x]
+
+                if on_grid and (
+                    wall or (col * sd >= depth * sn and col * ed <= depth * en)
+                ):
+                    seen[y][x] = True
+
+                if prev_wall and not wall:
+                    sn, sd = 2 * col - 1, 2 * depth
+                if prev_wall is False and wall:
+                    rows.append((depth + 1, sn, sd, 2 * col - 1, 2 * depth))
+
+                prev_wall = wall
+
+            if prev_wall is False:
+                rows.append((depth + 1, sn, sd, en, ed))
+
+    return numpy.array(seen, dtype=bool)
+
+
+def clear_line(
+    opaque: numpy.ndarray, start: tuple[int, int], end: tuple[int, int]
+) -> bool:
+    """Walks the cells between two cell centers (grid indices (x, y)), stopping at the first opaque one.
+
+    Lines passing exactly through a corner slip between the two diagonal cells, unless both are opaque, as
+    rays can't pass between walls that touch at a corner either.
+    """
+    x, y = start
+    dx, dy = end[0] - x, end[1] - y
+    nx, ny = abs(dx), abs(dy)
+    sx, sy = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+
+    ix = iy = 0
+
+    while (x, y) != end:
+        decision = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+
+        if decision == 0:
+            if opaque[y][x + sx] and opaque[y + sy][x]:
+                return False
+            x, y = x + sx, y + sy
+            ix, iy = ix + 1, iy + 1
+        elif decision < 0:
+            x, ix = x + sx, ix + 1
+        else:
+            y, iy = y + sy, iy + 1
+
+        if (x, y) == end:
+            return True
+        if opaque[y][x]:
+            return False
+
+    return True
@@ -1,17 +1,46 @@
 from __future__ import annotations
 
+import itertools
+import math
 from numbers import Number
-import queue
-from typing import Iterable
+from typing import Iterable, Optional
 
 from discord.ext.commands import EmojiNotFound
 import numpy
 import numpy.linalg
+from shapely.geometry import Point
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import PreparedGeometry, prep
 
-import utils.discord.emoji
 from utils.rpg import RPGException
-from utils.rpg.dungeon.piece import Condition, MovementMode, Piece
-from utils.rpg.dungeon.ray import CameraBehavior
+from utils.rpg.dungeon.cache import VersionedCache
+from utils.rpg.dungeon.fov import (
+    VisibilityMap,
+    clear_line,
+    is_grid_point,
+    rasterize,
+    stamp,
+)
+from utils.rpg.dungeon.palette import PALETTE, Palette, paste
+from utils.rpg.dungeon.path import (
+    DistanceField,
+    astar,
+    dijkstra,
+    rasterize_solids,
+    waypoints,
+)
+from utils.rpg.dungeon.piece import (
+    IMMOBILE,
+    MOVEMENT_COST,
+    Condition,
+    Event,
+    MovementMode,
+    Piece,
+)
+from utils.rpg.dungeon.ray import CameraBehavior, FieldOfView, Ray, RayTracer
+from utils.rpg.dungeon.scheduler import EventQueue, Turn, TurnManager
+from utils.rpg.dungeon.spatial import SpatialHash
+from utils.rpg.dungeon.world import World
 
 
 class InsufficientSpeed(RPGException):
@@ -19,7 +48,7 @@ class InsufficientSpeed(RPGException):
 
 
 class Movement(object):
-    __slots__ = ("vector", "piece", "dungeon", "mode")
+    __slots__ = ("vector", "piece", "dungeon", "mode", "_swept")
 
     def __init__(
         self,
@@ -34,59 +63,84 @@ class Movement(object):
         self.dungeon = dungeon
         self.mode = mode
 
+        self._swept = None
 
-class Turn(queue.Queue, object):
-    __slots__ = "focus"
+    @property
+    def swept(self) -> tuple[BaseGeometry, PreparedGeometry]:
+        """The area swept by the piece's hitbox and a prepared copy for fast predicates, built once per location."""
+        loc = tuple(self.piece.loc)
 
-    def __init__(self, focus: Piece = None):
-        super().__init__()
+        if self._swept is None or self._swept[0] != loc:
+            hitbox = self.piece.move_hitbox(self)
+            self._swept = (loc, hitbox, prep(hitbox))
 
-        self.focus = focus
+        return self._swept[1:]
 
-    def do_next(self, *args, **kwargs):
-        """Does the next action in the turn."""
-        self.get()(*args, **kwargs)
 
+class Transaction(object):
+    """Snapshots pieces, and their mounts, so that changes made to them can be rolled back as a whole.
 
-class TurnManager(queue.Queue, object):
-    __slots__ = ("turn", "dungeon")
+    Used as a context manager, it rolls back if an exception escapes and commits otherwise. Templates can't
+    change, so they're left out.
+    """
 
-    def __init__(self, dungeon: Dungeon):
-        super().__init__()
+    __slots__ = ("_snapshots",)
 
-        self.turn = None
-        self.dungeon = dungeon
+    def __init__(self, *pieces: Piece):
+        self._snapshots = dict()
+        self.add(*pieces)
 
-    def put(self, *args, **kwargs):
-        """Puts a new turn, advancing to that turn if no turn is present."""
-        super().put(*args, **kwargs)
-        if self.turn is None:
-            self.turn = self.next_turn()
+    def add(self, *pieces: Piece) -> None:
+        """Snapshots more pieces, e.g. ones a later step runs into; pieces already held keep their snapshot."""
+        for piece in pieces:
+            while (
+                piece is not None and not piece.frozen and piece not in self._snapshots
+            ):
+                self._snapshots[piece] = piece.snapshot()
+                piece = piece.mount
 
-    def next_turn(self):
-        """Advances to the next turn, putting a turn with the same focus back into the queue."""
-        if self.qsize() == 0 and not self.turn:
-            raise queue.Empty
+    def __enter__(self) -> Transaction:
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None:
+            self.rollback()
         else:
-            try:
-                self.turn.focus.on_turn(self.dungeon)
-                if not (self.turn.focus.condition & Condition.DEAD):
-                    self.put(Turn(self.turn.focus))
-            except AttributeError:
-                ...
-        self.turn = self.get()
-        return self.turn
+            self.commit()
+
+    def commit(self) -> None:
+        """Keeps the changes."""
+        self._snapshots.clear()
+
+    def rollback(self) -> None:
+        """Restores every piece to its snapshot."""
+        for piece, state in self._snapshots.items():
+            piece.restore(state)
+        self._snapshots.clear()
 
 
 class Dungeon(object):
     __slots__ = (
         "_pieces",
+        "_index",
+        "_layout",
+        "_version",
+        "_sight_version",
+        "_sight_lines",
+        "visibility",
+        "paths",
         "default",
         "blind",
         "turns",
         "render_size",
         "render_origin",
         "render_behavior",
+        "fov",
+        "reach",
+        "_layers",
+        "renders",
+        "world",
+        "_animated",
     )
 
     def __init__(
@@ -98,8 +152,15 @@ class Dungeon(object):
         render_size: Iterable[int] = (9, 9),
         render_origin: Iterable[Number] = (0, 0),
         render_behavior: CameraBehavior = CameraBehavior.FOLLOW,
+        fov: FieldOfView = FieldOfView.SHADOWCAST,
+        reach: Optional[str] = None,
+        world: Optional[World] = None,
     ):
+        if world is not None and not any(layer is world.pieces for layer in pieces):
+            pieces = [world.pieces, *pieces]
+
         self._pieces = pieces
+        self.world = world
 
         self.default = default
         self.blind = blind
@@ -107,6 +168,19 @@ class Dungeon(object):
         self.render_size = render_size[:2]
         self.render_origin = tuple(int(i) for i in render_origin[:2])
         self.render_behavior = render_behavior
+        self.fov = fov
+        self.reach = reach
+
+        self._layers = dict()
+
+        self._layout = None
+        self._version = 0
+        self._sight_version = 0
+        self._sight_lines = (0, dict())
+        self.visibility = VersionedCache()
+        self.paths = VersionedCache(size=16)
+        self.renders = VersionedCache(size=16)
+        self._animated = (None, False)
 
         for piece in set.union(*map(set, pieces)):
             piece.link(self)
@@ -121,64 +195,425 @@ class Dungeon(object):
     def pieces(self, new: Iterable[Iterable[Piece]]):
         diff = set.union(*map(set, new)).difference(set.union(*map(set, self._pieces)))
 
+        self._pieces = new
+        self.reindex()
+
         for piece in diff:
             piece.link(self)
 
-        self._pieces = new
+    @property
+    def index(self) -> SpatialHash:
+        """Spatial index over every piece's hitbox; rebuilt if the layers were modified in place."""
+        if self._layout != (
+            layout := [(id(layer), len(layer)) for layer in self._pieces]
+        ):
+            self.reindex(layout)
+        return self._index
+
+    def reindex(self, layout: list[tuple[int, int]] = None) -> None:
+        """Rebuilds the spatial index from scratch, linking pieces that were added to the layers in place."""
+        self._index = SpatialHash(itertools.chain.from_iterable(self._pieces))
+        for piece in itertools.chain.from_iterable(self._pieces):
+            if piece.dungeon is None:
+                piece.link(self)
+        self._layout = layout or [(id(layer), len(layer)) for layer in self._pieces]
+        self.bump()
+        self.bump_sight()
+
+    def query(self, bounds: Iterable[Number]) -> list[Piece]:
+        """Finds the pieces whose hitboxes may overlap (min x, min y, max x, max y), loading the world there first."""
+        self.load(bounds)
+        return self.index.query(bounds)
+
+    def load(self, bounds: Iterable[Number]) -> None:
+        """Makes sure the world's chunks over (min x, min y, max x, max y) are loaded."""
+        if self.world is not None and self.world.ensure(bounds):
+            self.reindex()
 
-    def collide(self, movement: Movement, mock: bool) -> None:
-        """Simulates collisions."""
-        piece = movement.piece
-        sim_queue = queue.PriorityQueue()
+    @property
+    def version(self) -> int:
+        """Counter bumped whenever any piece moves, changes condition, appears or disappears."""
+        self.index  # layers modified in place are picked up by the index, which bumps the version
+        return self._version
 
-        for layer in self.pieces:
-            for obj in layer:
-                if obj is piece:
-                    continue
-                if not mock:
-                    obj.process_kinesis(
-                        self.turns.turn,
-                        movement.piece.move_hitbox(movement),
-                        movement.piece.loc,
-                        "coincide",
-                        movement,
-                        mock=False,
-                    )
-                else:
-                    obj.process_kinesis(
-                        sim_queue,
-                        movement.piece.move_hitbox(movement),
-                        movement.piece.loc,
-                        "coincide",
-                        movement,
-                        mock=True,
-                    )
+    @property
+    def last_version(self) -> int:
+        """The version as of when it was last read, without looking for layers modified in place.
+
+        Unlike the version, it never rebuilds the index, so it can be read while a worker is using the dungeon.
+        """
+        return self._version
+
+    def bump(self) -> None:
+        self._version += 1
+
+    @property
+    def sight_version(self) -> int:
+        """Counter bumped whenever something that blocks or alters sight moves, appears or disappears."""
+        self.index  # layers modified in place are picked up by the index, which bumps the version
+        return self._sight_version
+
+    def bump_sight(self) -> None:
+        self._sight_version += 1
+
+    def occupancy(self, bounds: tuple[int, int, int, int]) -> Optional[numpy.ndarray]:
+        """Rasterizes sight-blocking pieces over (min x, min y, max x, max y), inclusive.
+
+        The raster is cached until the sight version changes, so every viewer shares it.
+        """
+        key = (self.sight_version, "occupancy", None, None)
+
+        if (grid := self.visibility.get(key, bounds)) is None:
+            region = bounds
+            if (old := self.visibility.peek(key)) is not None:
+                region = old.union(bounds)
+
+            raster = rasterize(
+                self.query(
+                    (region[0] - 0.5, region[1] - 0.5, region[2] + 0.5, region[3] + 0.5)
+                ),
+                region,
+            )
+            if raster is None:
+                return None
+
+            self.visibility.put(key, grid := VisibilityMap(region, raster))
+
+        return grid.window(bounds)
+
+    def field_of_view(
+        self, viewers: Iterable[Piece]
+    ) -> tuple[numpy.ndarray, dict[Piece, numpy.ndarray]]:
+        """Computes what a group of viewers sees of the viewport, giving the union and each viewer's field.
+
+        Blinded viewers see nothing. Occluders are rasterized once for the whole group.
+        """
+        tracers = [RayTracer(dungeon=self, source=viewer) for viewer in viewers]
+        regions = [
+            tracer.region
+            for tracer in tracers
+            if self.fov == FieldOfView.SHADOWCAST and is_grid_point(tracer.source.loc)
+        ]
+
+        if regions:
+            self.occupancy(
+                (
+                    min(r[0] for r in regions),
+                    min(r[1] for r in regions),
+                    max(r[2] for r in regions),
+                    max(r[3] for r in regions),
+                )
+            )
+
+        union = numpy.zeros(self.render_size[2::-1], dtype=bool)
+        fields = dict()
+
+        for tracer in tracers:
+            if tracer.source.condition & Condition.BLINDED:
+                fields[tracer.source] = numpy.zeros_like(union)
+            else:
+                fields[tracer.source] = tracer.trace()
+                union |= fields[tracer.source]
+
+        return union, fields
+
+    def line_of_sight(self, a: Piece, b: Piece) -> bool:
+        """Checks whether nothing blocks sight between two pieces, stopping at the first obstruction.
+
+        Answers are cached until the sight version changes.
+        """
+        version = self.sight_version
+        if self._sight_lines[0] != version:
+            self._sight_lines = (version, dict())
+
+        key = frozenset(
+            (tuple(float(i) for i in p.loc), p if p.affects_sight else None)
+            for p in (a, b)
+        )
+        lines = self._sight_lines[1]
+
+        if (clear := lines.get(key)) is None:
+            lines[key] = clear = self._trace_line(a, b)
+
+        return clear
+
+    def _trace_line(self, a: Piece, b: Piece) -> bool:
+        if (
+            self.fov == FieldOfView.SHADOWCAST
+            and is_grid_point(a.loc)
+            and is_grid_point(b.loc)
+            and not (a.affects_sight or b.affects_sight)
+        ):
+            (ax, ay), (bx, by) = (tuple(int(i) for i in p.loc) for p in (a, b))
+            bounds = (min(ax, bx), min(ay, by), max(ax, bx), max(ay, by))
+
+            if (grid := self.occupancy(bounds)) is not None:
+                return clear_line(
+                    grid,
+                    (ax - bounds[0], ay - bounds[1]),
+                    (bx - bounds[0], by - bounds[1]),
+                )
+
+        end = Ray(a.loc, b.loc, 1, self, ignore=(a, b)).trace()
+        return end.distance(Point(b.loc)) <= 0.1
+
+    def visible_pieces(self, viewer: Piece, radius: Number) -> list[Piece]:
+        """Finds the visible pieces within a radius of the viewer, in layer order; opaque scenery is skipped."""
+        if viewer.condition & Condition.BLINDED:
+            return []
+
+        x, y = viewer.loc
+
+        return [
+            piece
+            for piece in self.query((x - radius, y - radius, x + radius, y + radius))
+            if piece is not viewer
+            and not piece.opaque
+            and not (piece.condition & Condition.INVISIBLE)
+            and numpy.linalg.norm(piece.loc - viewer.loc) <= radius
+            and self.line_of_sight(viewer, piece)
+        ]
+
+    def extent(self, *cells: Iterable[int]) -> tuple[int, int, int, int]:
+        """The cells spanned by every piece and the given cells, padded by one so paths can go around the edge."""
+        bounds = [b for b in (self.index.bounds, *((*c, *c) for c in cells)) if b]
+
+        return (
+            math.floor(min(b[0] for b in bounds) + 0.5) - 1,
+            math.floor(min(b[1] for b in bounds) + 0.5) - 1,
+            math.ceil(max(b[2] for b in bounds) - 0.5) + 1,
+            math.ceil(max(b[3] for b in bounds) - 0.5) + 1,
+        )
+
+    def obstacles(self, bounds: tuple[int, int, int, int]) -> numpy.ndarray:
+        """Rasterizes solid pieces over (min x, min y, max x, max y), inclusive.
+
+        The raster is cached until the version changes, so every path search shares it.
+        """
+        key = (self.version, "obstacles")
+
+        if (grid := self.paths.get(key, bounds)) is None:
+            region = bounds
+            if (old := self.paths.peek(key)) is not None:
+                region = old.union(bounds)
+
+            raster = rasterize_solids(
+                self.query(
+                    (region[0] - 0.5, region[1] - 0.5, region[2] + 0.5, region[3] + 0.5)
+                ),
+                region,
+            )
+            self.paths.put(key, grid := VisibilityMap(region, raster))
+
+        return grid.window(bounds)
+
+    def distance_field(
+        self,
+        target: Iterable[Number],
+        mode: MovementMode = MovementMode.WALKING,
+        limit: Number = math.inf,
+    ) -> DistanceField:
+        """Computes the cost of reaching a cell from everywhere, e.g. so that many pieces can chase one target.
+
+        Fields are cached until the version changes.
+        """
+        target = tuple(int(i) for i in numpy.rint(target[:2]))
+        cost = MOVEMENT_COST[mode]
+        key = (self.version, "distance", target, cost, limit)
+
+        if (field := self.paths.get(key)) is None:
+            bounds = self.extent(target)
+            field = DistanceField(
+                bounds,
+                dijkstra(
+                    self.obstacles(bounds),
+                    (target[0] - bounds[0], target[1] - bounds[1]),
+                    cost,
+                    limit,
+                ),
+                target,
+                cost,
+            )
+            self.paths.put(key, field)
+
+        return field
+
+    def find_path(
+        self,
+        piece: Piece,
+        goal: Iterable[Number],
+        mode: MovementMode = MovementMode.WALKING,
+        limit: Number = math.inf,
+    ) -> Optional[list[numpy.ndarray]]:
+        """Finds the cheapest way for a piece to get to a cell, as movement vectors that don't cut corners.
+
+        Returns None if the piece can't move that way or the cell can't be reached within the limit.
+        """
+        cost = MOVEMENT_COST[mode]
+        if piece.condition & IMMOBILE or math.isinf(cost):
+            return None
+
+        start = tuple(int(i) for i in numpy.rint(piece.loc))
+        goal = tuple(int(i) for i in numpy.rint(goal[:2]))
+        bounds = self.extent(start, goal)
+
+        cells = astar(
+            self.obstacles(bounds),
+            (start[0] - bounds[0], start[1] - bounds[1]),
+            (goal[0] - bounds[0], goal[1] - bounds[1]),
+            limit / cost,
+        )
+        if cells is None:
+            return None
+
+        points = [numpy.array(piece.loc, dtype=float)] + [
+            numpy.array((x + bounds[0], y + bounds[1]), dtype=float)
+            for x, y in waypoints(cells)[1:]
+        ]
+
+        return [end - start for start, end in zip(points, points[1:])]
+
+    def reachable(
+        self, piece: Piece, mode: MovementMode = MovementMode.WALKING
+    ) -> numpy.ndarray:
+        """Finds the cells of the viewport a piece can get to with its remaining speed, indexed [y][x].
+
+        Only the square the speed can span is searched, and the answer is cached until the version changes.
+        """
+        bounds = self.viewport
+        mask = numpy.zeros(
+            (bounds[3] - bounds[1] + 1, bounds[2] - bounds[0] + 1), dtype=bool
+        )
+
+        cost = MOVEMENT_COST[mode]
+        if piece.condition & IMMOBILE or math.isinf(cost) or piece.speed < 0:
+            return mask
 
-        while sim_queue.qsize() != 0:
-            sim_queue.get()[1]()
+        x, y = (int(i) for i in numpy.rint(piece.loc))
+        key = (self.version, "reachable", (x, y), cost, piece.speed)
 
-    def move(self, movement: Movement) -> None:
-        """Moves a piece according to the movement."""
-        mag = numpy.linalg.norm(numpy.copy(movement.vector))
+        if (reach := self.paths.get(key)) is None:
+            if math.isinf(piece.speed):
+                region = self.extent((x, y))
+            else:
+                r = int(piece.speed // cost)
+                region = (x - r, y - r, x + r, y + r)
 
-        if mag > movement.piece.speed:
+            field = dijkstra(
+                self.obstacles(region),
+                (x - region[0], y - region[1]),
+                cost,
+                piece.speed,
+            )
+            reach = VisibilityMap(region, ~numpy.isinf(field))
+            self.paths.put(key, reach)
+
+        stamp(mask, bounds, reach.bounds[:2], reach.field)
+
+        return mask
+
+    def move_to(
+        self,
+        piece: Piece,
+        goal: Iterable[Number],
+        mode: MovementMode = MovementMode.WALKING,
+    ) -> None:
+        """Moves a piece to a cell along the cheapest path, resolving each leg before the next.
+
+        The legs go through as a whole: if any of them fails, every piece they moved is put back.
+        """
+        vectors = self.find_path(piece, goal, mode, piece.speed)
+
+        if vectors is None or (
+            MOVEMENT_COST[mode] * sum(numpy.linalg.norm(v) for v in vectors)
+            > piece.speed
+        ):
             raise InsufficientSpeed
 
-        if mag == 0:
-            movement.piece.on_move(movement)
-            return
+        origin = self.render_origin
+
+        try:
+            with Transaction(piece) as t:
+                for vector in vectors:
+                    self.move(
+                        Movement(vector, piece=piece, dungeon=self, mode=mode),
+                        transaction=t,
+                    )
+                    self.resolve_turn()
+        except InsufficientSpeed:
+            self.render_origin = origin
+            raise
+
+    def collisions(self, movement: Movement, **kwargs) -> list[Event]:
+        """Finds the hook calls a movement sets off, nearest to where it starts first."""
+        piece = movement.piece
+        events = EventQueue()
+
+        swept, prepared = movement.swept
 
-        self.collide(movement, mock=True)
+        for obj in self.query(swept.bounds):
+            if obj is piece or not prepared.intersects(obj.hitbox_near(swept)):
+                continue
+            obj.process_kinesis(
+                events, swept, piece.loc, "coincide", movement, **kwargs
+            )
 
-        movement.piece.on_move(movement, mock=True)
+        return [events.get() for _ in range(len(events))]
 
-        if movement.piece._speed < 0:
-            movement.piece._speed = movement.piece.speed
+    def collide(self, movement: Movement, mock: bool) -> None:
+        """Simulates collisions; mock collisions are rolled back afterwards."""
+        events = self.collisions(movement, mock=mock)
+
+        with Transaction(movement.piece, *(event.piece for event in events)) as t:
+            for event in events:
+                event()
+            if mock:
+                t.rollback()
+
+    def move(
+        self,
+        movement: Movement,
+        *,
+        preview: bool = False,
+        transaction: Optional[Transaction] = None,
+    ) -> None:
+        """Moves a piece according to the movement.
+
+        Collision hooks and the move itself run once, right away rather than queued on the turn, in a
+        transaction that is rolled back if the piece runs out of speed, or afterwards anyway if only previewing
+        the move. Previews call the hooks with mock set, and moves the piece can't pay for are refused before
+        any hook is called. The pieces involved are also added to the enclosing transaction, if any.
+        """
+        piece = movement.piece
+        mag = numpy.linalg.norm(movement.vector)
+        cost = MOVEMENT_COST[movement.mode]
+
+        if piece.condition & IMMOBILE or math.isinf(cost) or cost * mag > piece.speed:
             raise InsufficientSpeed
 
-        self.turns.turn.put(lambda: movement.piece.on_move(movement))
+        events = self.collisions(movement, mock=preview) if mag else []
+
+        if transaction is not None:
+            transaction.add(piece, *(event.piece for event in events))
+
+        with Transaction(piece, *(event.piece for event in events)) as t:
+            for event in events:
+                event()
 
-        self.collide(movement, mock=False)
+            piece.on_move(movement)
+
+            if piece.speed < 0:
+                raise InsufficientSpeed
+            if preview:
+                t.rollback()
+
+    def preview(self, movement: Movement) -> bool:
+        """Checks whether a movement would go through, leaving the pieces as they were."""
+        try:
+            self.move(movement, preview=True)
+        except InsufficientSpeed:
+            return False
+        return True
 
     def start_turn(self):
         """Starts a turn."""
@@ -195,76 +630,195 @@ class Dungeon(object):
         if self.render_behavior == CameraBehavior.FOLLOW:
             self.render_origin = tuple(int(i) for i in self.turns.turn.focus.loc)
 
-        self.turns.turn.focus.raytracer.clear_cache()
+    def _compose(self, index: int, layer: Iterable[Piece]) -> Optional[VisibilityMap]:
+        """Composes a layer into one raster of palette ids, cached until any of its pieces moves or changes skin.
+
+        Returns None if some piece's skin is boundless, or if the pieces are too spread out for it to pay off.
+        """
+        signature = [
+            (obj, tuple(obj.loc), obj.skin, obj.condition & Condition.INVISIBLE)
+            for obj in layer
+        ]
+
+        if (cached := self._layers.get(index)) is not None and cached[0] == signature:
+            return cached[1]
+
+        rasters = []
+
+        for obj in layer:
+            if obj.condition & Condition.INVISIBLE:
+                continue
+            if (raster := obj.skin.raster()) is None:
+                self._layers[index] = (signature, None)
+                return None
+
+            (sx, sy), ids = raster
+            x, y = (int(i) for i in numpy.rint(obj.loc))
+            rasters.append(((x + sx, y + sy), ids))
+
+        bounds = (
+            min((o[0] for o, _ in rasters), default=0),
+            min((o[1] for o, _ in rasters), default=0),
+            max((o[0] + ids.shape[1] - 1 for o, ids in rasters), default=-1),
+            max((o[1] + ids.shape[0] - 1 for o, ids in rasters), default=-1),
+        )
+        shape = (bounds[3] - bounds[1] + 1, bounds[2] - bounds[0] + 1)
+
+        if len(rasters) == 1:
+            # a lone raster, e.g. a template maze's, is shared rather than copied into every dungeon
+            composite = VisibilityMap(bounds, rasters[0][1])
+        elif shape[0] * shape[1] > 4 * sum(ids.size for _, ids in rasters):
+            composite = None
+        else:
+            composite = VisibilityMap(bounds, numpy.zeros(shape, dtype=numpy.int32))
+            for origin, ids in rasters:
+                paste(composite.field, bounds, origin, ids)
+
+        self._layers[index] = (signature, composite)
+        return composite
+
+    @staticmethod
+    def _blit(
+        board: numpy.ndarray, bounds: tuple[int, int, int, int], obj: Piece
+    ) -> None:
+        """Draws a single piece onto a board of palette ids spanning the bounds."""
+        x, y = (int(i) for i in numpy.rint(obj.loc))
+
+        if (raster := obj.skin.raster()) is not None:
+            (sx, sy), ids = raster
+            paste(board, bounds, (x + sx, y + sy), ids)
+        elif (
+            ids := obj.skin.window(
+                (bounds[0] - x, bounds[1] - y, bounds[2] - x, bounds[3] - y)
+            )
+        ) is not None:
+            numpy.copyto(board, ids, where=ids != Palette.EMPTY)
+        else:
+            for row in range(board.shape[0]):
+                for col in range(board.shape[1]):
+                    if px := obj.skin.get_index(
+                        bounds[0] + col - x, bounds[1] + row - y
+                    ):
+                        board[row][col] = PALETTE.id(px)
+
+    @property
+    def animated(self) -> bool:
+        """Whether any piece's skin changes between renders, so that renders can't be cached."""
+        if self._animated[0] != (version := self.version):
+            self._animated = (
+                version,
+                not all(
+                    obj.skin.deterministic
+                    for obj in itertools.chain.from_iterable(self._pieces)
+                ),
+            )
+        return self._animated[1]
+
+    def render_key(self, kind: str) -> Optional[tuple]:
+        """Key for the render cache; everything a render depends on besides the pieces is part of it.
+
+        None if the board is animated, and must be drawn afresh every time.
+        """
+        if self.animated:
+            return None
+
+        focus = self.turns.turn.focus
+
+        return (
+            self.version,
+            kind,
+            tuple(self.render_origin),
+            tuple(self.render_size),
+            focus,
+            focus.speed if self.reach is not None else None,
+            self.fov,
+            (self.default, self.blind, self.reach),
+            PALETTE.version,
+        )
 
     @property
     def render(self) -> Iterable[Iterable[str]]:
-        """Renders a 2D list for display."""
+        """Renders a 2D list for display.
+
+        Renders are cached until the version changes, so redrawing an unchanged board is a dictionary lookup.
+        """
+        self.load(RayTracer(dungeon=self, source=self.turns.turn.focus).region)
+        key = self.render_key("render")
+
+        if key is None or (rows := self.renders.get(key)) is None:
+            rows = tuple(tuple(row) for row in self._render())
+            if key is not None:
+                self.renders.put(key, rows)
+
+        return [list(row) for row in rows]
+
+    @property
+    def viewport(self) -> tuple[int, int, int, int]:
+        """The cells the board shows, as (min x, min y, max x, max y), inclusive."""
         x, y = self.render_origin
         width, height = self.render_size
+        x, y = x - (width - 1) // 2, y - (height - 1) // 2
+        return x, y, x + width - 1, y + height - 1
+
+    def _render(self) -> list[list[str]]:
+        """Layers are composed as arrays of palette ids; layers that didn't change are pasted from a cached raster."""
+        width, height = self.render_size
 
         if self.turns.turn.focus.condition & Condition.BLINDED:
             return [[self.blind] * width for _ in range(height)]
 
-        dx, dy = (width - 1) // 2, (height - 1) // 2
-        out = [[None] * width for _ in range(height)]
-        x, y = x - dx, y - dy
+        bounds = self.viewport
+        board = numpy.zeros((height, width), dtype=numpy.int32)
+
+        for i, layer in enumerate(self.pieces):
+            if (composite := self._compose(i, layer)) is not None:
+                paste(board, bounds, composite.bounds[:2], composite.field)
+                continue
 
-        for layer in self.pieces:
             for obj in layer:
                 if not (obj.condition & Condition.INVISIBLE):
-                    coords = numpy.rint(obj.loc)
-
-                    obj_bounds = obj.skin.get_bounds()
-
-                    if obj_bounds:
-                        for row in obj_bounds[1][
-                            max(round(y - coords[1]), 0) : max(
-                                min(round(y + height - coords[1]), len(obj_bounds[1])),
-                                0,
-                            )
-                        ]:
-                            for col in obj_bounds[0][
-                                max(round(x - coords[0]), 0) : max(
-                                    min(
-                                        round(x + width - coords[0]), len(obj_bounds[0])
-                                    ),
-                                    0,
-                                )
-                            ]:
-                                if px := obj.skin.get_index(col, row):
-                                    out[row + round(coords[1] - y)][
-                                        col + round(coords[0] - x)
-                                    ] = px
-                    else:
-                        for row in range(
-                            round(y - coords[1]), round(y + height - coords[1])
-                        ):
-                            for col in range(
-                                round(x - coords[0]), round(x + width - coords[0])
-                            ):
-                                if px := obj.skin.get_index(col, row):
-                                    out[row + round(coords[1] - y)][
-                                        col + round(coords[0] - x)
-                                    ] = px
+                    self._blit(board, bounds, obj)
 
         rays = self.turns.turn.focus.raytracer.trace()
 
-        out = [
-            [
-                utils.discord.emoji.condense(
-                    self.blind if not rays[i][j] else self.default if not px else px
-                )
-                for j, px in enumerate(row)
-            ]
-            for i, row in enumerate(out)
-        ]
+        if self.reach is not None:
+            empty = numpy.where(
+                self.reachable(self.turns.turn.focus),
+                PALETTE.id(self.reach),
+                PALETTE.id(self.default),
+            )
+        else:
+            empty = PALETTE.id(self.default)
+
+        board = numpy.where(board == Palette.EMPTY, empty, board)
+        board = numpy.where(rays, board, PALETTE.id(self.blind))
 
-        return out
+        return PALETTE.lookup(board, condensed=True)
 
     @property
     def render_str(self) -> str:
         """Creates string to display board."""
-        board = self.render
-        board.reverse()
-        return "\n".join(["".join(a) for a in board])
+        self.load(RayTracer(dungeon=self, source=self.turns.turn.focus).region)
+        key = self.render_key("render_str")
+
+        if key is None or (board := self.renders.get(key)) is None:
+            board = "\n".join(["".join(a) for a in reversed(self.render)])
+            if key is not None:
+                self.renders.put(key, board)
+
+        return board
+
+    def diff(self, board: Iterable[Iterable[str]]) -> list[int]:
+        """Finds the rows of the current render that differ from an earlier one, e.g. to skip redundant redraws.
+
+        Rows are indexed as in render; every row differs if the viewport was resized.
+        """
+        current = self.render
+        board = list(board)
+
+        if len(board) != len(current):
+            return list(range(len(current)))
+
+        return [
+            i for i, (old, new) in enumerate(zip(board, current)) if list(old) != new
+        ]
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import io
+import pathlib
+import struct
+from typing import BinaryIO, Iterable, Union
+
+import numpy
+
+# binary maps: magic, format version, width, height, then the rows bottom first, as packed bits
+MAGIC = b"HMAP"
+VERSION = 1
+HEADER = struct.Struct("<4sBII")
+
+
+def parse_map(rows: Iterable[str], wall_token: str = "#") -> numpy.ndarray:
+    """Turns rows of an ASCII map, top row first, into a grid of wall cells indexed [y][x].
+
+    Each row is one whitespace-separated word, so maps can be indented; short rows are padded with floor.
+    """
+    # rows are filled into a grid that doubles as it runs out of room, so only one row's codes exist at a time
+    grid = numpy.zeros((0, 0), dtype=bool)
+    height = width = 0
+
+    for row in rows:
+        for word in row.split():
+            code = numpy.frombuffer(word.encode("utf-32-le"), dtype=numpy.uint32)
+            if height == grid.shape[0] or len(code) > grid.shape[1]:
+                grown = numpy.zeros(
+                    (max(height * 2, 16), max(grid.shape[1], len(code))), dtype=bool
+                )
+                grown[:height, : grid.shape[1]] = grid[:height]
+                grid = grown
+
+            grid[height, : len(code)] = code == ord(wall_token)
+            height, width = height + 1, max(width, len(code))
+
+    # the rows were read top first, but the grid is indexed bottom first
+    grid = grid[height - 1 :: -1, :width].copy() if height else grid
+
+    return grid
+
+
+def load_map(
+    path: Union[str, pathlib.Path, BinaryIO], wall_token: str = "#"
+) -> numpy.ndarray:
+    """Reads a map file, either ASCII or binary (see save_map), into a grid of wall cells indexed [y][x].
+
+    ASCII maps are read line by line into the grid, so neither the file's text nor a wide copy of it is ever
+    held in memory all at once.
+    """
+    f = open(path, "rb") if isinstance(path, (str, pathlib.Path)) else path
+
+    try:
+        head = f.read(HEADER.size)
+
+        if head[: len(MAGIC)] != MAGIC:
+            text = io.TextIOWrapper(io.BufferedReader(_Prepend(head, f)), "utf-8")
+            return parse_map(text, wall_token)
+
+        _, version, width, height = HEADER.unpack(head)
+        if version != VERSION:
+            raise ValueError(f"unsupported map format version {version}")
+
+        bits = numpy.frombuffer(f.read(), dtype=numpy.uint8)
+        return (
+            numpy.unpackbits(bits.reshape(height, -1), axis=1, count=width)
+            .astype(bool)
+            .reshape(height, width)
+        )
+    finally:
+        if f is not path:
+            f.close()
+
+
+def save_map(path: Union[str, pathlib.Path, BinaryIO], grid: numpy.ndarray) -> None:
+    """Writes a grid of wall cells indexed [y][x] as a binary map, one bit per cell."""
+    height, width = grid.shape
+    data = (
+        HEADER.pack(MAGIC, VERSION, width, height)
+        + numpy.packbits(grid, axis=1).tobytes()
+    )
+
+    if isinstance(path, (str, pathlib.Path)):
+        pathlib.Path(path).write_bytes(data)
+    else:
+        path.write(data)
+
+
+def window(grid: numpy.ndarray, bounds: tuple[int, int, int, int]) -> numpy.ndarray:
+    """Copies out the cells of a grid indexed [y][x] over (min x, min y, max x, max y), inclusive.
+
+    Cells beyond the grid are floor.
+    """
+    x0, y0, x1, y1 = bounds
+    height, width = grid.shape
+    cells = numpy.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+
+    left, right = max(x0, 0), min(x1 + 1, width)
+    bottom, top = max(y0, 0), min(y1 + 1, height)
+
+    if left < right and bottom < top:
+        cells[bottom - y0 : top - y0, left - x0 : right - x0] = grid[
+            bottom:top, left:right
+        ]
+
+    return cells
+
+
+class MapFile(object):
+    """A binary map file (see save_map), memory-mapped so that windows of it are read from disk on demand."""
+
+    __slots__ = ("path", "width", "height", "_bits")
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+
+        with open(self.path, "rb") as f:
+            magic, version, self.width, self.height = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} isn't a version {VERSION} binary map")
+
+        self._bits = numpy.memmap(
+            self.path,
+            dtype=numpy.uint8,
+            mode="r",
+            offset=HEADER.size,
+            shape=(self.height, (self.width + 7) // 8),
+        )
+
+    def __call__(self, bounds: tuple[int, int, int, int]) -> numpy.ndarray:
+        """Reads the cells over (min x, min y, max x, max y), inclusive; cells beyond the map are floor."""
+        x0, y0, x1, y1 = bounds
+        bottom, top = max(y0, 0), min(y1 + 1, self.height)
+        left, right = max(x0, 0), min(x1 + 1, self.width)
+
+        if bottom >= top or left >= right:
+            return numpy.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+
+        # only the bytes spanning the window's columns are unpacked
+        first = left // 8
+        rows = numpy.unpackbits(
+            self._bits[bottom:top, first : (right + 7) // 8], axis=1
+        ).astype(bool)
+
+        return window(rows, (x0 - first * 8, y0 - bottom, x1 - first * 8, y1 - bottom))
+
+
+class _Prepend(io.RawIOBase):
+    """A readable stream that gives some bytes already read before the rest of a file."""
+
+    def __init__(self, head: bytes, f: BinaryIO):
+        self.head = head
+        self.f = f
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.head:
+            n = min(len(buffer), len(self.head))
+            buffer[:n], self.head = self.head[:n], self.head[n:]
+            return n
+
+        data = self.f.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def greedy_mesh(grid: numpy.ndarray) -> numpy.ndarray:
+    """Covers the set cells of a grid with disjoint rectangles, as rows of (min x, min y, max x, max y), inclusive.
+
+    Each row's runs of set cells are found at once; runs spanning the same columns in consecutive rows are
+    merged into one rectangle.
+    """
+    height, width = grid.shape
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = grid
+
+    edges = numpy.diff(padded, axis=1)
+    rows, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1] - 1
+
+    rects = []
+    # runs still growing, as (first x, last x) -> (first y, last y)
+    growing = dict()
+
+    for y, x0, x1 in zip(rows.tolist(), starts.tolist(), ends.tolist()):
+        run = growing.get((x0, x1))
+
+        if run is not None and run[1] == y - 1:
+            growing[x0, x1] = (run[0], y)
+            continue
+        if run is not None:
+            rects.append((x0, run[0], x1, run[1]))
+
+        growing[x0, x1] = (y, y)
+
+    rects.extend((x0, y0, x1, y1) for (x0, x1), (y0, y1) in growing.items())
+
+    return numpy.array(rects, dtype=numpy.int64).reshape(-1, 4)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import threading
+from typing import Callable, Iterable, Optional
+
+import discord
+import numpy
+
+from utils.discord.bot import bot
+import utils.discord.emoji
+
+
+class Palette(object):
+    """Interns tile strings as small integer ids, so boards can be composed as arrays of ids.
+
+    Id 0 is reserved for "no tile", which lets lower layers show through. Each tile is condensed for display
+    once; tiles that are custom emojis are condensed again after the emoji comes or goes.
+    """
+
+    __slots__ = (
+        "tiles",
+        "condense",
+        "version",
+        "_ids",
+        "_condensed",
+        "_emojis",
+        "_lock",
+    )
+
+    EMPTY = 0
+
+    def __init__(self, condense: Callable[[str], str] = None):
+        self.tiles = [None]
+        self.condense = condense or utils.discord.emoji.condense
+        # bumped whenever a condensed string is dropped, so that anything built from them can be rebuilt
+        self.version = 0
+
+        self._ids = {None: Palette.EMPTY, "": Palette.EMPTY}
+        self._condensed = dict()
+        self._emojis = dict()
+
+        # dungeons render on worker threads, which mustn't give two new tiles the same id, nor condense a tile
+        # while its emoji is being forgotten on the event loop
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    def id(self, tile: Optional[str]) -> int:
+        """Gets the id of a tile, interning it if it's new."""
+        if (i := self._ids.get(tile)) is None:
+            with self._lock:
+                if (i := self._ids.get(tile)) is None:
+                    self.tiles.append(tile)
+                    i = self._ids[tile] = len(self.tiles) - 1
+        return i
+
+    def condensed(self, i: int) -> str:
+        """Gets the display string of a tile, condensing it the first time."""
+        if (tile := self._condensed.get(i)) is None:
+            with self._lock:
+                if (tile := self._condensed.get(i)) is None:
+                    tile = self._condensed[i] = self.condense(self.tiles[i])
+
+                    if match := utils.discord.emoji.CUSTOM_EMOJI.match(self.tiles[i]):
+                        self._emojis.setdefault(int(match.group(1)), set()).add(i)
+
+        return tile
+
+    def forget(self, emoji_ids: Iterable[int]) -> None:
+        """Drops the condensed strings of tiles made of the given custom emojis."""
+        with self._lock:
+            for emoji_id in emoji_ids:
+                if tiles := self._emojis.pop(emoji_id, None):
+                    self.version += 1
+                for i in tiles or ():
+                    self._condensed.pop(i, None)
+
+    def lookup(
+        self, ids: numpy.ndarray, condensed: bool = False
+    ) -> list[list[Optional[str]]]:
+        """Turns a 2D array of ids back into rows of tiles, or of their display strings."""
+        used, inverse = numpy.unique(ids, return_inverse=True)
+        table = numpy.array(
+            [self.condensed(i) if condensed else self.tiles[i] for i in used],
+            dtype=object,
+        )
+        return table[inverse.reshape(ids.shape)].tolist()
+
+
+def paste(
+    board: numpy.ndarray,
+    bounds: tuple[int, int, int, int],
+    origin: tuple[int, int],
+    ids: numpy.ndarray,
+) -> None:
+    """Copies the tiles of a raster whose lower-left cell is at the origin onto a board spanning the bounds.
+
+    Empty tiles are skipped, so whatever is underneath shows through.
+    """
+    x0, y0, x1, y1 = bounds
+    ox, oy = origin
+    h, w = ids.shape
+
+    left, right = max(ox, x0), min(ox + w, x1 + 1)
+    bottom, top = max(oy, y0), min(oy + h, y1 + 1)
+
+    if left >= right or bottom >= top:
+        return
+
+    tiles = ids[bottom - oy : top - oy, left - ox : right - ox]
+    numpy.copyto(
+        board[bottom - y0 : top - y0, left - x0 : right - x0],
+        tiles,
+        where=tiles != Palette.EMPTY,
+    )
+
+
+# skins are shared between dungeons, so they share one palette
+PALETTE = Palette()
+
+
+@bot.listen("on_guild_emojis_update")
+async def forget_emojis(
+    guild: discord.Guild,
+    before: Iterable[discord.Emoji],
+    after: Iterable[discord.Emoji],
+):
+    """Recondenses tiles whose custom emoji was added or removed."""
+    PALETTE.forget({e.id for e in before} ^ {e.id for e in after})
+
+
+@bot.listen("on_guild_remove")
+async def forget_guild(guild: discord.Guild):
+    """Recondenses tiles whose custom emoji came from a guild the bot left."""
+    PALETTE.forget(e.id for e in guild.emojis)
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import heapq
+import math
+from typing import TYPE_CHECKING, Iterable, Optional
+
+import numpy
+
+from utils.rpg.dungeon.fov import VisibilityMap, stamp
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.piece import Piece
+
+SQRT2 = math.sqrt(2)
+
+# steps between neighbouring cells as (dx, dy, length); diagonal steps may not cut corners
+STEPS = (
+    (1, 0, 1.0),
+    (-1, 0, 1.0),
+    (0, 1, 1.0),
+    (0, -1, 1.0),
+    (1, 1, SQRT2),
+    (1, -1, SQRT2),
+    (-1, 1, SQRT2),
+    (-1, -1, SQRT2),
+)
+
+# searches run on fixed-point lengths so equal paths tie exactly; 1393 / 985 is a convergent of sqrt(2)
+UNIT, DIAGONAL_UNIT = 985, 1393
+
+
+class DistanceField(VisibilityMap):
+    """The cost of the cheapest path from every cell to a target cell, indexed [y][x]; unreachable cells are inf."""
+
+    __slots__ = ("target", "cost")
+
+    def __init__(
+        self,
+        bounds: tuple[int, int, int, int],
+        field: numpy.ndarray,
+        target: tuple[int, int],
+        cost: float = 1.0,
+    ):
+        super().__init__(bounds, field)
+        self.target = target
+        self.cost = cost
+
+    def _at(self, x: int, y: int) -> float:
+        x0, y0, x1, y1 = self.bounds
+        if not (x0 <= x <= x1 and y0 <= y <= y1):
+            return math.inf
+        return float(self.field[y - y0][x - x0])
+
+    def distance(self, cell: Iterable[int]) -> float:
+        """The cost from a cell to the target.
+
+        A blocked cell, e.g. one a piece stands on, costs as much as stepping out of it.
+        """
+        x, y = cell
+        if not math.isinf(d := self._at(x, y)) or (best := self.step(cell)) is None:
+            return d
+        return self._at(*best) + math.hypot(best[0] - x, best[1] - y) * self.cost
+
+    def step(self, cell: Iterable[int]) -> Optional[tuple[int, int]]:
+        """Finds the neighbouring cell to step into to get closer to the target, if any."""
+        x, y = cell
+        best, score = None, math.inf
+
+        for dx, dy, length in STEPS:
+            if (
+                dx
+                and dy
+                and (math.isinf(self._at(x + dx, y)) or math.isinf(self._at(x, y + dy)))
+            ):
+                continue
+            if (d := self._at(x + dx, y + dy) + length * self.cost) < score:
+                best, score = (x + dx, y + dy), d
+
+        if best is None or self._at(*best) >= self._at(x, y):
+            return None
+        return best
+
+    def path(self, cell: Iterable[int]) -> Optional[list[tuple[int, int]]]:
+        """Follows the field downhill from a cell to the target, giving every cell on the way."""
+        cells = [tuple(int(i) for i in cell)]
+
+        while cells[-1] != self.target:
+            if (cell := self.step(cells[-1])) is None:
+                return None
+            cells.append(cell)
+
+        return cells
+
+
+def rasterize_solids(
+    pieces: Iterable[Piece],
+    bounds: tuple[int, int, int, int],
+    ignore: Iterable[Piece] = (),
+) -> numpy.ndarray:
+    """Rasterizes solid pieces into a grid of blocked cells spanning (min x, min y, max x, max y), inclusive.
+
+    Cells a hitbox only partly covers count as blocked.
+    """
+    x0, y0, x1, y1 = bounds
+    grid = numpy.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=bool)
+
+    for obj in pieces:
+        if obj in ignore or not obj.solid:
+            continue
+        stamp(grid, bounds, *obj.raster(exact=False))
+
+    return grid
+
+
+def _flatten(
+    blocked: numpy.ndarray, *open_cells: tuple[int, int]
+) -> tuple[list[bool], int, list[int], list[tuple[int, int, int]]]:
+    """Pads the grid with a blocked border and flattens it, so neighbours are found by adding offsets.
+
+    Gives the flat grid, its row width, the orthogonal steps' offsets and the diagonal steps as
+    (offset, side offset, side offset).
+    """
+    height, width = blocked.shape
+    padded = numpy.ones((height + 2, width + 2), dtype=bool)
+    padded[1:-1, 1:-1] = blocked
+
+    row = width + 2
+    walls = padded.ravel().tolist()
+    for x, y in open_cells:
+        walls[(y + 1) * row + x + 1] = False
+
+    orthogonal = [dx + dy * row for dx, dy, _ in STEPS[:4]]
+    diagonal = [(dx + dy * row, dx, dy * row) for dx, dy, _ in STEPS[4:]]
+
+    return walls, row, orthogonal, diagonal
+
+
+def astar(
+    blocked: numpy.ndarray,
+    start: tuple[int, int],
+    goal: tuple[int, int],
+    limit: float = math.inf,
+) -> Optional[list[tuple[int, int]]]:
+    """Finds the shortest path between two cells (grid indices (x, y)) with A*, giving every cell on the way.
+
+    The start and goal count as open. Returns None if the goal can't be reached within the limit.
+    """
+    height, width = blocked.shape
+    if not all(0 <= x < width and 0 <= y < height for x, y in (start, goal)):
+        return None
+
+    walls, row, orthogonal, diagonal = _flatten(blocked, start, goal)
+
+    source = (start[1] + 1) * row + start[0] + 1
+    target = (goal[1] + 1) * row + goal[0] + 1
+    gy, gx = divmod(target, row)
+
+    # octile distance, in fixed point
+    slant = DIAGONAL_UNIT - UNIT
+
+    def heuristic(j: int) -> int:
+        y, x = divmod(j, row)
+        dx, dy = abs(x - gx), abs(y - gy)
+        return UNIT * dx + slant * dy if dx > dy else UNIT * dy + slant * dx
+
+    limit *= UNIT
+    dist = [math.inf] * len(walls)
+    parent = dict()
+    dist[source] = 0
+    # ties go to the deepest node, so open ground isn't searched breadth-first
+    heap = [(heuristic(source), 0, source)]
+
+    while heap:
+        f, g, i = heapq.heappop(heap)
+        if i == target or f > limit:
+            break
+        if -g > dist[i]:
+            continue
+        g = -g
+
+        d = g + UNIT
+        for offset in orthogonal:
+            j = i + offset
+            if not walls[j] and d < dist[j]:
+                dist[j] = d
+                parent[j] = i
+                heapq.heappush(heap, (d + heuristic(j), -d, j))
+
+        d = g + DIAGONAL_UNIT
+        for offset, side_x, side_y in diagonal:
+            j = i + offset
+            if (
+                not walls[j]
+                and d < dist[j]
+                and not walls[i + side_x]
+                and not walls[i + side_y]
+            ):
+                dist[j] = d
+                parent[j] = i
+                heapq.heappush(heap, (d + heuristic(j), -d, j))
+
+    if i != target or f > limit:
+        return None
+
+    cells = [(gx - 1, gy - 1)]
+    while i != source:
+        i = parent[i]
+        y, x = divmod(i, row)
+        cells.append((x - 1, y - 1))
+
+    return cells[::-1]
+
+
+def dijkstra(
+    blocked: numpy.ndarray,
+    target: tuple[int, int],
+    cost: float = 1.0,
+    limit: float = math.inf,
+) -> numpy.ndarray:
+    """Computes the cost from every cell to a target cell (grid indices (x, y)), indexed [y][x].
+
+    The target counts as open. Cells that are blocked, unreachable or costlier than the limit are inf.
+    Every step is at least one unit long, so the cells within a unit of the nearest unsettled one are
+    settled together, relaxing their neighbours as arrays.
+    """
+    height, width = blocked.shape
+    field = numpy.full((height, width), math.inf)
+
+    if math.isinf(cost) or not (0 <= target[0] < width and 0 <= target[1] < height):
+        return field
+
+    row = width + 2
+    walls = numpy.ones((height + 2, row), dtype=bool)
+    walls[1:-1, 1:-1] = blocked
+    walls = walls.ravel()
+
+    source = (target[1] + 1) * row + target[0] + 1
+    walls[source] = False
+
+    offsets = numpy.array([dx + dy * row for dx, dy, _ in STEPS])
+    sides = numpy.array(
+        [(dx if dy else 0, dy * row if dx else 0) for dx, dy, _ in STEPS]
+    )
+    lengths = numpy.array([UNIT] * 4 + [DIAGONAL_UNIT] * 4, dtype=float)
+    limit = limit / cost * UNIT
+
+    dist = numpy.full(walls.size, math.inf)
+    dist[source] = 0
+    pending = numpy.array([source])
+    bound = UNIT
+
+    while pending.size:
+        settled = dist[pending] < bound
+        if not settled.any():
+            bound = (dist[pending].min() // UNIT + 1) * UNIT
+            continue
+
+        cells = numpy.unique(pending[settled])
+        pending = pending[~settled]
+
+        near = (cells[:, None] + offsets).ravel()
+        d = (dist[cells][:, None] + lengths).ravel()
+        # diagonal steps need both sides open; orthogonal steps check their own cell, which is open
+        ok = (
+            ~walls[near]
+            & (d < dist[near])
+            & (d <= limit)
+            & ~walls[(cells[:, None] + sides[:, 0]).ravel()]
+            & ~walls[(cells[:, None] + sides[:, 1]).ravel()]
+        )
+
+        numpy.minimum.at(dist, near[ok], d[ok])
+        pending = numpy.concatenate((pending, near[ok]))
+        bound += UNIT
+
+    field = dist.reshape(height + 2, row)[1:-1, 1:-1]
+    return field * (cost / UNIT)
+
+
+def waypoints(cells: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Drops the cells in the middle of straight runs, keeping the start, the turns and the end."""
+    if len(cells) <= 2:
+        return list(cells)
+
+    points = [cells[0]]
+
+    for prev, cell, nxt in zip(cells, cells[1:], cells[2:]):
+        if (cell[0] - prev[0], cell[1] - prev[1]) != (
+            nxt[0] - cell[0],
+            nxt[1] - cell[1],
+        ):
+            points.append(cell)
+
+    points.append(cells[-1])
+
+    return points
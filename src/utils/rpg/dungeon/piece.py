@@ -1,23 +1,33 @@
 from __future__ import annotations
 
+import copy
 from enum import Enum, IntFlag
 from functools import reduce
+import itertools
+import math
 from numbers import Number
 from operator import ior
-from queue import PriorityQueue, Queue
-from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+import pathlib
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional, Union
 
 import numpy
 from shapely.affinity import translate
 from shapely.geometry import Point, Polygon, box
 from shapely.geometry.base import BaseGeometry, BaseMultipartGeometry
 from shapely.ops import unary_union
+from shapely.prepared import prep
 
+from utils.rpg import RPGException
+from utils.rpg.dungeon.fov import is_grid_point
+from utils.rpg.dungeon.maps import greedy_mesh, load_map, parse_map
+from utils.rpg.dungeon.palette import PALETTE, Palette, paste
 from utils.rpg.dungeon.ray import Ray, RayTracer
-from utils.rpg.dungeon.skin import DefiniteSkin, Skin
+from utils.rpg.dungeon.skin import DefiniteSkin, ProceduralSkin, Skin, UniformSkin
 
 if TYPE_CHECKING:
     from utils.rpg.dungeon.game import Dungeon, Movement
+    from utils.rpg.dungeon.scheduler import EventQueue, Turn
 
 
 Condition = IntFlag(
@@ -46,6 +56,11 @@ Condition = IntFlag(
 
 Relation = Enum("Relation", ["CHARMED", "FRIGHTENED"])
 
+
+class FrozenPiece(RPGException):
+    """Raised when a template piece is changed, since every dungeon sharing it would see the change."""
+
+
 IMMOBILE = (
     Condition.GRAPPLED
     | Condition.INCAPACITATED
@@ -71,18 +86,68 @@ MovementMode = Enum(
     ],
 )
 
+# how many feet of speed each foot moved costs
+MOVEMENT_COST = {
+    MovementMode.WALKING: 1,
+    MovementMode.JUMPING: 1,
+    MovementMode.CLIMBING: 2,
+    MovementMode.SWIMMING: 2,
+    MovementMode.CRAWLING: 2,
+    MovementMode.FLYING: math.inf,
+    MovementMode.BURROWING: math.inf,
+}
+
+
+class Event(object):
+    """A queued hook call, ordered by distance from the origin and then by creation."""
+
+    __slots__ = ("distance", "order", "piece", "hook", "args", "kwargs", "intersect")
+
+    _counter = itertools.count()
+
+    def __init__(
+        self,
+        distance: Number,
+        piece: Piece,
+        hook: Callable,
+        args: tuple,
+        kwargs: dict,
+        intersect: BaseGeometry,
+    ):
+        self.distance = distance
+        self.order = next(Event._counter)
+        self.piece = piece
+        self.hook = hook
+        self.args = args
+        self.kwargs = kwargs
+        self.intersect = intersect
+
+    def __lt__(self, other: Event) -> bool:
+        return (self.distance, self.order) < (other.distance, other.order)
+
+    def __call__(self, *args, **kwargs):
+        return self.hook(self.piece, *self.args, *args, **self.kwargs, **kwargs)
+
 
 class Piece(object):
+    opaque = False
+    solid = False
+    hooks: dict[str, Callable] = dict()
+
     __slots__ = (
-        "loc",
+        "_loc",
         "speed",
-        "hitbox",
-        "skin",
+        "max_speed",
+        "_hitbox",
+        "_skin",
         "mount",
-        "condition",
+        "initiative",
+        "_condition",
         "psychology",
         "data",
         "raytracer",
+        "dungeon",
+        "frozen",
     )
 
     def __init__(
@@ -93,24 +158,145 @@ class Piece(object):
         hitbox: BaseGeometry = box(-0.5, -0.5, 0.5, 0.5),
         skin: Skin = DefiniteSkin([["*️⃣"]]),
         mount: Optional[Piece] = None,
+        initiative: Number = 0,
         data: Any = None,
     ) -> None:
-        self.loc = numpy.array(loc[:2])
-        self._speed = self.max_speed = self.speed = float(speed)
+        self.dungeon = None
+        self.frozen = False
+        self._condition = 0
+
+        self.loc = loc
+        self.max_speed = self.speed = float(speed)
 
-        self.condition = 0
         self.psychology = {Relation.CHARMED: [], Relation.FRIGHTENED: []}
 
         self.hitbox = hitbox
         self.skin = skin
 
         self.mount = mount
+        self.initiative = initiative
 
         self.data = data
 
     def link(self, dungeon: Dungeon):
+        # templates are shared by many dungeons, so they're never tied to any one of them
+        if self.frozen:
+            return
+
+        self.dungeon = dungeon
         self.raytracer = RayTracer(source=self, dungeon=dungeon)
 
+    def freeze(self) -> Piece:
+        """Makes the piece a template, which dungeons can share read-only."""
+        self.dungeon = None
+        self.frozen = True
+        # in-place arithmetic, e.g. loc += vector, changes the array before the setter could refuse it
+        self._loc.flags.writeable = False
+        return self
+
+    def instance(self, loc: Optional[Iterable[Number]] = None, **state) -> Piece:
+        """A piece of a dungeon's own, sharing a template's geometry and skin, with its own location and state.
+
+        Any other attribute given, e.g. condition, is set on the new piece.
+        """
+        piece = copy.copy(self)
+        piece.frozen = False
+        piece.dungeon = None
+        piece._loc = self._loc.copy()
+        piece.psychology = {Relation.CHARMED: [], Relation.FRIGHTENED: []}
+        piece.mount = None
+
+        if loc is not None:
+            piece.loc = loc
+        for name, value in state.items():
+            setattr(piece, name, value)
+
+        return piece
+
+    def _check_frozen(self, changed: bool = True) -> None:
+        """Refuses to change a template; setting a template's attribute to what it already is, e.g. when a
+        transaction rolls back, is fine."""
+        if changed and getattr(self, "frozen", False):
+            raise FrozenPiece(
+                f"{type(self).__name__} is a template; change an instance of it instead"
+            )
+
+    @property
+    def loc(self) -> numpy.ndarray:
+        return self._loc
+
+    @loc.setter
+    def loc(self, new: Iterable[Number]):
+        new = numpy.array(new[:2], dtype=float)
+        self._check_frozen(not numpy.array_equal(new, getattr(self, "_loc", None)))
+        if getattr(self, "frozen", False):
+            # the location is the same, and the template keeps its read-only array
+            return
+        self._loc = new
+        self._reindex()
+
+    @property
+    def condition(self) -> int:
+        return self._condition
+
+    @condition.setter
+    def condition(self, new: int):
+        if new != self._condition:
+            self._check_frozen()
+            self._condition = new
+            if self.dungeon is not None:
+                self.dungeon.bump()
+
+    @property
+    def skin(self) -> Skin:
+        return self._skin
+
+    @skin.setter
+    def skin(self, new: Skin):
+        self._check_frozen(new is not getattr(self, "_skin", None))
+        self._skin = new
+        if self.dungeon is not None:
+            self.dungeon.bump()
+
+    @property
+    def hitbox(self) -> BaseGeometry:
+        return self._hitbox
+
+    @hitbox.setter
+    def hitbox(self, new: BaseGeometry):
+        self._check_frozen(new is not getattr(self, "_hitbox", None))
+        self._hitbox = new
+        self._reindex()
+
+    def __init_subclass__(cls, **kwargs):
+        """Resolves the hooks of each subclass once, so dispatch is a dictionary lookup."""
+        super().__init_subclass__(**kwargs)
+        cls.hooks = _collect_hooks(cls)
+
+    @property
+    def affects_sight(self) -> bool:
+        return self.opaque or type(self).hooks["sight"] is not Piece.hooks["sight"]
+
+    def _reindex(self):
+        """Keeps the linked dungeon's spatial index and versions in sync with the hitbox."""
+        if self.dungeon is not None:
+            self.dungeon.index.update(self)
+            self.dungeon.bump()
+            if self.affects_sight:
+                self.dungeon.bump_sight()
+
+    def snapshot(self) -> tuple:
+        """Captures the state a movement can change, so that it can be rolled back."""
+        return self._loc.copy(), self.speed, self.condition, self._hitbox
+
+    def restore(self, state: tuple) -> None:
+        loc, self.speed, self.condition, hitbox = state
+
+        if hitbox is not self._hitbox:
+            self.hitbox = hitbox
+        if not numpy.array_equal(loc, self._loc):
+            self.loc = loc
+
     def apply_conditions(self, *conditions: Iterable[Condition]):
         self.condition |= reduce(ior, conditions)
 
@@ -118,64 +304,42 @@ class Piece(object):
         self.condition ^= reduce(ior, conditions)
 
     def on_coincide(self, movement: Movement, mock: bool = True):
-        ...
+        """Called when a movement runs into the piece.
+
+        Mock calls come from previews, and may only change what a Transaction rolls back: the location, speed,
+        condition and hitbox of the pieces involved.
+        """
 
     def on_turn(self, dungeon: Dungeon):
         self.speed = self.max_speed
-        self._speed = self.max_speed
 
-    def on_move(self, movement: Movement, mock: bool = False):
+    def on_move(self, movement: Movement):
         # TODO: check jumping capability with athletics stat
         if self.mount:
-            self.mount.on_move(movement, mock)
+            self.mount.on_move(movement)
             return
 
-        if mock:
-            for enemy in self.psychology[Relation.FRIGHTENED]:
-                new_loc = movement.vector + self.loc
-                if numpy.linalg.norm(new_loc - enemy.loc) < numpy.linalg.norm(
-                    self.loc - enemy.loc
-                ):
-                    self._speed -= float("inf")
-                    return
-
-            if self.condition & IMMOBILE or movement.mode in {
-                MovementMode.BURROWING,
-                MovementMode.FLYING,
-            }:
-                self._speed -= float("inf")
-                return
-            elif movement.mode in {
-                MovementMode.CLIMBING,
-                MovementMode.SWIMMING,
-                MovementMode.CRAWLING,
-            }:
-                self._speed -= 2 * numpy.linalg.norm(movement.vector)
-            else:
-                self._speed -= numpy.linalg.norm(movement.vector)
-        else:
-            if movement.mode == MovementMode.CRAWLING and not (
-                self.condition & Condition.PRONE
+        for enemy in self.psychology[Relation.FRIGHTENED]:
+            new_loc = movement.vector + self.loc
+            if numpy.linalg.norm(new_loc - enemy.loc) < numpy.linalg.norm(
+                self.loc - enemy.loc
             ):
-                self.apply_conditions(Condition.PRONE)
-            elif self.condition & Condition.PRONE:
-                self.unapply_conditions(Condition.PRONE)
-
-            if self.condition & IMMOBILE or movement.mode in {
-                MovementMode.BURROWING,
-                MovementMode.FLYING,
-            }:
                 self.speed -= float("inf")
                 return
-            elif movement.mode in {
-                MovementMode.CLIMBING,
-                MovementMode.SWIMMING,
-                MovementMode.CRAWLING,
-            }:
-                self.speed -= 2 * numpy.linalg.norm(movement.vector)
-            else:
-                self.loc += movement.vector
-                self.speed -= numpy.linalg.norm(movement.vector)
+
+        if movement.mode == MovementMode.CRAWLING and not (
+            self.condition & Condition.PRONE
+        ):
+            self.apply_conditions(Condition.PRONE)
+        elif self.condition & Condition.PRONE:
+            self.unapply_conditions(Condition.PRONE)
+
+        if self.condition & IMMOBILE or math.isinf(MOVEMENT_COST[movement.mode]):
+            self.speed -= float("inf")
+            return
+
+        self.loc += movement.vector
+        self.speed -= MOVEMENT_COST[movement.mode] * numpy.linalg.norm(movement.vector)
 
     def on_sight(self, intersect: BaseGeometry, ray: Ray):
         ...
@@ -184,8 +348,93 @@ class Piece(object):
     def true_hitbox(self):
         return translate(self.hitbox, *self.loc)
 
+    @property
+    def true_bounds(self) -> Optional[tuple[float, float, float, float]]:
+        """The bounds of the true hitbox, or None if it's empty."""
+        hitbox = self.true_hitbox
+        return None if hitbox.is_empty else hitbox.bounds
+
+    def hitbox_near(self, geometry: BaseGeometry) -> BaseGeometry:
+        """The part of the true hitbox that a geometry can touch; pieces with huge hitboxes give less than all."""
+        return self.true_hitbox
+
+    def raster(
+        self, exact: bool = True
+    ) -> Optional[tuple[tuple[int, int], numpy.ndarray]]:
+        """Rasterizes the hitbox onto the unit grid, giving the lower-left cell and an occupancy mask.
+
+        Returns None if the hitbox isn't made up of whole grid cells, unless an inexact
+        raster is asked for, in which case every cell the hitbox overlaps is marked.
+        """
+        hitbox = self.true_hitbox
+
+        if hitbox.is_empty:
+            return (0, 0), numpy.zeros((0, 0), dtype=bool)
+
+        if not exact:
+            min_x, min_y, max_x, max_y = hitbox.bounds
+
+            x, y = math.floor(min_x - 0.5) + 1, math.floor(min_y - 0.5) + 1
+            w = max(math.ceil(max_x + 0.5) - x, 0)
+            h = max(math.ceil(max_y + 0.5) - y, 0)
+
+            if math.isclose(hitbox.area, (max_x - min_x) * (max_y - min_y)):
+                return (x, y), numpy.ones((h, w), dtype=bool)
+
+            mask = numpy.zeros((h, w), dtype=bool)
+
+            for row in range(h):
+                for col in range(w):
+                    cell = box(
+                        x + col - 0.5, y + row - 0.5, x + col + 0.5, y + row + 0.5
+                    )
+                    mask[row][col] = cell.intersects(hitbox) and not cell.touches(
+                        hitbox
+                    )
+
+            return (x, y), mask
+
+        min_x, min_y, max_x, max_y = (i + 0.5 for i in hitbox.bounds)
+
+        if not is_grid_point((min_x, min_y, max_x, max_y)):
+            return None
+
+        x, y = int(min_x), int(min_y)
+        w, h = int(max_x) - x, int(max_y) - y
+
+        if math.isclose(hitbox.area, w * h):
+            return (x, y), numpy.ones((h, w), dtype=bool)
+
+        mask = numpy.zeros((h, w), dtype=bool)
+
+        for row in range(h):
+            for col in range(w):
+                area = hitbox.intersection(
+                    box(x + col - 0.5, y + row - 0.5, x + col + 0.5, y + row + 0.5)
+                ).area
+                if math.isclose(area, 1):
+                    mask[row][col] = True
+                elif not math.isclose(area, 0, abs_tol=1e-9):
+                    return None
+
+        return (x, y), mask
+
     def move_hitbox(self, movement: Movement):
-        coords = list(self.true_hitbox.exterior.coords)
+        """Builds the area swept by the hitbox's boundary; use Movement.swept to avoid rebuilding it."""
+        start = self.true_hitbox
+
+        # for convex hitboxes, the boundary sweeps the hull except where the start and end overlap
+        if (
+            isinstance(start, Polygon)
+            and not start.is_empty
+            and math.isclose(start.area, start.convex_hull.area)
+        ):
+            end = translate(start, *movement.vector)
+            return unary_union([start, end]).convex_hull.difference(
+                start.intersection(end)
+            )
+
+        coords = list(start.exterior.coords)
         pairs = [numpy.array([x, y]) for x, y in zip(coords, coords[1:])]
 
         def gen_quad(pair, vector):
@@ -200,106 +449,225 @@ class Piece(object):
 
     def process_kinesis(
         self,
-        hook_queue: Queue,
+        hook_queue: Union[EventQueue, Turn],
         ray_box: BaseGeometry,
         origin: Iterable[Number],
         hook: str,
         *args,
         **kwargs,
     ):
+        """Queues a hook call for each part of the intersection, nearest to the origin first."""
+        intersect = ray_box.intersection(self.hitbox_near(ray_box))
+
+        if intersect.is_empty:
+            return
+
         origin = Point(origin[:2])
-        hook = eval(f"self.on_{hook}")
-
-        if is_priority := isinstance(hook_queue, PriorityQueue):
-            _queue = hook_queue
-        else:
-            _queue = PriorityQueue()
-
-        intersect = ray_box.intersection(self.true_hitbox)
-        if isinstance(intersect, BaseMultipartGeometry):
-            for shape in intersect.geoms:
-                _queue.put(
-                    (
-                        origin.distance(shape),
-                        lambda *_args, **_kwargs: hook(
-                            *args, *_args, **kwargs, **_kwargs
-                        ),
-                        shape,
-                    )
-                )
-        elif not intersect.is_empty:
-            _queue.put(
-                (
-                    origin.distance(intersect),
-                    lambda *_args, **_kwargs: hook(*args, *_args, **kwargs, **_kwargs),
-                    intersect,
-                )
+        hook = type(self).hooks[hook]
+
+        events = [
+            Event(origin.distance(shape), self, hook, args, kwargs, shape)
+            for shape in (
+                intersect.geoms
+                if isinstance(intersect, BaseMultipartGeometry)
+                else (intersect,)
             )
+        ]
 
-        if not is_priority:
-            while _queue.qsize() != 0:
-                hook_queue.put(_queue.get()[1])
+        for event in sorted(events):
+            hook_queue.put(event)
+
+
+def _collect_hooks(cls: type) -> dict[str, Callable]:
+    return {
+        name[len("on_") :]: getattr(cls, name)
+        for name in dir(cls)
+        if name.startswith("on_") and callable(getattr(cls, name))
+    }
+
+
+Piece.hooks = _collect_hooks(Piece)
 
 
 class MergedPiece(Piece):
     def __init__(self, pieces: Iterable[Piece], *args, **kwargs):
-        """Creates a single piece which simulates multiple pieces. Keep in mind that hooks are overwritten."""
+        """Creates a single piece which simulates multiple pieces. Keep in mind that hooks are overwritten.
+
+        The pieces' locations are offsets from the merged piece, and earlier pieces are drawn over later ones.
+        """
         super().__init__(*args, **kwargs)
 
-        self._pieces = [
-            Piece(x=p.loc[0], y=p.loc[1], hitbox=p.hitbox, skin=p.skin) for p in pieces
-        ]
+        self._pieces = [Piece(p.loc, hitbox=p.hitbox, skin=p.skin) for p in pieces]
 
-        self.skin = Skin()
+        self.skin = _merge_skins(self._pieces)
+        self.hitbox = unary_union([piece.true_hitbox for piece in self._pieces])
 
-        def get_tile(x, y):
-            for piece in self._pieces:
-                if tile := piece.skin.get_index(x - piece.loc[0], y - piece.loc[1]):
-                    return tile
-            return None
 
-        self.skin.get_index = get_tile
+def _merge_skins(pieces: list[Piece]) -> Skin:
+    """Composes the skins of pieces on grid points into one DefiniteSkin with real bounds.
 
-        # bounds should be overridden for further optimization; they're boundless by default because i cba to figure out a good algorithm.
-        self.skin.get_bounds = lambda: False
+    Pieces off the grid or with boundless skins can't be composed, and are looked up one by one instead.
+    """
+    rasters = []
 
-        self.hitbox = unary_union([piece.true_hitbox for piece in self._pieces])
+    for piece in reversed(pieces):
+        if not is_grid_point(piece.loc) or (raster := piece.skin.raster()) is None:
+            break
+
+        (sx, sy), ids = raster
+        x, y = (int(i) for i in piece.loc)
+        rasters.append(((x + sx, y + sy), ids))
+    else:
+        x0 = min((o[0] for o, _ in rasters), default=0)
+        y0 = min((o[1] for o, _ in rasters), default=0)
+        x1 = max((o[0] + ids.shape[1] for o, ids in rasters), default=0)
+        y1 = max((o[1] + ids.shape[0] for o, ids in rasters), default=0)
+
+        composite = numpy.zeros((y1 - y0, x1 - x0), dtype=numpy.int32)
+        for origin, ids in rasters:
+            paste(composite, (x0, y0, x1 - 1, y1 - 1), origin, ids)
+
+        return DefiniteSkin.from_ids(composite, (x0, y0))
+
+    skin = Skin()
+
+    def get_tile(x, y):
+        for piece in pieces:
+            if tile := piece.skin.get_index(x - piece.loc[0], y - piece.loc[1]):
+                return tile
+        return None
+
+    skin.get_index = get_tile
+    skin.get_bounds = lambda: False
+
+    return skin
 
 
 class Wall(Piece):
+    opaque = True
+    solid = True
+
     def on_coincide(self, movement: Movement, mock: bool = True):
-        if mock:
-            movement.piece._speed -= float("inf")
-        else:
-            movement.piece.speed -= float("inf")
+        # blocking only spends speed, which previews roll back, so mock collisions block the same way
+        movement.piece.speed -= float("inf")
 
     def on_sight(self, intersect: BaseGeometry, ray: Ray):
         ray.intensity -= float("inf")
 
 
+_geometry_lock = threading.Lock()
+
+
 class MergedWalls(Wall):
     def __init__(
-        self, walls: str, wall_token: str = "#", skin: str = "⬜", *args, **kwargs
+        self,
+        walls: Union[str, numpy.ndarray],
+        wall_token: str = "#",
+        skin: str = "⬜",
+        *args,
+        **kwargs,
     ):
-        """Creates a piece that simulates many individual walls."""
-        self._skin = []
-        self._hb = []
-
-        for i, row in enumerate(walls.split()):
-            self._skin.append([])
-            for j, tile in enumerate(row):
-                if tile == wall_token:
-                    self._skin[i].append(skin)
-                    self._hb.append(box(-0.5 + j, -0.5 - i, 0.5 + j, 0.5 - i))
-                else:
-                    self._skin[i].append(None)
+        """Creates a piece that simulates many individual walls.
+
+        The walls are given as an ASCII map, top row first, or as a grid of wall cells indexed [y][x], e.g.
+        from load_map. They're merged into rectangles; the hitbox is built from those only when it's asked
+        for, since collisions and rays only look at the rectangles near them.
+        """
+        if isinstance(walls, str):
+            walls = parse_map([walls], wall_token)
+
+        self.grid = numpy.asarray(walls, dtype=bool)
+        self.rects = greedy_mesh(self.grid)
+        # the hitbox, built on demand; the dict is shared with instances, which have the same rectangles
+        self._geometry = dict()
 
         super().__init__(*args, **kwargs)
 
-        self.skin = DefiniteSkin(self._skin)
-        self.hitbox = translate(unary_union(self._hb), 0, i)
+        self.skin = DefiniteSkin.from_ids(
+            numpy.where(self.grid, PALETTE.id(skin), Palette.EMPTY)
+        )
+
+    @classmethod
+    def load(
+        cls, path: Union[str, pathlib.Path], wall_token: str = "#", *args, **kwargs
+    ) -> MergedWalls:
+        """Creates walls from an ASCII or binary map file."""
+        return cls(load_map(path, wall_token), wall_token, *args, **kwargs)
 
-        del self._skin, self._hb
+    def freeze(self) -> MergedWalls:
+        self.grid.flags.writeable = False
+        self.rects.flags.writeable = False
+        return super().freeze()
+
+    @property
+    def hitbox(self) -> BaseGeometry:
+        if (hitbox := self._geometry.get("hitbox")) is None:
+            # instances in dungeons on other worker threads may be asking for it too
+            with _geometry_lock:
+                if (hitbox := self._geometry.get("hitbox")) is None:
+                    hitbox = self._geometry["hitbox"] = self._union(
+                        self.rects.tolist(), (0, 0)
+                    )
+        return hitbox
+
+    @hitbox.setter
+    def hitbox(self, new: BaseGeometry):
+        # the hitbox always follows the grid
+        self._check_frozen(new is not getattr(self, "_hitbox", None))
+        self._hitbox = None
+        self._reindex()
+
+    @property
+    def true_bounds(self) -> Optional[tuple[float, float, float, float]]:
+        if not len(self.rects):
+            return None
+
+        x, y = self.loc
+        return (
+            x + self.rects[:, 0].min() - 0.5,
+            y + self.rects[:, 1].min() - 0.5,
+            x + self.rects[:, 2].max() + 0.5,
+            y + self.rects[:, 3].max() + 0.5,
+        )
+
+    def hitbox_near(self, geometry: BaseGeometry) -> BaseGeometry:
+        x, y = self.loc
+        min_x, min_y, max_x, max_y = geometry.bounds
+        rects = self.rects[
+            (self.rects[:, 0] - 0.5 + x <= max_x)
+            & (self.rects[:, 2] + 0.5 + x >= min_x)
+            & (self.rects[:, 1] - 0.5 + y <= max_y)
+            & (self.rects[:, 3] + 0.5 + y >= min_y)
+        ]
+
+        # the union of the rectangles the geometry touches agrees with the whole hitbox where it matters
+        if len(rects) > 1:
+            prepared = prep(geometry)
+            rects = [
+                rect
+                for rect in rects.tolist()
+                if prepared.intersects(self._union([rect], (x, y)))
+            ]
+
+        return self._union(rects, (x, y))
+
+    @staticmethod
+    def _union(
+        rects: Iterable[Iterable[int]], offset: Iterable[Number]
+    ) -> BaseGeometry:
+        x, y = offset
+        boxes = [
+            box(x0 - 0.5 + x, y0 - 0.5 + y, x1 + 0.5 + x, y1 + 0.5 + y)
+            for x0, y0, x1, y1 in rects
+        ]
+        return boxes[0] if len(boxes) == 1 else unary_union(boxes)
+
+    def raster(
+        self, exact: bool = True
+    ) -> Optional[tuple[tuple[int, int], numpy.ndarray]]:
+        if not is_grid_point(self.loc):
+            return None if exact else super().raster(exact)
+        return tuple(int(i) for i in self.loc), self.grid
 
 
 class Surface(Piece):
@@ -310,25 +678,35 @@ class Surface(Piece):
 
 
 class Being(Piece):
+    solid = True
+    # geometries are immutable, so every being shares one body, which snapshots store once
+    body = Point(0, 0).buffer(0.125)
+
     def __init__(self, *args, **kwargs):
         kwargs.update(zip(super().__init__.__code__.co_varnames, args))
-        kwargs |= {"hitbox": Point(0, 0).buffer(0.125)}
+        kwargs |= {"hitbox": self.body}
         super().__init__(**kwargs)
 
     def on_coincide(self, movement: Movement, mock: bool = True):
-        if mock:
-            movement.piece._speed -= float("inf")
-        else:
-            movement.piece.speed -= float("inf")
+        # blocking only spends speed, which previews roll back, so mock collisions block the same way
+        movement.piece.speed -= float("inf")
 
 
 class Plane(Piece):
-    def __init__(self, skin_alg: Callable, *args, **kwargs):
+    def __init__(
+        self,
+        skin_alg: Callable,
+        *args,
+        vectorized: bool = False,
+        deterministic: bool = False,
+        **kwargs,
+    ):
+        """Creates an infinite non-colliding piece whose skin is computed by skin_alg; see ProceduralSkin."""
         kwargs.update(zip(super().__init__.__code__.co_varnames, args))
 
-        skin = Skin()
-        skin.get_bounds = lambda: False
-        skin.get_index = skin_alg
+        skin = ProceduralSkin(
+            skin_alg, vectorized=vectorized, deterministic=deterministic
+        )
 
         kwargs |= {"hitbox": Polygon(), "skin": skin}
         super().__init__(**kwargs)
@@ -338,3 +716,5 @@ class BoringPlane(Plane):
     def __init__(self, skin: str, *args, **kwargs):
         """Creates an infinite non-colliding piece with a uniform skin."""
         super().__init__(skin_alg=lambda *_: skin, *args, **kwargs)
+
+        self.skin = UniformSkin(skin)
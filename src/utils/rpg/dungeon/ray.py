@@ -2,18 +2,27 @@ from __future__ import annotations
 
 from enum import Enum
 from numbers import Number
-import queue
 from typing import TYPE_CHECKING, Iterable
 
 import numpy
 from shapely.geometry import LineString, Point
 from shapely.ops import nearest_points
 
+from utils.rpg.dungeon.fov import (
+    CornerTable,
+    VisibilityMap,
+    is_grid_point,
+    rasterize,
+    shadowcast,
+)
+from utils.rpg.dungeon.scheduler import EventQueue
+
 if TYPE_CHECKING:
     from utils.rpg.dungeon.game import Dungeon
     from utils.rpg.dungeon.piece import Piece
 
 CameraBehavior = Enum("CameraBehavior", ["FOLLOW", "DETACH", "SNAP"])
+FieldOfView = Enum("FieldOfView", ["SHADOWCAST", "RAYCAST"])
 
 
 class Ray(object):
@@ -39,36 +48,32 @@ class Ray(object):
         self.ignore = ignore
 
     def trace(self):
-        collisions = queue.PriorityQueue()
+        collisions = EventQueue()
 
-        for layer in self.dungeon.pieces:
-            for obj in layer:
-                if obj in self.ignore:
-                    continue
-                obj.process_kinesis(
-                    collisions, self.hitbox, self.start, "sight", ray=self
-                )
+        for obj in self.dungeon.query(self.hitbox.bounds):
+            if obj in self.ignore:
+                continue
+            obj.process_kinesis(collisions, self.hitbox, self.start, "sight", ray=self)
 
         while collisions.qsize() != 0:
             collision = collisions.get()
-            collision[1](intersect=collision[2])
+            collision(intersect=collision.intersect)
 
             if self.intensity < 0:
-                return nearest_points(collision[2], Point(self.start))[0]
+                return nearest_points(collision.intersect, Point(self.start))[0]
 
         return Point(self.end)
 
 
 class RayTracer(object):
-    __slots__ = ("source", "dungeon", "_traced")
-    corners = numpy.array(((0.5, 0.5), (0.5, -0.5), (-0.5, 0.5), (-0.5, -0.5)))
+    __slots__ = ("source", "dungeon")
+    # corner offsets of a cell, in units of the corner lattice
+    corners = ((1, 1), (1, 0), (0, 1), (0, 0))
 
     def __init__(self, dungeon: Dungeon, source: Piece) -> None:
         self.source = source
         self.dungeon = dungeon
 
-        self._traced = dict()
-
     @property
     def origin(self):
         return self.dungeon.render_origin
@@ -85,43 +90,131 @@ class RayTracer(object):
     def dy(self):
         return self.size[1] // 2
 
+    @property
+    def bounds(self) -> tuple[int, int, int, int]:
+        """The cells covered by the viewport, as (min x, min y, max x, max y), inclusive."""
+        x0, y0 = (int(i) for i in self.origin)
+        x0, y0 = x0 - self.dx, y0 - self.dy
+        return x0, y0, x0 + self.size[0] - 1, y0 + self.size[1] - 1
+
+    @property
+    def region(self) -> tuple[int, int, int, int]:
+        """The cells worth shadowcasting: the viewport padded by half its size, so small pans hit the cache."""
+        x0, y0, x1, y1 = self.bounds
+        sx, sy = (int(i) for i in self.source.loc)
+        return (
+            min(x0 - self.dx, sx),
+            min(y0 - self.dy, sy),
+            max(x1 + self.dx, sx),
+            max(y1 + self.dy, sy),
+        )
+
+    def cache_key(self, kind: str) -> tuple:
+        """Key for the dungeon's visibility cache; only sight-affecting viewers are told apart."""
+        return (
+            self.dungeon.sight_version,
+            kind,
+            tuple(float(i) for i in self.source.loc),
+            self.source if self.source.affects_sight else None,
+        )
+
     def clear_cache(self):
-        self._traced.clear()
+        self.dungeon.visibility.clear()
 
     def trace(self):
-        field = numpy.zeros(self.size[2::-1], dtype=bool)
-
-        for i in range(self.size[1]):
-            for j in range(self.size[0]):
-                goal = numpy.array(
-                    (self.origin[0] + j - self.dx, self.origin[1] + i - self.dy)
+        """Computes which cells of the viewport the source can see."""
+        if self.dungeon.fov == FieldOfView.SHADOWCAST:
+            field = self.shadowcast()
+            if field is not None:
+                return field
+
+        return self.raycast()
+
+    def shadowcast(self):
+        """Computes the field of view over the occupancy grid; returns None if the dungeon can't be gridded."""
+        if not is_grid_point(self.source.loc):
+            return None
+
+        bounds = self.bounds
+        key = self.cache_key("shadowcast")
+
+        if (seen := self.dungeon.visibility.get(key, bounds)) is None:
+            region = self.region
+
+            if (old := self.dungeon.visibility.peek(key)) is not None:
+                region = old.union(region)
+
+            if self.source.affects_sight:
+                grid = rasterize(
+                    self.dungeon.query(
+                        (
+                            region[0] - 0.5,
+                            region[1] - 0.5,
+                            region[2] + 0.5,
+                            region[3] + 0.5,
+                        )
+                    ),
+                    region,
+                    ignore=(self.source,),
                 )
+            else:
+                grid = self.dungeon.occupancy(region)
+
+            if grid is None:
+                return None
+
+            sx, sy = (int(i) for i in self.source.loc)
+            seen = VisibilityMap(
+                region, shadowcast(grid, (sx - region[0], sy - region[1]))
+            )
+            self.dungeon.visibility.put(key, seen)
 
-                for corner in RayTracer.corners:
-                    destination = goal + corner
-
-                    dest_rep = tuple(int(i) for i in destination)
-
-                    if dest_rep in self._traced:
-                        if self._traced[dest_rep]:
-                            field[i][j] = True
-                            break
-                        continue
-
-                    r = Ray(
-                        self.source.loc,
-                        destination,
-                        1,
-                        self.dungeon,
-                        ignore=(self.source,),
-                    )
-                    end = r.trace()
-
-                    if Point(destination).distance(Point(end)) <= 0.1:
-                        field[i][j] = True
-                        self._traced[dest_rep] = True
+        return seen.window(bounds)
+
+    def raycast(self):
+        """Computes the field of view by casting rays towards the corners of each cell.
+
+        Corners are memoized on the lattice of half-integer points, so each is traced at most once.
+        """
+        x0, y0, x1, y1 = self.bounds
+        corner_bounds = (x0, y0, x1 + 1, y1 + 1)
+
+        key = self.cache_key("raycast")
+        if (corners := self.dungeon.visibility.get(key, corner_bounds)) is None:
+            if (old := self.dungeon.visibility.peek(key)) is None:
+                corners = CornerTable(corner_bounds)
+            else:
+                corners = old.resized(old.union(corner_bounds))
+            self.dungeon.visibility.put(key, corners)
+
+        table = corners.field
+        cx, cy = corners.bounds[:2]
+
+        for y in range(y0 - cy, y1 - cy + 1):
+            for x in range(x0 - cx, x1 - cx + 1):
+                cell = [(y + dy, x + dx) for dx, dy in RayTracer.corners]
+
+                if any(table[i][j] == CornerTable.VISIBLE for i, j in cell):
+                    continue
+
+                for i, j in cell:
+                    if table[i][j] == CornerTable.UNKNOWN:
+                        table[i][j] = self.trace_corner((j + cx - 0.5, i + cy - 0.5))
+                    if table[i][j] == CornerTable.VISIBLE:
                         break
 
-                    self._traced[dest_rep] = False
+        seen = corners.window(corner_bounds) == CornerTable.VISIBLE
+
+        return numpy.stack(
+            (seen[1:, 1:], seen[:-1, 1:], seen[1:, :-1], seen[:-1, :-1])
+        ).any(axis=0)
+
+    def trace_corner(self, destination: Iterable[Number]) -> int:
+        """Casts a ray towards a point, checking whether it arrives."""
+        end = Ray(
+            self.source.loc, destination, 1, self.dungeon, ignore=(self.source,)
+        ).trace()
 
-        return field
+        if Point(destination).distance(end) <= 0.1:
+            return CornerTable.VISIBLE
+        return CornerTable.HIDDEN
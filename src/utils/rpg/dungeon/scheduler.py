@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from collections import deque
+import heapq
+import itertools
+from numbers import Number
+from queue import Empty
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+import utils.rpg.dungeon.piece
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.game import Dungeon
+    from utils.rpg.dungeon.piece import Piece
+
+
+class EventQueue(object):
+    """Heap-backed priority queue; items of equal priority come out in the order they were put.
+
+    The dungeon runs inside the event loop, so unlike queue.PriorityQueue, this takes no locks.
+    """
+
+    __slots__ = ("_heap", "_counter")
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+    def empty(self) -> bool:
+        return not self._heap
+
+    def put(self, item: Any, priority: Any = None) -> None:
+        """Puts an item, using the item itself as its priority if none is given."""
+        heapq.heappush(
+            self._heap,
+            (item if priority is None else priority, next(self._counter), item),
+        )
+
+    def get(self) -> Any:
+        """Pops the item with the lowest priority."""
+        if not self._heap:
+            raise Empty
+        return heapq.heappop(self._heap)[2]
+
+
+class Turn(object):
+    """The actions queued during a piece's turn, done first in, first out."""
+
+    __slots__ = ("focus", "initiative", "_actions")
+
+    def __init__(self, focus: Piece = None, initiative: Optional[Number] = None):
+        self.focus = focus
+        self.initiative = (
+            initiative if initiative is not None else getattr(focus, "initiative", 0)
+        )
+
+        self._actions = deque()
+
+    def qsize(self) -> int:
+        return len(self._actions)
+
+    def empty(self) -> bool:
+        return not self._actions
+
+    def put(self, action: Callable) -> None:
+        self._actions.append(action)
+
+    def get(self) -> Callable:
+        if not self._actions:
+            raise Empty
+        return self._actions.popleft()
+
+    def do_next(self, *args, **kwargs):
+        """Does the next action in the turn."""
+        self.get()(*args, **kwargs)
+
+
+class TurnManager(object):
+    """Rotates turns by round, then by initiative (highest first), then by the order they joined."""
+
+    __slots__ = ("turn", "dungeon", "round", "_heap", "_entries", "_counter")
+
+    def __init__(self, dungeon: Dungeon):
+        self.turn = None
+        self.dungeon = dungeon
+
+        self.round = 0
+
+        self._heap = []
+        self._entries = dict()
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(map(len, self._entries.values()))
+
+    def qsize(self) -> int:
+        return len(self)
+
+    def empty(self) -> bool:
+        return not self._entries
+
+    def put(self, turn: Turn, *, round: Optional[int] = None):
+        """Puts a new turn, advancing to that turn if no turn is present."""
+        entry = [
+            self.round if round is None else round,
+            -turn.initiative,
+            next(self._counter),
+            turn,
+        ]
+        heapq.heappush(self._heap, entry)
+        self._entries.setdefault(turn.focus, []).append(entry)
+
+        if self.turn is None:
+            self.turn = self.next_turn()
+
+    def remove(self, piece: Piece) -> None:
+        """Drops every pending turn of a piece, e.g. when it dies or leaves the dungeon."""
+        for entry in self._entries.pop(piece, ()):
+            entry[-1] = None
+
+    def get(self) -> Turn:
+        """Pops the next pending turn."""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if (turn := entry[-1]) is None:
+                continue
+
+            entries = self._entries[turn.focus]
+            entries.remove(entry)
+            if not entries:
+                del self._entries[turn.focus]
+
+            self.round = entry[0]
+            return turn
+
+        raise Empty
+
+    def next_turn(self):
+        """Advances to the next turn, putting a turn with the same focus into the next round."""
+        if self.empty() and not self.turn:
+            raise Empty
+        elif self.turn is not None:
+            focus = self.turn.focus
+
+            focus.on_turn(self.dungeon)
+            if not (focus.condition & utils.rpg.dungeon.piece.Condition.DEAD):
+                self.put(Turn(focus, self.turn.initiative), round=self.round + 1)
+
+        self.turn = self.get()
+        return self.turn
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+import contextlib
+import functools
+from numbers import Number
+import os
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Iterable, Optional
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.game import Dungeon, Movement
+    from utils.rpg.dungeon.piece import Piece
+
+
+class DungeonService(object):
+    """Runs dungeon simulation and rendering on worker threads, so a slow render doesn't stall the event loop.
+
+    Threads rather than processes are used since dungeons are full of callables and shapely geometry, and
+    shapely and numpy release the GIL for the heavy parts. Calls on the same dungeon run one at a time, in
+    the order they were made; calls on different dungeons run side by side.
+    """
+
+    __slots__ = ("executor", "_locks")
+
+    def __init__(
+        self, workers: Optional[int] = None, executor: Optional[Executor] = None
+    ):
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=workers or min(4, os.cpu_count() or 1),
+            thread_name_prefix="dungeon",
+        )
+
+        # dungeon -> its lock and how many calls are holding or waiting for it
+        self._locks = dict()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, dungeon: Dungeon) -> AsyncIterator[None]:
+        """Keeps any other call from touching the dungeon, e.g. while it's being snapshotted."""
+        entry = self._locks.setdefault(dungeon, [asyncio.Lock(), 0])
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[dungeon]
+
+    async def call(self, dungeon: Dungeon, function: Callable, *args, **kwargs) -> Any:
+        """Runs a function on a worker while holding the dungeon."""
+        async with self.hold(dungeon):
+            return await self.run(function, *args, **kwargs)
+
+    async def run(self, function: Callable, *args, **kwargs) -> Any:
+        """Runs a function on a worker; the caller must already be holding any dungeon it touches."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def move(self, dungeon: Dungeon, movement: Movement) -> None:
+        await self.call(dungeon, dungeon.move, movement)
+
+    async def move_to(
+        self, dungeon: Dungeon, piece: Piece, goal: Iterable[Number], **kwargs
+    ) -> None:
+        await self.call(dungeon, dungeon.move_to, piece, goal, **kwargs)
+
+    async def start_turn(self, dungeon: Dungeon) -> None:
+        await self.call(dungeon, dungeon.start_turn)
+
+    async def resolve_turn(self, dungeon: Dungeon) -> None:
+        await self.call(dungeon, dungeon.resolve_turn)
+
+    async def render_str(self, dungeon: Dungeon) -> str:
+        return await self.call(dungeon, lambda: dungeon.render_str)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict
+import contextlib
+import pathlib
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Hashable,
+    Optional,
+    Union,
+)
+
+from utils.rpg.dungeon import snapshot
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.game import Dungeon
+    from utils.rpg.dungeon.service import DungeonService
+
+
+class DiskStore(object):
+    """Keeps spilled sessions as snapshot files in a directory."""
+
+    __slots__ = ("path",)
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, key: Hashable) -> pathlib.Path:
+        return self.path / f"{key}.hdgn"
+
+    async def save(self, key: Hashable, data: bytes) -> None:
+        self._file(key).write_bytes(data)
+
+    async def load(self, key: Hashable) -> Optional[bytes]:
+        try:
+            return self._file(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    async def delete(self, key: Hashable) -> None:
+        self._file(key).unlink(missing_ok=True)
+
+
+class MongoStore(object):
+    """Keeps spilled sessions as snapshot documents in a Mongo collection, e.g. bot.db.sessions."""
+
+    __slots__ = ("collection",)
+
+    def __init__(self, collection: Any):
+        self.collection = collection
+
+    async def save(self, key: Hashable, data: bytes) -> None:
+        await self.collection.replace_one(
+            {"_id": key}, {"_id": key, "snapshot": data}, upsert=True
+        )
+
+    async def load(self, key: Hashable) -> Optional[bytes]:
+        document = await self.collection.find_one({"_id": key})
+        return None if document is None else document["snapshot"]
+
+    async def delete(self, key: Hashable) -> None:
+        await self.collection.delete_one({"_id": key})
+
+
+class _Session(object):
+    __slots__ = ("dungeon", "used", "users", "size", "version")
+
+    def __init__(self, dungeon: Dungeon, used: float):
+        self.dungeon = dungeon
+        self.used = used
+
+        # commands holding the session through use(), which is never spilled while they do
+        self.users = 0
+
+        # the size is estimated again only once the dungeon has changed
+        self.size = 0
+        self.version = None
+
+
+class SessionManager(object):
+    """Keeps live dungeons by key, e.g. user id, within a memory budget.
+
+    Sessions idle for longer than the TTL, and the least recently used sessions once the live ones take more
+    than the budget, are spilled to the store as snapshots and taken out of memory; they're restored the next
+    time they're asked for. A session's size is an estimate of its snapshot's, from the pieces' arrays, so
+    layers shared through the library don't count towards it.
+
+    Given the service that runs the dungeons, sessions are measured and snapshotted through it, so they're
+    never caught halfway through a move. Sessions held through use() aren't spilled at all.
+    """
+
+    __slots__ = (
+        "store",
+        "library",
+        "service",
+        "budget",
+        "ttl",
+        "clock",
+        "hits",
+        "misses",
+        "rehydrations",
+        "spills",
+        "_sessions",
+        "_loading",
+        "_spilling",
+    )
+
+    def __init__(
+        self,
+        store: Union[DiskStore, MongoStore],
+        *,
+        library: Optional[snapshot.Library] = None,
+        service: Optional[DungeonService] = None,
+        budget: int = 64 * 2 ** 20,
+        ttl: float = 30 * 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.store = store
+        self.library = library
+        self.service = service
+        self.budget = budget
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.rehydrations = 0
+        self.spills = 0
+
+        # key -> live session; least recently used first
+        self._sessions = OrderedDict()
+        self._loading = dict()
+        # key -> set once the session has been spilled, or failed to be
+        self._spilling = dict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._sessions
+
+    @property
+    def size(self) -> int:
+        """The bytes taken by the live sessions, as of when each was last measured."""
+        return sum(session.size for session in self._sessions.values())
+
+    @property
+    def metrics(self) -> dict[str, int]:
+        return {
+            "live": len(self),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rehydrations": self.rehydrations,
+            "spills": self.spills,
+        }
+
+    async def get(self, key: Hashable) -> Optional[Dungeon]:
+        """The session's dungeon, restored from the store if it was spilled, or None if there's no session."""
+        # a session being spilled mustn't be handed out, as changes to it would be lost with it
+        if (spilled := self._spilling.get(key)) is not None:
+            await spilled.wait()
+
+        now = self.clock()
+
+        if (session := self._sessions.get(key)) is not None:
+            self.hits += 1
+            session.used = now
+            self._sessions.move_to_end(key)
+            await self.sweep()
+            return session.dungeon
+
+        # two commands arriving at once mustn't restore two copies of the session
+        if key not in self._loading:
+            self._loading[key] = loading = asyncio.ensure_future(self._rehydrate(key))
+            # dropped once done rather than by whoever awaits it, who may be cancelled first
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        dungeon = await asyncio.shield(self._loading[key])
+
+        if dungeon is None:
+            self.misses += 1
+        return dungeon
+
+    @contextlib.asynccontextmanager
+    async def use(self, key: Hashable) -> AsyncIterator[Optional[Dungeon]]:
+        """Gets a session's dungeon, as get does, and keeps it from being spilled until the block is left."""
+        while (dungeon := await self.get(key)) is not None:
+            # the session may have been spilled again while get was sweeping
+            if (session := self._sessions.get(key)) is not None and (
+                session.dungeon is dungeon
+            ):
+                break
+
+        if dungeon is None:
+            yield None
+            return
+
+        session.users += 1
+        try:
+            yield dungeon
+        finally:
+            session.users -= 1
+
+    async def _rehydrate(self, key: Hashable) -> Optional[Dungeon]:
+        data = await self.store.load(key)
+        if data is None:
+            return None
+
+        dungeon = snapshot.load(data, self.library)
+        self.rehydrations += 1
+
+        await self.store.delete(key)
+        await self.put(key, dungeon)
+        return dungeon
+
+    async def put(self, key: Hashable, dungeon: Dungeon) -> None:
+        """Starts or replaces a session, spilling others if that goes over the budget."""
+        self._sessions[key] = _Session(dungeon, self.clock())
+        self._sessions.move_to_end(key)
+        await self.sweep()
+
+    async def delete(self, key: Hashable) -> None:
+        """Ends a session, live or spilled."""
+        self._sessions.pop(key, None)
+        await self.store.delete(key)
+
+    async def sweep(self) -> None:
+        """Spills the sessions that have been idle too long, then the least recently used ones over the budget.
+
+        The session used last, and sessions held through use(), are always kept, even if they alone are over
+        the budget.
+        """
+        now = self.clock()
+
+        for key in [
+            key
+            for key, session in self._sessions.items()
+            if now - session.used > self.ttl and not session.users
+        ]:
+            await self.spill(key)
+
+        total = 0
+        for session in list(self._sessions.values()):
+            total += await self._measure(session)
+
+        for key in list(self._sessions)[:-1]:
+            if total <= self.budget:
+                break
+            if (session := self._sessions.get(key)) is None or session.users:
+                continue
+            total -= session.size
+            await self.spill(key)
+
+    async def spill(self, key: Hashable) -> None:
+        """Snapshots a session into the store and drops it from memory."""
+        if (session := self._sessions.get(key)) is None or key in self._spilling:
+            return
+
+        self._spilling[key] = spilled = asyncio.Event()
+        try:
+            # nothing may touch the dungeon from the snapshot until it's dropped, or the change would be lost
+            async with self._hold(session.dungeon):
+                await self.store.save(
+                    key, await self._run(snapshot.dump, session.dungeon, self.library)
+                )
+
+                # the session may have been replaced while it was being saved
+                if self._sessions.get(key) is session:
+                    del self._sessions[key]
+                self.spills += 1
+        finally:
+            del self._spilling[key]
+            spilled.set()
+
+    async def _measure(self, session: _Session) -> int:
+        if session.version != (version := session.dungeon.last_version):
+            async with self._hold(session.dungeon):
+                session.size = await self._run(
+                    snapshot.estimate, session.dungeon, self.library
+                )
+            session.version = version
+        return session.size
+
+    def _hold(self, dungeon: Dungeon) -> contextlib.AbstractAsyncContextManager:
+        if self.service is None:
+            return contextlib.nullcontext()
+        return self.service.hold(dungeon)
+
+    async def _run(self, function: Callable, *args) -> Any:
+        if self.service is None:
+            return function(*args)
+        return await self.service.run(function, *args)
@@ -1,27 +1,168 @@
+from __future__ import annotations
+
 from numbers import Number
-from typing import Iterable
+from typing import Callable, Iterable, Optional
+
+import numpy
+
+from utils.rpg.dungeon.cache import VersionedCache
+from utils.rpg.dungeon.palette import PALETTE
 
 
 class Skin:
+    # whether a tile stays the same from one render to the next; animated skins, e.g. water, don't
+    deterministic = True
+
     def get_index(self, x: Number, y: Number):
         raise NotImplementedError
 
     def get_bounds(self):
         raise NotImplementedError
 
+    def raster(self) -> Optional[tuple[tuple[int, int], numpy.ndarray]]:
+        """Rasterizes the skin into palette ids, giving the lower-left index and the ids, indexed [y][x].
+
+        Returns None for boundless skins.
+        """
+        if not (bounds := self.get_bounds()):
+            return None
+
+        cols, rows = bounds
+        ids = numpy.array(
+            [[PALETTE.id(self.get_index(x, y)) for x in cols] for y in rows],
+            dtype=numpy.int32,
+        ).reshape(len(rows), len(cols))
+
+        return (cols.start, rows.start), ids
+
+    def window(self, bounds: tuple[int, int, int, int]) -> Optional[numpy.ndarray]:
+        """Gives the palette ids of a boundless skin over (min x, min y, max x, max y), inclusive, indexed [y][x].
+
+        Returns None if the tiles have to be looked up one by one.
+        """
+        return None
+
 
 class DefiniteSkin(Skin, object):
-    __slots__ = ("_skin",)
+    """A skin made of a fixed grid of tiles, given top row first.
+
+    The tiles are kept as an array of palette ids indexed [y][x], where 0 is transparent, so the whole skin
+    is pasted in one slice assignment. The array's lower-left tile is at the origin.
+    """
+
+    __slots__ = ("ids", "origin", "_bounds")
 
     def __init__(self, skin: Iterable[Iterable[str]]):
-        self._skin = skin
-        self._skin.reverse()
+        rows = [list(row) for row in skin][::-1]
+        ids = numpy.zeros(
+            (len(rows), max(map(len, rows), default=0)), dtype=numpy.int32
+        )
+
+        for y, row in enumerate(rows):
+            ids[y, : len(row)] = [PALETTE.id(tile) for tile in row]
+
+        self._set(ids, (0, 0))
+
+    @classmethod
+    def from_ids(
+        cls, ids: numpy.ndarray, origin: tuple[int, int] = (0, 0)
+    ) -> DefiniteSkin:
+        """Wraps an array of palette ids, indexed [y][x], without going through tile strings."""
+        skin = cls.__new__(cls)
+        skin._set(numpy.asarray(ids, dtype=numpy.int32), origin)
+        return skin
+
+    def _set(self, ids: numpy.ndarray, origin: tuple[int, int]) -> None:
+        self.ids = ids
+        self.origin = x, y = origin
+        self._bounds = (range(x, x + ids.shape[1]), range(y, y + ids.shape[0]))
 
     def get_bounds(self):
-        return (range(len(self._skin[0])), range(len(self._skin)))
+        return self._bounds
 
     def get_index(self, x: Number, y: Number):
-        bounds = self.get_bounds()
-        if y not in bounds[1] or x not in bounds[0]:
+        if y not in self._bounds[1] or x not in self._bounds[0]:
             return None
-        return self._skin[int(y)][int(x)]
+        return PALETTE.tiles[self.ids[int(y) - self.origin[1]][int(x) - self.origin[0]]]
+
+    def raster(self) -> Optional[tuple[tuple[int, int], numpy.ndarray]]:
+        return self.origin, self.ids
+
+
+class UniformSkin(Skin, object):
+    """A boundless skin that is the same tile everywhere."""
+
+    __slots__ = ("tile",)
+
+    def __init__(self, tile: str):
+        self.tile = tile
+
+    def get_bounds(self):
+        return False
+
+    def get_index(self, x: Number, y: Number):
+        return self.tile
+
+    def window(self, bounds: tuple[int, int, int, int]) -> Optional[numpy.ndarray]:
+        x0, y0, x1, y1 = bounds
+        return numpy.full(
+            (y1 - y0 + 1, x1 - x0 + 1), PALETTE.id(self.tile), numpy.int32
+        )
+
+
+class ProceduralSkin(Skin, object):
+    """A boundless skin whose tiles are computed by an algorithm.
+
+    Vectorized algorithms are given arrays of x and y coordinates for a whole window and give back an array
+    of palette ids; others are called once per tile and give back the tile. Windows of deterministic
+    algorithms are cached.
+    """
+
+    __slots__ = ("algorithm", "vectorized", "deterministic", "_windows")
+
+    def __init__(
+        self,
+        algorithm: Callable,
+        *,
+        vectorized: bool = False,
+        deterministic: bool = False,
+    ):
+        self.algorithm = algorithm
+        self.vectorized = vectorized
+        self.deterministic = deterministic
+        self._windows = VersionedCache(size=16)
+
+    def get_bounds(self):
+        return False
+
+    def get_index(self, x: Number, y: Number):
+        if self.vectorized:
+            return PALETTE.tiles[int(self.algorithm(numpy.array(x), numpy.array(y)))]
+        return self.algorithm(x, y)
+
+    def window(self, bounds: tuple[int, int, int, int]) -> Optional[numpy.ndarray]:
+        key = (0, bounds)
+
+        if self.deterministic and (ids := self._windows.get(key)) is not None:
+            return ids
+
+        x0, y0, x1, y1 = bounds
+        ys, xs = numpy.mgrid[y0 : y1 + 1, x0 : x1 + 1]
+
+        if self.vectorized:
+            ids = numpy.broadcast_to(
+                numpy.asarray(self.algorithm(xs, ys), dtype=numpy.int32), xs.shape
+            )
+        else:
+            ids = numpy.array(
+                [
+                    [PALETTE.id(self.algorithm(x, y)) for x in range(x0, x1 + 1)]
+                    for y in range(y0, y1 + 1)
+                ],
+                dtype=numpy.int32,
+            ).reshape(xs.shape)
+
+        if self.deterministic:
+            self._windows.put(key, ids)
+
+        return ids
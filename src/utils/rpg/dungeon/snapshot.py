@@ -0,0 +1,579 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import struct
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+import numpy
+import shapely.wkb
+
+from utils.rpg.dungeon.palette import PALETTE, Palette
+from utils.rpg.dungeon.piece import (
+    Being,
+    BoringPlane,
+    MergedPiece,
+    MergedWalls,
+    Piece,
+    Plane,
+    Relation,
+    Surface,
+    Wall,
+)
+from utils.rpg.dungeon.ray import CameraBehavior, FieldOfView
+from utils.rpg.dungeon.scheduler import Turn
+from utils.rpg.dungeon.skin import DefiniteSkin, UniformSkin
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.game import Dungeon
+    from utils.rpg.dungeon.world import World
+
+# snapshots: magic, format version, metadata length, the metadata as JSON, then the arrays it lists, back to back
+MAGIC = b"HDGN"
+VERSION = 2
+HEADER = struct.Struct("<4sHI")
+
+# piece references: indices into the snapshot's pieces, NONE, or [SHARED, key, index] into a shared layer
+NONE, SHARED = -1, -2
+
+
+class SnapshotError(ValueError):
+    ...
+
+
+# the piece classes snapshots may name; snapshots come from the database, so nothing else is ever looked up
+CLASSES: dict[str, type[Piece]] = dict()
+
+
+def register(*classes: type[Piece]) -> None:
+    """Allows pieces of the given classes in snapshots."""
+    for cls in classes:
+        if not issubclass(cls, Piece):
+            raise TypeError(f"{cls!r} isn't a piece")
+        CLASSES[_name(cls)] = cls
+
+
+def _name(cls: type) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+class Library(object):
+    """Static layers shared between dungeons, e.g. the maze every session plays in, keyed by content hash.
+
+    Snapshots refer to a library's layers by key rather than copying them, and restore them as the very same
+    objects.
+    """
+
+    __slots__ = ("_layers", "_keys")
+
+    def __init__(self):
+        self._layers = dict()
+        self._keys = dict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._layers
+
+    def __getitem__(self, key: str) -> list[Piece]:
+        return self._layers[key]
+
+    def add(self, layer: list[Piece], key: Optional[str] = None) -> str:
+        """Shares a layer, giving its key; layers that can't be snapshotted, e.g. procedural planes, need a key."""
+        if key is None:
+            key = hashlib.blake2b(_Writer().layer(layer), digest_size=16).hexdigest()
+
+        self._layers.setdefault(key, layer)
+        self._keys[id(self._layers[key])] = key
+        return key
+
+    def key(self, layer: Iterable[Piece]) -> Optional[str]:
+        """The key of a shared layer, or None if it isn't shared."""
+        return self._keys.get(id(layer))
+
+
+def dump(dungeon: Dungeon, library: Optional[Library] = None) -> bytes:
+    """Snapshots a dungeon's pieces, turn order and render settings.
+
+    Layers in the library are stored by key, and a world's chunks aren't stored at all. Actions queued in
+    the current turn aren't stored either, since they are arbitrary callables.
+    """
+    return _Writer(library).dungeon(dungeon)
+
+
+# bytes a piece takes in a snapshot besides its arrays: its columns, metadata and a share of the tables
+PIECE_BYTES = 256
+
+
+def estimate(dungeon: Dungeon, library: Optional[Library] = None) -> int:
+    """Roughly how big a dungeon's snapshot would be, from its pieces' arrays, without taking one."""
+    library = library or Library()
+    size = 0
+
+    for layer in dungeon.pieces:
+        if dungeon.world is not None and layer is dungeon.world.pieces:
+            continue
+        if library.key(layer) is not None:
+            continue
+
+        for piece in layer:
+            size += PIECE_BYTES
+            if isinstance(piece, MergedWalls):
+                size += piece.grid.nbytes + piece.rects.nbytes
+            if isinstance(piece.skin, DefiniteSkin):
+                size += piece.skin.ids.nbytes
+
+    return size
+
+
+def load(
+    data: bytes, library: Optional[Library] = None, *, world: Optional[World] = None
+) -> Dungeon:
+    """Restores a dungeon from a snapshot; shared layers come from the library, and the world must be given again.
+
+    Raises SnapshotError for anything wrong with the snapshot, including it being truncated or corrupt.
+    """
+    try:
+        return _Reader(data, library).dungeon(world)
+    except SnapshotError:
+        raise
+    except (ValueError, TypeError, KeyError, IndexError, struct.error) as e:
+        raise SnapshotError(f"corrupt snapshot: {e!r}") from e
+
+
+class _Writer(object):
+    __slots__ = ("library", "meta", "arrays", "blobs", "_refs")
+
+    def __init__(self, library: Optional[Library] = None):
+        self.library = library or Library()
+
+        self.meta = dict()
+        self.arrays = []
+        self.blobs = []
+
+        self._refs = dict()
+
+    def array(self, array: numpy.ndarray) -> int:
+        self.arrays.append(numpy.ascontiguousarray(array))
+        return len(self.arrays) - 1
+
+    def blob(self, data: bytes) -> int:
+        self.blobs.append(data)
+        return len(self.blobs) - 1
+
+    def finish(self) -> bytes:
+        if self.blobs:
+            self.meta["blobs"] = self.array(
+                numpy.cumsum([0] + [len(b) for b in self.blobs], dtype=numpy.int64)
+            )
+            self.array(numpy.frombuffer(b"".join(self.blobs), dtype=numpy.uint8))
+
+        self.meta["arrays"] = [(a.dtype.str, a.shape) for a in self.arrays]
+        try:
+            meta = json.dumps(self.meta, separators=(",", ":")).encode()
+        except TypeError as e:
+            raise SnapshotError(f"piece state must be JSON: {e}") from e
+
+        return b"".join(
+            [HEADER.pack(MAGIC, VERSION, len(meta)), meta]
+            + [a.tobytes() for a in self.arrays]
+        )
+
+    def layer(self, layer: Iterable[Piece]) -> bytes:
+        """Snapshots a layer on its own, e.g. to hash it."""
+        pieces = list(layer)
+        self._refs = {piece: i for i, piece in enumerate(pieces)}
+        self.pieces(pieces)
+        return self.finish()
+
+    def dungeon(self, dungeon: Dungeon) -> bytes:
+        layers = []
+        pieces = []
+
+        for layer in dungeon.pieces:
+            if dungeon.world is not None and layer is dungeon.world.pieces:
+                layers.append({"world": True})
+            elif (key := self.library.key(layer)) is not None:
+                layers.append({"shared": key})
+            else:
+                layers.append(
+                    {"pieces": list(range(len(pieces), len(pieces) + len(layer)))}
+                )
+                pieces.extend(layer)
+
+        self._refs = {piece: i for i, piece in enumerate(pieces)}
+        self.meta["layers"] = layers
+        self.pieces(pieces)
+
+        turns = dungeon.turns
+        pending = sorted(
+            (entry for entry in turns._heap if entry[-1] is not None),
+            key=lambda entry: entry[:3],
+        )
+        self.meta["turns"] = {
+            "round": turns.round,
+            "turn": None
+            if turns.turn is None
+            else [self.ref(turns.turn.focus), turns.turn.initiative],
+            "pending": [
+                [entry[0], self.ref(entry[-1].focus), entry[-1].initiative]
+                for entry in pending
+            ],
+        }
+        self.meta["render"] = {
+            "default": dungeon.default,
+            "blind": dungeon.blind,
+            "reach": dungeon.reach,
+            "size": list(dungeon.render_size),
+            "origin": [int(i) for i in dungeon.render_origin],
+            "behavior": dungeon.render_behavior.name,
+            "fov": dungeon.fov.name,
+        }
+
+        return self.finish()
+
+    def ref(self, piece: Optional[Piece]) -> Any:
+        """A reference to a piece: its index, NONE, or [SHARED, key, index] for a piece of a shared layer."""
+        if piece is None:
+            return NONE
+        if (i := self._refs.get(piece)) is not None:
+            return i
+
+        for layer in self.library._layers.values():
+            for i, shared in enumerate(layer):
+                if shared is piece:
+                    return [SHARED, self.library.key(layer), i]
+
+        raise SnapshotError(f"{piece!r} isn't in the dungeon")
+
+    def pieces(self, pieces: list[Piece]) -> None:
+        classes, geometries, skins = dict(), dict(), dict()
+        extras = []
+
+        for i, piece in enumerate(pieces):
+            extra = dict()
+
+            if (
+                piece.psychology[Relation.CHARMED]
+                or piece.psychology[Relation.FRIGHTENED]
+            ):
+                extra["psychology"] = {
+                    relation.name: [self.ref(p) for p in others]
+                    for relation, others in piece.psychology.items()
+                }
+            if piece.data is not None:
+                extra["data"] = piece.data
+            if isinstance(piece, MergedWalls):
+                extra["grid"] = self.array(piece.grid)
+                extra["rects"] = self.array(piece.rects)
+            elif getattr(piece, "__dict__", None):
+                state = vars(piece)
+                if isinstance(piece, MergedPiece):
+                    # the merged pieces are plain pieces, stored in the same tables as the others
+                    extra["merged"] = [
+                        [
+                            p.loc.tolist(),
+                            self._index(geometries, p.hitbox, id(p.hitbox)),
+                            self._index(skins, p.skin, id(p.skin)),
+                        ]
+                        for p in piece._pieces
+                    ]
+                    state = {k: v for k, v in state.items() if k != "_pieces"}
+                if state:
+                    extra["dict"] = self.state(piece, state)
+
+            if piece.frozen:
+                extra["frozen"] = True
+
+            if extra:
+                extra["piece"] = i
+                extras.append(extra)
+
+        self.meta["pieces"] = {
+            "count": len(pieces),
+            "class": self.array(
+                numpy.array(
+                    [self._index(classes, type(p), id(type(p))) for p in pieces],
+                    dtype=numpy.int32,
+                )
+            ),
+            "loc": self.array(
+                numpy.array([p.loc for p in pieces], dtype=float).reshape(-1, 2)
+            ),
+            "speed": self.array(
+                numpy.array(
+                    [(p.speed, p.max_speed) for p in pieces], dtype=float
+                ).reshape(-1, 2)
+            ),
+            "condition": self.array(
+                numpy.array([int(p.condition) for p in pieces], dtype=numpy.int64)
+            ),
+            "initiative": self.array(
+                numpy.array([p.initiative for p in pieces], dtype=float)
+            ),
+            "hitbox": self.array(
+                numpy.array(
+                    [
+                        NONE
+                        if isinstance(p, MergedWalls)
+                        else self._index(geometries, p.hitbox, id(p.hitbox))
+                        for p in pieces
+                    ],
+                    dtype=numpy.int32,
+                )
+            ),
+            "skin": self.array(
+                numpy.array(
+                    [self._index(skins, p.skin, id(p.skin)) for p in pieces],
+                    dtype=numpy.int32,
+                )
+            ),
+            "extras": extras,
+        }
+        # mounts may be in shared layers, so they're kept with the extras if need be
+        mounts = [self.ref(p.mount) for p in pieces]
+        if any(isinstance(m, list) for m in mounts):
+            self.meta["pieces"]["mounts"] = mounts
+        else:
+            self.meta["pieces"]["mount"] = self.array(
+                numpy.array(mounts, dtype=numpy.int32)
+            )
+
+        for _, cls in classes.values():
+            if CLASSES.get(_name(cls)) is not cls:
+                raise SnapshotError(f"{cls.__name__} isn't registered for snapshots")
+        self.meta["classes"] = [_name(cls) for _, cls in classes.values()]
+        self.meta["geometries"] = [
+            self.blob(shapely.wkb.dumps(g)) for _, g in geometries.values()
+        ]
+        self.meta["skins"] = [self.skin(s) for _, s in skins.values()]
+
+    @staticmethod
+    def state(piece: Piece, state: dict) -> dict:
+        """Checks that the attributes of a piece can be stored as JSON."""
+        try:
+            json.dumps(state)
+        except (TypeError, ValueError) as e:
+            raise SnapshotError(
+                f"{type(piece).__name__}'s attributes must be JSON: {e}"
+            ) from e
+        return state
+
+    @staticmethod
+    def _index(table: dict, value: Any, key: Any) -> int:
+        """Interns a value by key into a table whose insertion order gives its index."""
+        if (entry := table.get(key)) is None:
+            entry = table[key] = (len(table), value)
+        return entry[0]
+
+    def skin(self, skin: Any) -> dict:
+        if isinstance(skin, UniformSkin):
+            return {"uniform": skin.tile}
+        if isinstance(skin, DefiniteSkin):
+            # palette ids only mean something in this process, so the tiles are stored alongside
+            used, ids = numpy.unique(skin.ids, return_inverse=True)
+            return {
+                "tiles": [PALETTE.tiles[i] for i in used.tolist()],
+                "ids": self.array(ids.reshape(skin.ids.shape).astype(numpy.int32)),
+                "origin": list(skin.origin),
+            }
+
+        raise SnapshotError(
+            f"{type(skin).__name__} can't be snapshotted; share its layer through a Library"
+        )
+
+
+class _Reader(object):
+    __slots__ = ("library", "meta", "arrays", "pieces")
+
+    def __init__(self, data: bytes, library: Optional[Library] = None):
+        self.library = library or Library()
+
+        magic, version, length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise SnapshotError("not a dungeon snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+
+        self.meta = json.loads(data[HEADER.size : HEADER.size + length])
+
+        self.arrays = []
+        offset = HEADER.size + length
+
+        for dtype, shape in self.meta["arrays"]:
+            dtype = numpy.dtype(dtype)
+            if dtype.hasobject:
+                raise SnapshotError("snapshots hold plain arrays only")
+            count = int(numpy.prod(shape))
+            self.arrays.append(
+                numpy.frombuffer(data, dtype, count, offset).reshape(shape)
+            )
+            offset += count * dtype.itemsize
+
+        self.pieces = []
+
+    def blob(self, i: int) -> bytes:
+        offsets, data = (
+            self.arrays[self.meta["blobs"]],
+            self.arrays[self.meta["blobs"] + 1],
+        )
+        return data[offsets[i] : offsets[i + 1]].tobytes()
+
+    def deref(self, ref: Any) -> Optional[Piece]:
+        if isinstance(ref, list):
+            _, key, i = ref
+            if key not in self.library:
+                raise SnapshotError(f"shared layer {key} isn't in the library")
+            return self.library[key][i]
+        return None if ref == NONE else self.pieces[ref]
+
+    def read_pieces(self) -> list[Piece]:
+        meta = self.meta["pieces"]
+        arrays = {
+            name: self.arrays[meta[name]]
+            for name in (
+                "class",
+                "loc",
+                "speed",
+                "condition",
+                "initiative",
+                "hitbox",
+                "skin",
+            )
+        }
+
+        try:
+            classes = [CLASSES[name] for name in self.meta["classes"]]
+        except KeyError as e:
+            raise SnapshotError(f"{e.args[0]} isn't registered for snapshots") from e
+        geometries = [shapely.wkb.loads(self.blob(i)) for i in self.meta["geometries"]]
+        skins = [self.skin(skin) for skin in self.meta["skins"]]
+
+        for cls, loc, (speed, max_speed), condition, initiative, hitbox, skin in zip(
+            arrays["class"].tolist(),
+            arrays["loc"],
+            arrays["speed"].tolist(),
+            arrays["condition"].tolist(),
+            arrays["initiative"].tolist(),
+            arrays["hitbox"].tolist(),
+            arrays["skin"].tolist(),
+        ):
+            # subclasses' constructors build their own state, which is restored as is instead
+            piece = classes[cls].__new__(classes[cls])
+            Piece.__init__(
+                piece,
+                loc,
+                speed=max_speed,
+                hitbox=None if hitbox == NONE else geometries[hitbox],
+                skin=skins[skin],
+                initiative=initiative,
+            )
+            piece.speed = speed
+            piece.condition = condition
+            self.pieces.append(piece)
+
+        if "mount" in meta:
+            mounts = self.arrays[meta["mount"]].tolist()
+        else:
+            mounts = meta["mounts"]
+        for piece, mount in zip(self.pieces, mounts):
+            piece.mount = self.deref(mount)
+
+        for extra in meta["extras"]:
+            piece = self.pieces[extra["piece"]]
+
+            if "dict" in extra:
+                self.state(piece, extra["dict"])
+            if "merged" in extra:
+                piece._pieces = [
+                    Piece(loc, hitbox=geometries[hitbox], skin=skins[skin])
+                    for loc, hitbox, skin in extra["merged"]
+                ]
+            if "grid" in extra:
+                piece.grid = self.arrays[extra["grid"]].copy()
+                piece.rects = self.arrays[extra["rects"]].copy()
+                piece._geometry = dict()
+            if "data" in extra:
+                piece.data = extra["data"]
+            if "psychology" in extra:
+                piece.psychology = {
+                    Relation[name]: [self.deref(ref) for ref in refs]
+                    for name, refs in extra["psychology"].items()
+                }
+            if "frozen" in extra:
+                piece.freeze()
+
+        return self.pieces
+
+    @staticmethod
+    def state(piece: Piece, state: dict) -> None:
+        """Sets the stored attributes of a piece, which may only be plain attributes of its own."""
+        if not hasattr(piece, "__dict__"):
+            raise SnapshotError(f"{type(piece).__name__} has no attributes to restore")
+
+        for name, value in state.items():
+            # methods, properties and slots are the class's own, and dunders belong to Python
+            if (name.startswith("__") and name.endswith("__")) or hasattr(
+                getattr(type(piece), name, None), "__get__"
+            ):
+                raise SnapshotError(
+                    f"{type(piece).__name__}.{name} can't be set from a snapshot"
+                )
+            setattr(piece, name, value)
+
+    def skin(self, skin: dict) -> Any:
+        if "uniform" in skin:
+            return UniformSkin(skin["uniform"])
+
+        tiles = numpy.array(
+            [PALETTE.id(tile) for tile in skin["tiles"]], dtype=numpy.int32
+        )
+        return DefiniteSkin.from_ids(
+            tiles[self.arrays[skin["ids"]]], tuple(skin["origin"])
+        )
+
+    def dungeon(self, world: Optional[World] = None) -> Dungeon:
+        from utils.rpg.dungeon.game import Dungeon
+
+        for layer in self.meta["layers"]:
+            if "shared" in layer and layer["shared"] not in self.library:
+                raise SnapshotError(
+                    f"shared layer {layer['shared']} isn't in the library"
+                )
+
+        pieces = self.read_pieces()
+        layers = []
+
+        for layer in self.meta["layers"]:
+            if "world" in layer:
+                if world is None:
+                    raise SnapshotError("the dungeon had a world, which must be given")
+                layers.append(world.pieces)
+            elif "shared" in layer:
+                layers.append(self.library[layer["shared"]])
+            else:
+                layers.append([pieces[i] for i in layer["pieces"]])
+
+        render = self.meta["render"]
+        dungeon = Dungeon(
+            layers,
+            default=render["default"],
+            blind=render["blind"],
+            render_size=tuple(render["size"]),
+            render_origin=tuple(render["origin"]),
+            render_behavior=CameraBehavior[render["behavior"]],
+            fov=FieldOfView[render["fov"]],
+            reach=render["reach"],
+            world=world,
+        )
+
+        turns = self.meta["turns"]
+        dungeon.turns.round = turns["round"]
+        if turns["turn"] is not None:
+            focus, initiative = turns["turn"]
+            dungeon.turns.turn = Turn(self.deref(focus), initiative)
+        for round, focus, initiative in turns["pending"]:
+            dungeon.turns.put(Turn(self.deref(focus), initiative), round=round)
+
+        return dungeon
+
+
+register(Piece, Wall, MergedWalls, Surface, Being, Plane, BoringPlane, MergedPiece)
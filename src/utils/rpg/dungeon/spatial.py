@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+from collections import defaultdict
+import math
+from numbers import Number
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    from utils.rpg.dungeon.piece import Piece
+
+
+class SpatialHash(object):
+    """Uniform grid of buckets over piece hitboxes, used to find the pieces near a region.
+
+    Pieces spanning more than LARGE buckets, e.g. whole mazes, are kept aside and checked on every query
+    instead, so that the buckets of each dungeon sharing them don't grow with the size of the map.
+    """
+
+    LARGE = 64
+
+    __slots__ = ("size", "_buckets", "_entries", "_order", "_large")
+
+    def __init__(self, pieces: Iterable[Piece] = (), size: Number = 8):
+        self.size = size
+
+        self._buckets = defaultdict(set)
+        self._entries = dict()
+        self._order = dict()
+        self._large = set()
+
+        for piece in pieces:
+            self.insert(piece)
+
+    def __contains__(self, piece: Piece) -> bool:
+        return piece in self._order
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    @property
+    def bounds(self) -> Optional[tuple[Number, Number, Number, Number]]:
+        """The bounds of every indexed hitbox together, or None if there are none."""
+        if not self._entries:
+            return None
+
+        boxes = [entry[0] for entry in self._entries.values()]
+        return (
+            min(b[0] for b in boxes),
+            min(b[1] for b in boxes),
+            max(b[2] for b in boxes),
+            max(b[3] for b in boxes),
+        )
+
+    def _keys(self, bounds: Iterable[Number]) -> list[tuple[int, int]]:
+        min_x, min_y, max_x, max_y = (math.floor(i / self.size) for i in bounds)
+        return [
+            (i, j) for i in range(min_x, max_x + 1) for j in range(min_y, max_y + 1)
+        ]
+
+    def insert(self, piece: Piece) -> None:
+        """Adds a piece; pieces are returned from queries in the order they were inserted."""
+        self._order.setdefault(piece, len(self._order))
+        self.update(piece)
+
+    def remove(self, piece: Piece) -> None:
+        """Removes a piece from the index."""
+        self._unbucket(piece)
+        self._order.pop(piece, None)
+
+    def update(self, piece: Piece) -> None:
+        """Re-buckets a piece after its location or hitbox changed."""
+        if piece not in self._order:
+            return
+
+        self._unbucket(piece)
+
+        bounds = piece.true_bounds
+        if bounds is None:
+            return
+
+        min_x, min_y, max_x, max_y = (math.floor(i / self.size) for i in bounds)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > self.LARGE:
+            self._large.add(piece)
+            self._entries[piece] = (bounds, ())
+            return
+
+        keys = self._keys(bounds)
+
+        for key in keys:
+            self._buckets[key].add(piece)
+
+        self._entries[piece] = (bounds, keys)
+
+    def _unbucket(self, piece: Piece) -> None:
+        if (entry := self._entries.pop(piece, None)) is None:
+            return
+
+        self._large.discard(piece)
+        for key in entry[1]:
+            bucket = self._buckets[key]
+            bucket.discard(piece)
+            if not bucket:
+                del self._buckets[key]
+
+    def query(self, bounds: Iterable[Number]) -> list[Piece]:
+        """Finds the pieces whose hitbox bounds overlap (min x, min y, max x, max y)."""
+        min_x, min_y, max_x, max_y = bounds
+        candidates = set(self._large)
+
+        for key in self._keys(bounds):
+            if key in self._buckets:
+                candidates |= self._buckets[key]
+
+        hits = []
+
+        for piece in candidates:
+            p_min_x, p_min_y, p_max_x, p_max_y = self._entries[piece][0]
+            if (
+                p_min_x <= max_x
+                and min_x <= p_max_x
+                and p_min_y <= max_y
+                and min_y <= p_max_y
+            ):
+                hits.append(piece)
+
+        hits.sort(key=self._order.__getitem__)
+
+        return hits
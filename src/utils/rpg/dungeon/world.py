@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import math
+from numbers import Number
+from typing import Callable, Iterable, Optional
+
+import numpy
+
+from utils.rpg.dungeon.piece import MergedWalls
+
+
+class World(object):
+    """Walls of a map too big to keep in memory, split into square chunks that are loaded as they're needed.
+
+    The source gives the wall cells of the map over (min x, min y, max x, max y), inclusive, e.g. a MapFile
+    or a query against the database. Loaded chunks are MergedWalls in the pieces list, which should be one
+    of a dungeon's layers; the least recently used chunks are dropped once there are more than the capacity.
+    """
+
+    __slots__ = (
+        "source",
+        "chunk_size",
+        "capacity",
+        "loc",
+        "skin",
+        "pieces",
+        "loads",
+        "_chunks",
+    )
+
+    def __init__(
+        self,
+        source: Callable[[tuple[int, int, int, int]], numpy.ndarray],
+        *,
+        chunk_size: int = 64,
+        capacity: int = 64,
+        loc: Iterable[int] = (0, 0),
+        skin: str = "⬜",
+    ):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.capacity = capacity
+        self.loc = tuple(int(i) for i in loc[:2])
+        self.skin = skin
+
+        self.pieces = []
+        self.loads = 0
+
+        # chunk -> its walls, or None if it has none; oldest use first
+        self._chunks = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def __contains__(self, chunk: tuple[int, int]) -> bool:
+        return chunk in self._chunks
+
+    def chunks(self, bounds: Iterable[Number]) -> list[tuple[int, int]]:
+        """The chunks covering (min x, min y, max x, max y), in world coordinates."""
+        x0, y0, x1, y1 = (
+            math.floor((b - o + 0.5) / self.chunk_size)
+            for b, o in zip(bounds, self.loc * 2)
+        )
+        return [(cx, cy) for cy in range(y0, y1 + 1) for cx in range(x0, x1 + 1)]
+
+    def ensure(self, bounds: Iterable[Number]) -> bool:
+        """Loads the chunks covering the bounds, evicting others if need be; tells whether the pieces changed."""
+        needed = self.chunks(bounds)
+        changed = False
+
+        for chunk in needed:
+            if chunk in self._chunks:
+                self._chunks.move_to_end(chunk)
+            else:
+                self._chunks[chunk] = self._load(chunk)
+                changed |= self._chunks[chunk] is not None
+
+        # chunks needed right now are kept even if they don't fit
+        while len(self._chunks) > max(self.capacity, len(needed)):
+            if self._chunks.popitem(last=False)[1] is not None:
+                changed = True
+
+        if changed:
+            self.pieces[:] = [walls for walls in self._chunks.values() if walls]
+
+        return changed
+
+    def _load(self, chunk: tuple[int, int]) -> Optional[MergedWalls]:
+        self.loads += 1
+
+        size = self.chunk_size
+        x, y = chunk[0] * size, chunk[1] * size
+        grid = self.source((x, y, x + size - 1, y + size - 1))
+
+        if not grid.any():
+            return None
+
+        walls = MergedWalls(grid, skin=self.skin)
+        walls.loc = (self.loc[0] + x, self.loc[1] + y)
+        return walls
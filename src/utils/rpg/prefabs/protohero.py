@@ -1,6 +1,7 @@
 import textwrap
 
 from utils.rpg.dungeon import Being, DefiniteSkin
+from utils.rpg.dungeon.snapshot import register
 
 characters = {
     "Yuni": 828629768651014195,
@@ -11,6 +12,11 @@ characters = {
 }
 __all__ = [f"Prototype{name}" for name in characters]
 
+# every instance of a prefab wears the same skin
+skins = {
+    name: DefiniteSkin([[f"<:__:{emoji_id}>"]]) for name, emoji_id in characters.items()
+}
+
 for _ in characters:
     exec(
         textwrap.dedent(
@@ -18,7 +24,9 @@ for _ in characters:
             class Prototype{_}(Being):
                 def __init__(self, *args, **kwargs):
                     super().__init__(*args, **kwargs)
-                    self.skin = DefiniteSkin([["<:__:{characters[_]}>"]])
+                    self.skin = skins["{_}"]
             """
         )
     )
+
+register(*(globals()[f"Prototype{_}"] for _ in characters))
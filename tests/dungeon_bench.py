@@ -0,0 +1,405 @@
+"""Micro-benchmarks for the dungeon engine. Run with `python dungeon_bench.py` from this directory."""
+
+import asyncio
+import pathlib
+import queue
+import random
+import tempfile
+import time
+import timeit
+
+import numpy
+
+from utils.rpg.dungeon import (
+    Being,
+    DefiniteSkin,
+    Dungeon,
+    FieldOfView,
+    MergedWalls,
+    Movement,
+    Plane,
+    Turn,
+    Wall,
+)
+from utils.rpg.dungeon.maps import MapFile, save_map
+from utils.rpg.dungeon.palette import PALETTE
+from utils.rpg.dungeon.path import astar, dijkstra
+from utils.rpg.dungeon.ray import Ray
+from utils.rpg.dungeon.scheduler import EventQueue
+from utils.rpg.dungeon.service import DungeonService
+from utils.rpg.dungeon.snapshot import Library, dump, load
+from utils.rpg.dungeon.world import World
+
+
+def random_maze(size: int, density: float = 0.25, seed: int = 0) -> str:
+    """Generates a square map of randomly placed walls, keeping the center open."""
+    rng = random.Random(seed)
+    rows = [
+        ["#" if rng.random() < density else "." for _ in range(size)]
+        for _ in range(size)
+    ]
+    rows[size // 2][size // 2] = "."
+    return "\n".join("".join(row) for row in rows)
+
+
+def maze_dungeon(size: int, **kwargs):
+    walls = MergedWalls(random_maze(size))
+    walls.loc = (-(size // 2), -(size // 2))
+    chara = Being(loc=(0, 0), speed=10)
+    dungeon = Dungeon(
+        [[walls], [chara]], blind="🌫️", render_size=(size, size), **kwargs
+    )
+    dungeon.turns.put(Turn(chara))
+    return chara, dungeon
+
+
+def report(name: str, statement, number: int) -> None:
+    elapsed = min(timeit.repeat(statement, number=number, repeat=3)) / number
+    print(f"{name:<40} {elapsed * 1000:>10.3f} ms")
+
+
+def bench_fov():
+    chara, dungeon = maze_dungeon(41)
+
+    def shadowcast():
+        dungeon.visibility.clear()
+        chara.raytracer.shadowcast()
+
+    report("fov: shadowcast 41x41", shadowcast, 100)
+    report("fov: shadowcast 41x41, cached", chara.raytracer.shadowcast, 100)
+    report("fov: render 41x41", lambda: dungeon.render, 20)
+
+    chara, dungeon = maze_dungeon(9, fov=FieldOfView.RAYCAST)
+
+    def raycast():
+        chara.raytracer.clear_cache()
+        chara.raytracer.raycast()
+
+    report("fov: raycast 9x9", raycast, 3)
+
+
+def bench_render():
+    chara, dungeon = maze_dungeon(201)
+    dungeon.render_size = (25, 25)
+
+    def render():
+        dungeon.renders.clear()
+        return dungeon.render
+
+    report("render: 25x25 over a 201x201 maze", render, 100)
+    report("render: 25x25, unchanged", lambda: dungeon.render_str, 1000)
+
+    walls = [Wall(loc=(x, y), skin=DefiniteSkin([["⬜"]])) for x, y in ((1, 0), (0, 1))]
+    dungeon.pieces[0].extend(walls)
+
+    def moving():
+        walls[0].loc = walls[0].loc + (0, 1) if walls[0].loc[1] < 5 else (1, 0)
+        return dungeon.render
+
+    report("render: 25x25, a layer changing each time", moving, 100)
+
+    tiles = numpy.array([PALETTE.id("🟫"), PALETTE.id("🟦")])
+    planes = {
+        "per tile": Plane(lambda x, y: ("🟫", "🟦")[(x + y) % 2]),
+        "vectorized": Plane(lambda x, y: tiles[(x + y) % 2], vectorized=True),
+    }
+
+    for name, plane in planes.items():
+        dungeon.pieces = [[plane], *dungeon.pieces[-2:]]
+        report(f"render: 25x25 over a plane, {name}", render, 100)
+
+
+def bench_party_vision():
+    chara, dungeon = maze_dungeon(41)
+    party = [chara] + [
+        Being(loc=loc, speed=10) for loc in ((-2, 0), (0, -2), (-4, 0), (0, -4))
+    ]
+    dungeon.pieces[1].extend(party[1:])
+
+    def field_of_view(viewers):
+        dungeon.visibility.clear()
+        dungeon.field_of_view(viewers)
+
+    report("party: field of view, 1 viewer", lambda: field_of_view(party[:1]), 50)
+    report("party: field of view, 5 viewers", lambda: field_of_view(party), 50)
+
+
+def bench_line_of_sight():
+    chara, dungeon = maze_dungeon(41)
+    targets = [Being(loc=(x, 15)) for x in range(-15, 16, 3)]
+    dungeon.pieces[1].extend(targets)
+
+    def line_of_sight():
+        dungeon.bump_sight()
+        for target in targets:
+            dungeon.line_of_sight(chara, target)
+
+    def rays():
+        for target in targets:
+            Ray(chara.loc, target.loc, 1, dungeon, ignore=(chara, target)).trace()
+
+    report(f"sight: {len(targets)} lines of sight", line_of_sight, 100)
+    report(
+        f"sight: {len(targets)} lines of sight, cached",
+        lambda: [dungeon.line_of_sight(chara, target) for target in targets],
+        100,
+    )
+    report(f"sight: {len(targets)} Ray.trace calls", rays, 10)
+
+
+def bench_move():
+    chara, dungeon = maze_dungeon(41)
+    chara.speed = float("inf")
+
+    there = Movement((1, 0), piece=chara, dungeon=dungeon)
+    back = Movement((-1, 0), piece=chara, dungeon=dungeon)
+
+    def move():
+        dungeon.move(there)
+        dungeon.move(back)
+
+    report("move: 2 moves", move, 100)
+    report("move: preview", lambda: dungeon.preview(there), 100)
+
+
+def bench_scheduler():
+    def drain(events, n: int = 1000):
+        for i in range(n):
+            events.put((i * 7919 % n, i))
+        while events.qsize():
+            events.get()
+
+    report(
+        "scheduler: queue.PriorityQueue 1000 events",
+        lambda: drain(queue.PriorityQueue()),
+        50,
+    )
+    report("scheduler: EventQueue 1000 events", lambda: drain(EventQueue()), 50)
+
+    def actions(turn, n: int = 1000):
+        for _ in range(n):
+            turn.put(lambda: None)
+        while turn.qsize():
+            turn.get()()
+
+    report("scheduler: queue.Queue 1000 actions", lambda: actions(queue.Queue()), 50)
+    report("scheduler: Turn 1000 actions", lambda: actions(Turn()), 50)
+
+    charas = [Being(loc=(i, 0), speed=10) for i in range(100)]
+    dungeon = Dungeon([charas])
+    for chara in charas:
+        dungeon.turns.put(Turn(chara))
+
+    report("scheduler: 100-piece rotation", dungeon.turns.next_turn, 10000)
+
+
+def bench_pathfinding():
+    chara, dungeon = maze_dungeon(101)
+    chara.speed = float("inf")
+
+    def find_path():
+        dungeon.paths.clear()
+        dungeon.find_path(chara, (45, 45))
+
+    report("path: find_path 101x101", find_path, 10)
+
+    def distance_field():
+        dungeon.paths.clear()
+        dungeon.distance_field((45, 45))
+
+    report("path: distance_field 101x101", distance_field, 10)
+    report(
+        "path: distance_field 101x101, cached",
+        lambda: dungeon.distance_field((45, 45)),
+        1000,
+    )
+
+    blocked = numpy.random.default_rng(0).random((1000, 1000)) < 0.25
+    blocked[0][0] = blocked[999][999] = False
+
+    report(
+        "path: astar 1000x1000, short",
+        lambda: astar(blocked, (500, 500), (560, 530)),
+        3,
+    )
+    report(
+        "path: astar 1000x1000, across", lambda: astar(blocked, (0, 500), (999, 500)), 1
+    )
+    report("path: dijkstra 1000x1000, full", lambda: dijkstra(blocked, (500, 500)), 1)
+    report(
+        "path: dijkstra 1000x1000, limit 60",
+        lambda: dijkstra(blocked, (500, 500), limit=60),
+        10,
+    )
+
+
+def bench_reachable():
+    for size, speed in ((9, 10), (41, 60)):
+        chara, dungeon = maze_dungeon(size, reach="🟦")
+        chara.speed = speed
+
+        def reachable():
+            dungeon.paths.clear()
+            dungeon.reachable(chara)
+
+        report(f"reach: {size}x{size} viewport, speed {speed}", reachable, 50)
+
+    chara, dungeon = maze_dungeon(121)
+    chara.speed = 60
+
+    def reachable():
+        dungeon.paths.clear()
+        dungeon.reachable(chara)
+
+    report("reach: 121x121 maze, speed 60", reachable, 20)
+
+
+def bench_load():
+    maze = random_maze(512)
+    report("load: MergedWalls 512x512", lambda: MergedWalls(maze), 3)
+
+    chara, dungeon = maze_dungeon(513)
+    chara.speed = float("inf")
+    step = Movement((1, 0), piece=chara, dungeon=dungeon)
+
+    report("load: preview among 513x513 walls", lambda: dungeon.preview(step), 100)
+
+
+def bench_world():
+    grid = numpy.random.default_rng(0).random((4096, 4096)) < 0.25
+    grid[2048][2048] = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        save_map(pathlib.Path(tmp) / "world.hmap", grid)
+        world = World(MapFile(pathlib.Path(tmp) / "world.hmap"), loc=(-2048, -2048))
+
+        chara = Being(loc=(0, 0), speed=float("inf"))
+        dungeon = Dungeon([[chara]], world=world, blind="🌫️")
+        dungeon.turns.put(Turn(chara))
+
+        def walk():
+            chara.loc = chara.loc + (32, 0)
+            dungeon.render_origin = tuple(int(i) for i in chara.loc)
+            return dungeon.render
+
+        report("world: render 4096x4096 map, new chunks", walk, 20)
+        report(
+            "world: preview 4096x4096 map",
+            lambda: dungeon.preview(Movement((0, 1), piece=chara, dungeon=dungeon)),
+            100,
+        )
+
+
+def scattered_dungeon(spacing: int = 3, extent: int = 30):
+    chara = Being(loc=(0, 0), speed=10)
+    walls = [
+        Wall(loc=(x, y))
+        for x in range(-extent, extent, spacing)
+        for y in range(-extent, extent, spacing)
+        if (x, y) != (0, 0)
+    ]
+    dungeon = Dungeon([walls, [chara]])
+    dungeon.turns.put(Turn(chara))
+    return chara, dungeon
+
+
+def bench_spatial():
+    chara, dungeon = scattered_dungeon()
+    report(
+        f"spatial: ray among {len(dungeon.pieces[0])} walls",
+        lambda: Ray((0, 0), (1.5, 0.2), 1, dungeon, ignore=(chara,)).trace(),
+        1000,
+    )
+    report(
+        f"spatial: collide among {len(dungeon.pieces[0])} walls",
+        lambda: dungeon.collide(
+            Movement((1, 1), piece=chara, dungeon=dungeon), mock=True
+        ),
+        1000,
+    )
+
+
+def bench_snapshot():
+    rng = random.Random(0)
+    beings = [
+        Being(loc=(rng.randrange(-64, 64), rng.randrange(-64, 64)), speed=6)
+        for _ in range(400)
+    ]
+    walls = [
+        Wall(loc=(rng.randrange(-64, 64), rng.randrange(-64, 64))) for _ in range(99)
+    ]
+    maze = MergedWalls(random_maze(128))
+    dungeon = Dungeon([[maze], walls, beings])
+    for being in beings:
+        dungeon.turns.put(Turn(being))
+
+    data = dump(dungeon)
+    report(f"snapshot: dump 500 pieces ({len(data)} bytes)", lambda: dump(dungeon), 20)
+    report("snapshot: load 500 pieces", lambda: load(data), 20)
+
+    library = Library()
+    library.add(dungeon.pieces[0])
+    data = dump(dungeon, library)
+    report(
+        f"snapshot: dump, shared maze ({len(data)} bytes)",
+        lambda: dump(dungeon, library),
+        20,
+    )
+    report("snapshot: load, shared maze", lambda: load(data, library), 20)
+
+
+def bench_service():
+    """Load test: how late the event loop wakes up while 50 sessions render at once, inline or on workers."""
+
+    def render(dungeon):
+        # panning changes the render key, so every render is drawn from scratch
+        x, y = dungeon.render_origin
+        dungeon.render_origin = (x + 1, y)
+        return dungeon.render_str
+
+    async def run(offload):
+        sessions = [maze_dungeon(81)[1] for _ in range(50)]
+        for dungeon in sessions:
+            dungeon.render_size = (41, 41)
+
+        service = DungeonService(workers=4)
+        lags = []
+        done = False
+
+        async def heartbeat():
+            while not done:
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(time.perf_counter() - start - 0.001)
+
+        async def play(dungeon):
+            for _ in range(10):
+                if offload:
+                    await service.call(dungeon, render, dungeon)
+                else:
+                    render(dungeon)
+                await asyncio.sleep(0)
+
+        beat = asyncio.ensure_future(heartbeat())
+        start = time.perf_counter()
+        await asyncio.gather(*map(play, sessions))
+        elapsed = time.perf_counter() - start
+        done = True
+        await beat
+        service.close()
+
+        lags.sort()
+        name = "workers" if offload else "inline"
+        print(
+            f"{'service: 50 sessions, ' + name:<40} {elapsed * 1000:>10.3f} ms total, "
+            f"loop lag p50 {lags[len(lags) // 2] * 1000:.1f} ms, max {lags[-1] * 1000:.1f} ms"
+        )
+
+    asyncio.run(run(False))
+    asyncio.run(run(True))
+
+
+if __name__ == "__main__":
+    for name, bench in list(globals().items()):
+        if name.startswith("bench_"):
+            bench()
@@ -1,16 +1,57 @@
+import asyncio
+import queue
+import types
+
+from discord.ext.commands import EmojiNotFound
+import numpy
 import pytest
+from shapely.geometry import Point, box
+from shapely.ops import unary_union
 
+from utils.discord.emoji import condense
 from utils.rpg.dungeon import (
     Being,
+    BoringPlane,
+    Condition,
     DefiniteSkin,
     Dungeon,
+    FieldOfView,
+    FrozenPiece,
     InsufficientSpeed,
+    MergedPiece,
+    MergedWalls,
     Movement,
+    MovementMode,
     Piece,
+    Plane,
+    Relation,
     Surface,
     Turn,
     Wall,
+    snapshot,
+)
+from utils.rpg.dungeon.maps import (
+    MapFile,
+    greedy_mesh,
+    load_map,
+    parse_map,
+    save_map,
+    window,
+)
+from utils.rpg.dungeon.palette import PALETTE, Palette, forget_emojis
+from utils.rpg.dungeon.ray import RayTracer
+from utils.rpg.dungeon.scheduler import EventQueue
+from utils.rpg.dungeon.service import DungeonService
+from utils.rpg.dungeon.sessions import DiskStore, SessionManager
+from utils.rpg.dungeon.snapshot import (
+    CLASSES,
+    Library,
+    SnapshotError,
+    dump,
+    load,
+    register,
 )
+from utils.rpg.dungeon.world import World
 
 
 @pytest.fixture
@@ -188,3 +229,1096 @@ class TestRender:
         assert all(
             [all([tile == "." for tile in row]) for row in dungeon.render(3, 3, (0, 0))]
         )
+
+
+@pytest.fixture
+def setup_room():
+    walls = MergedWalls(
+        """
+        #######
+        #.....#
+        #.....#
+        #..#..#
+        #.....#
+        #.....#
+        #######
+        """
+    )
+    walls.loc = (-3, -3)
+    chara = Being(loc=(-1, -1), speed=5)
+    dungeon = Dungeon([[walls], [chara]], render_size=(7, 7))
+
+    dungeon.turns.put(Turn(chara))
+
+    return chara, dungeon
+
+
+@pytest.mark.game
+class TestFieldOfView:
+    def test_shadowcast(self, setup_room):
+        chara, dungeon = setup_room
+
+        field = chara.raytracer.trace()
+
+        assert field[2][2] and field[3][3]
+        assert not field[5][5] and not field[6][5]
+
+    def test_modes_agree(self, setup_room):
+        chara, dungeon = setup_room
+
+        shadow = chara.raytracer.shadowcast()
+        rays = chara.raytracer.raycast()
+
+        assert shadow[5][5] == rays[5][5]
+        assert shadow[:4].all() and rays[:4].all()
+
+    def test_fallback(self, setup_room):
+        class Glass(Piece):
+            def on_sight(self, intersect, ray):
+                ray.intensity -= 0.5
+
+        chara, dungeon = setup_room
+        dungeon.pieces = [*dungeon.pieces, [Glass(loc=(1, 1))]]
+
+        assert chara.raytracer.shadowcast() is None
+        assert chara.raytracer.trace().shape == (7, 7)
+
+        dungeon.fov = FieldOfView.RAYCAST
+        assert chara.raytracer.trace()[2][2]
+
+    def test_occupancy(self, setup_room):
+        chara, dungeon = setup_room
+
+        dungeon.occupancy((-3, -3, 0, 0))
+        grid = dungeon.occupancy((0, 0, 3, 3))
+
+        assert grid.shape == (4, 4) and grid[0][0] and grid[3].all()
+
+
+@pytest.mark.game
+class TestSpatialIndex:
+    def test_query(self):
+        chara = Being(loc=(0, 0), speed=5)
+        near, far = Wall(loc=(1, 0)), Wall(loc=(40, 40))
+        dungeon = Dungeon([[near, far], [chara]])
+
+        assert dungeon.index.query((0.5, -0.5, 2, 0.5)) == [near]
+        assert dungeon.index.query((-50, -50, 50, 50)) == [near, far, chara]
+
+    def test_move(self):
+        chara = Being(loc=(0, 0), speed=5)
+        dungeon = Dungeon([[chara]])
+
+        dungeon.turns.put(Turn(chara))
+        dungeon.move(Movement((3, 4), piece=chara, dungeon=dungeon))
+        dungeon.resolve_turn()
+
+        assert dungeon.index.query((2.5, 3.5, 3.5, 4.5)) == [chara]
+        assert dungeon.index.query((-0.5, -0.5, 0.5, 0.5)) == []
+
+    def test_in_place(self):
+        chara = Being(loc=(0, 0), speed=5)
+        dungeon = Dungeon([[chara]])
+
+        dungeon.pieces.append([wall := Wall(loc=(0, 1))])
+
+        assert dungeon.index.query((-0.5, 0.5, 0.5, 1.5)) == [wall]
+
+
+@pytest.mark.game
+class TestCornerTable:
+    def test_traced_once(self, setup_room, monkeypatch):
+        chara, dungeon = setup_room
+        dungeon.fov = FieldOfView.RAYCAST
+
+        traced = []
+        trace_corner = RayTracer.trace_corner
+        monkeypatch.setattr(
+            RayTracer,
+            "trace_corner",
+            lambda self, corner: traced.append(corner) or trace_corner(self, corner),
+        )
+
+        field = chara.raytracer.trace()
+
+        assert len(traced) == len(set(traced)) <= 8 * 8
+        assert (field == chara.raytracer.trace()).all()
+        assert len(traced) == len(set(traced))
+
+    def test_half_integer_corners(self, setup_room):
+        chara, dungeon = setup_room
+        dungeon.fov = FieldOfView.RAYCAST
+
+        field = chara.raytracer.trace()
+
+        assert not field[4][4] and field[3][3] and field[1][1]
+
+
+@pytest.mark.game
+class TestPartyVision:
+    def test_union(self, setup_room):
+        chara, dungeon = setup_room
+        other = Being(loc=(2, 2), speed=5)
+        dungeon.pieces[1].append(other)
+
+        union, fields = dungeon.field_of_view([chara, other])
+
+        assert (union == fields[chara] | fields[other]).all()
+        assert not fields[chara][5][5] and fields[other][5][5]
+        assert union.all()
+
+    def test_shared_raster(self, setup_room):
+        chara, dungeon = setup_room
+        party = [chara, *(Being(loc=(x, -2), speed=5) for x in range(-1, 3))]
+
+        dungeon.field_of_view(party)
+
+        assert dungeon.visibility.misses == 1 + len(party)
+
+    def test_blinded(self, setup_room):
+        chara, dungeon = setup_room
+        chara.apply_conditions(Condition.BLINDED)
+
+        union, fields = dungeon.field_of_view([chara])
+
+        assert not union.any()
+
+
+@pytest.mark.game
+class TestLineOfSight:
+    def test_blocked(self, setup_room):
+        chara, dungeon = setup_room
+        behind, beside = Being(loc=(1, 1)), Being(loc=(1, -1))
+        dungeon.pieces[1].extend((behind, beside))
+
+        assert not dungeon.line_of_sight(chara, behind)
+        assert dungeon.line_of_sight(chara, beside)
+        assert dungeon.visible_pieces(chara, 3) == [beside]
+
+    def test_modes_agree(self, setup_room):
+        chara, dungeon = setup_room
+        others = [Being(loc=loc) for loc in ((1, 1), (2, 2), (1, -1), (2, -2), (-2, 2))]
+        # the line between these two passes exactly between walls touching at a corner
+        viewer, corner = Being(loc=(2, 0)), Being(loc=(0, 2))
+        dungeon.pieces[1].extend([*others, viewer, corner])
+        dungeon.pieces = [*dungeon.pieces, [Wall(loc=(1, 0)), Wall(loc=(2, 1))]]
+
+        pairs = [(chara, other) for other in others] + [(viewer, corner)]
+        grid = [dungeon.line_of_sight(*pair) for pair in pairs]
+        dungeon.fov = FieldOfView.RAYCAST
+        dungeon.bump_sight()
+        rays = [dungeon.line_of_sight(*pair) for pair in pairs]
+
+        assert grid == rays == [False, False, True, True, True, False]
+
+    def test_cached(self, setup_room, monkeypatch):
+        chara, dungeon = setup_room
+        wall, other = Wall(loc=(1, -1)), Being(loc=(2, -1))
+        dungeon.pieces = [*dungeon.pieces, [wall, other]]
+
+        assert not dungeon.line_of_sight(chara, other)
+
+        monkeypatch.setattr(Dungeon, "_trace_line", lambda *_: pytest.fail())
+        assert not dungeon.line_of_sight(other, chara)
+
+        monkeypatch.undo()
+        wall.loc = (1, 1)
+        assert dungeon.line_of_sight(chara, other)
+
+
+@pytest.mark.game
+class TestVisibilityCache:
+    def test_pan(self, setup_room):
+        chara, dungeon = setup_room
+
+        chara.raytracer.trace()
+        misses = dungeon.visibility.misses
+
+        dungeon.render_origin = (1, 1)
+        chara.raytracer.trace()
+        dungeon.render_origin = (0, 0)
+        chara.raytracer.trace()
+
+        assert dungeon.visibility.misses == misses
+        assert dungeon.visibility.hits == 2
+
+    def test_invalidation(self, setup_room):
+        chara, dungeon = setup_room
+        wall = Wall(loc=(2, 2))
+        dungeon.pieces = [*dungeon.pieces, [wall]]
+
+        before = chara.raytracer.trace()
+        version = dungeon.sight_version
+
+        dungeon.turns.put(Turn(other := Being(loc=(1, -1), speed=5)))
+        dungeon.pieces[1].append(other)
+        other.loc = (1, 0)
+        assert dungeon.sight_version == version + 1
+
+        other.loc = (1, 1)
+        assert dungeon.sight_version == version + 1
+
+        wall.loc = (-2, 2)
+        assert dungeon.sight_version == version + 2
+        assert (chara.raytracer.trace() != before).any()
+
+
+@pytest.mark.game
+class TestSweptHitbox:
+    def test_built_once(self, setup_room, monkeypatch):
+        chara, dungeon = setup_room
+        calls = []
+        move_hitbox = Being.move_hitbox
+        monkeypatch.setattr(
+            Being,
+            "move_hitbox",
+            lambda self, movement: calls.append(movement)
+            or move_hitbox(self, movement),
+        )
+
+        dungeon.move(Movement((0, 1), piece=chara, dungeon=dungeon))
+        dungeon.resolve_turn()
+
+        assert len(calls) == 1
+        assert tuple(chara.loc) == (-1, 0)
+
+    def test_convex(self):
+        chara = Being(loc=(0, 0))
+        chara.hitbox = box(-0.5, -0.5, 0.5, 0.5)
+
+        far = chara.move_hitbox(Movement((3, 1), piece=chara, dungeon=None))
+        near = chara.move_hitbox(Movement((0.5, 0), piece=chara, dungeon=None))
+
+        assert far.area == pytest.approx(5)
+        assert near.area == pytest.approx(1)
+        assert not near.contains(Point(0.25, 0))
+
+
+@pytest.mark.game
+class TestHookDispatch:
+    class Tripwire(Piece):
+        def on_coincide(self, movement, mock=True):
+            movement.piece.tripped = getattr(movement.piece, "tripped", 0) + 1
+
+        def on_custom(self, value):
+            return value
+
+    def test_registry(self):
+        assert (
+            TestHookDispatch.Tripwire.hooks["custom"]
+            is TestHookDispatch.Tripwire.on_custom
+        )
+        assert Wall.hooks["sight"] is Wall.on_sight
+        assert Being.hooks["sight"] is Piece.on_sight
+
+    def test_event(self):
+        wire = TestHookDispatch.Tripwire(loc=(0, 0))
+        events = queue.Queue()
+
+        wire.process_kinesis(events, box(-1, -1, 1, 1), (0, 0), "custom", 5)
+
+        assert events.get()() == 5
+
+    def test_ties(self):
+        chara = Being(loc=(0, 0), speed=5)
+        wires = [
+            TestHookDispatch.Tripwire(loc=(0, 2)),
+            TestHookDispatch.Tripwire(loc=(0, 2)),
+        ]
+        dungeon = Dungeon([wires, [chara]])
+
+        dungeon.turns.put(Turn(chara))
+        dungeon.move(Movement((0, 3), piece=chara, dungeon=dungeon))
+        dungeon.resolve_turn()
+
+        assert chara.tripped == 2
+
+
+@pytest.mark.game
+class TestScheduler:
+    def test_event_queue(self):
+        events = EventQueue()
+
+        for priority, item in ((2, "c"), (1, "a"), (1, "b")):
+            events.put(item, priority)
+
+        assert [events.get() for _ in range(3)] == ["a", "b", "c"]
+        with pytest.raises(queue.Empty):
+            events.get()
+
+    def test_rotation(self):
+        slow, fast, first = (
+            Being(loc=(0, 0), initiative=1),
+            Being(loc=(1, 0), initiative=3),
+            Being(loc=(2, 0), initiative=2),
+        )
+        dungeon = Dungeon([[slow, fast, first]])
+
+        for piece in (first, slow, fast):
+            dungeon.turns.put(Turn(piece))
+
+        order = [dungeon.turns.turn.focus]
+        for _ in range(5):
+            order.append(dungeon.start_turn() or dungeon.turns.turn.focus)
+
+        assert order == [first, fast, slow, fast, first, slow]
+
+    def test_remove(self):
+        a, b, c = (Being(loc=(i, 0)) for i in range(3))
+        dungeon = Dungeon([[a, b, c]])
+
+        for piece in (a, b, c):
+            dungeon.turns.put(Turn(piece))
+
+        dungeon.turns.remove(b)
+        dungeon.start_turn()
+
+        assert dungeon.turns.turn.focus is c
+        assert dungeon.turns.qsize() == 1
+
+
+@pytest.mark.game
+class TestPathfinding:
+    def test_find_path(self, setup_room):
+        chara, dungeon = setup_room
+
+        vectors = dungeon.find_path(chara, (1, 1))
+
+        assert sum(vectors).tolist() == [2, 2]
+        assert sum(numpy.linalg.norm(v) for v in vectors) == pytest.approx(4)
+        assert dungeon.find_path(chara, (1, 1), MovementMode.FLYING) is None
+
+    def test_move_to(self, setup_room):
+        chara, dungeon = setup_room
+
+        with pytest.raises(InsufficientSpeed):
+            dungeon.move_to(chara, (2, 2))
+        assert chara.loc.tolist() == [-1, -1]
+
+        dungeon.move_to(chara, (1, 1))
+
+        assert chara.loc.tolist() == [1, 1]
+        assert chara.speed == pytest.approx(1)
+
+    def test_move_to_rollback(self, setup_room):
+        chara, dungeon = setup_room
+
+        class Mud(Piece):
+            def on_coincide(self, movement, mock=True):
+                movement.piece.speed -= 10
+
+        dungeon.pieces = [*dungeon.pieces, [Mud(loc=(1, 1))]]
+        origin = dungeon.render_origin
+
+        # the last leg sinks into the mud, which puts back the legs before it too
+        with pytest.raises(InsufficientSpeed):
+            dungeon.move_to(chara, (1, 1))
+
+        assert chara.loc.tolist() == [-1, -1] and chara.speed == 5
+        assert dungeon.render_origin == origin
+
+    def test_distance_field(self, setup_room):
+        chara, dungeon = setup_room
+
+        field = dungeon.distance_field((1, 1))
+
+        assert field.distance((-1, -1)) == pytest.approx(4)
+        assert field.path((-1, -1))[-1] == (1, 1)
+        assert (0, 0) not in field.path((-1, -1))
+        assert dungeon.distance_field((1, 1)) is field
+
+        climbing = dungeon.distance_field((1, 1), MovementMode.CLIMBING)
+        assert climbing.distance((-1, -1)) == pytest.approx(8)
+
+    def test_invalidation(self, setup_room):
+        chara, dungeon = setup_room
+        field = dungeon.distance_field((1, 1))
+
+        dungeon.pieces[1].append(Being(loc=(1, 0)))
+
+        assert (new := dungeon.distance_field((1, 1))) is not field
+        assert new.distance((-1, -1)) == pytest.approx(4)
+        assert (1, 0) not in new.path((-1, -1))
+
+
+@pytest.mark.game
+class TestReachable:
+    def test_reachable(self, setup_room):
+        chara, dungeon = setup_room
+        chara.speed = 2
+
+        reach = dungeon.reachable(chara)
+
+        assert reach[2][2] and reach[2][4] and reach[4][2]
+        assert not reach[3][3] and not reach[4][4] and not reach[0][0]
+        assert dungeon.reachable(chara, MovementMode.CLIMBING).sum() == 5
+
+    def test_cached(self, setup_room):
+        chara, dungeon = setup_room
+
+        dungeon.reachable(chara)
+        hits = dungeon.paths.hits
+        dungeon.reachable(chara)
+
+        assert dungeon.paths.hits == hits + 1
+
+        dungeon.move(Movement((1, 0), piece=chara, dungeon=dungeon))
+        dungeon.resolve_turn()
+
+        # the camera follows the piece to (0, -1), so the pillar is right above the center
+        reach = dungeon.reachable(chara)
+        assert reach[3][3] and not reach[4][3]
+        assert dungeon.paths.hits == hits + 1
+
+    def test_overlay(self, setup_room):
+        chara, dungeon = setup_room
+        chara.speed = 1
+        dungeon.blind, dungeon.reach = "🌫️", "🟦"
+
+        board = dungeon.render
+
+        assert board[2][1] == "🟦" and board[2][3] == "🟦"
+        assert board[5][5] != "🟦"
+
+    def test_even_size(self, setup_room):
+        chara, dungeon = setup_room
+        chara.speed = 1
+        dungeon.render_size = (6, 6)
+
+        # the board centers on the cell left of and below the middle, and so must the overlay
+        reach = dungeon.reachable(chara)
+        assert reach.sum() == 5
+        assert (
+            reach[1][1] and reach[1][0] and reach[1][2] and reach[0][1] and reach[2][1]
+        )
+
+
+@pytest.mark.game
+class TestTransaction:
+    def test_rollback(self, setup_room):
+        chara, dungeon = setup_room
+
+        with pytest.raises(InsufficientSpeed):
+            dungeon.move(Movement((2, 2), piece=chara, dungeon=dungeon))
+
+        assert chara.loc.tolist() == [-1, -1] and chara.speed == 5
+
+    def test_preview(self, setup_room):
+        chara, dungeon = setup_room
+
+        assert dungeon.preview(Movement((2, 0), piece=chara, dungeon=dungeon))
+        assert not dungeon.preview(Movement((0, -2), piece=chara, dungeon=dungeon))
+        assert chara.loc.tolist() == [-1, -1] and chara.speed == 5
+
+    def test_cost(self, setup_room):
+        chara, dungeon = setup_room
+
+        dungeon.move(
+            Movement((1, 0), piece=chara, dungeon=dungeon, mode=MovementMode.CLIMBING)
+        )
+
+        assert chara.loc.tolist() == [0, -1] and chara.speed == 3
+
+    def test_side_effects(self, setup_room):
+        class Trap(Piece):
+            def on_coincide(self, movement, mock=True):
+                if not mock:
+                    movement.piece.data = "hurt"
+
+        chara, dungeon = setup_room
+        dungeon.pieces = [*dungeon.pieces, [Trap(loc=(0, -1))]]
+
+        assert dungeon.preview(Movement((1, 0), piece=chara, dungeon=dungeon))
+        with pytest.raises(InsufficientSpeed):
+            dungeon.move(
+                Movement(
+                    (3, 0), piece=chara, dungeon=dungeon, mode=MovementMode.CLIMBING
+                )
+            )
+
+        assert chara.loc.tolist() == [-1, -1] and chara.data != "hurt"
+
+        dungeon.move(Movement((1, 0), piece=chara, dungeon=dungeon))
+        assert chara.data == "hurt"
+
+
+@pytest.mark.game
+class TestLayers:
+    def test_palette(self):
+        palette = Palette()
+
+        assert palette.id(None) == palette.id("") == Palette.EMPTY
+        assert palette.id("⬜") == palette.id("⬜") != palette.id("🟫")
+        assert palette.lookup(numpy.array([[1, 0]])) == [["⬜", None]]
+
+    def test_condensed(self):
+        calls = []
+        palette = Palette(condense=lambda tile: calls.append(tile) or tile.upper())
+        emoji = "<:hana:834557109235482686>"
+        tiles = numpy.array([[palette.id("a"), palette.id(emoji), palette.id("a")]])
+
+        assert palette.lookup(tiles, condensed=True) == [["A", emoji.upper(), "A"]]
+        palette.lookup(tiles, condensed=True)
+        assert calls == ["a", emoji]
+
+        palette.forget([834557109235482686])
+        palette.lookup(tiles, condensed=True)
+        assert calls == ["a", emoji, emoji]
+
+    def test_emojis_update(self):
+        emoji = "<:hana:834557109235482686>"
+        i = PALETTE.id(emoji)
+        PALETTE._condensed[i] = "<:_:834557109235482686>"
+        PALETTE._emojis.setdefault(834557109235482686, set()).add(i)
+
+        gone = types.SimpleNamespace(id=834557109235482686)
+        asyncio.run(forget_emojis(None, [gone], []))
+
+        with pytest.raises(EmojiNotFound):
+            PALETTE.condensed(i)
+
+    def test_condense(self):
+        assert condense(":hash:") == condense("#️⃣") == "#⃣"
+        assert condense("🌫️") == condense(":fog:") == "🌫"
+
+        with pytest.raises(EmojiNotFound):
+            condense(":not_an_emoji:")
+
+    def test_definite_skin(self):
+        skin = DefiniteSkin([["⬜", "🟫"], ["😀"]])
+        (origin, ids) = skin.raster()
+
+        assert skin.get_bounds() == (range(2), range(2)) and origin == (0, 0)
+        assert skin.get_index(0, 1) == "⬜" and skin.get_index(0, 0) == "😀"
+        assert skin.get_index(1, 0) is None and skin.get_index(2, 0) is None
+        assert PALETTE.lookup(ids) == [["😀", None], ["⬜", "🟫"]]
+        assert DefiniteSkin.from_ids(ids).get_index(1, 1) == "🟫"
+
+    def test_merged_piece(self):
+        merged = MergedPiece(
+            [
+                Piece((0, 0), skin=DefiniteSkin([["😀"]])),
+                Piece((0, 0), skin=DefiniteSkin([["⬜", "⬜"]])),
+                Piece((-1, 2)),
+            ],
+            loc=(1, 1),
+        )
+
+        assert merged.skin.get_bounds() == (range(-1, 2), range(0, 3))
+        assert merged.skin.get_index(0, 0) == "😀" and merged.skin.get_index(1, 0) == "⬜"
+        assert merged.skin.get_index(-1, 1) is None
+        assert merged.true_hitbox.bounds == (-0.5, 0.5, 1.5, 3.5)
+
+        wavy = MergedPiece([Piece((0.5, 0)), Piece((0, 0), skin=DefiniteSkin([["😀"]]))])
+
+        assert not wavy.skin.get_bounds() and wavy.skin.get_index(0, 0) == "😀"
+
+    def test_plane(self, setup_room):
+        chara, dungeon = setup_room
+        dungeon.blind = "🌫️"
+        calls = []
+        tiles = numpy.array([PALETTE.id("🟫"), PALETTE.id("🟦")])
+
+        def checkered(x, y):
+            calls.append((x, y))
+            return tiles[(x + y) % 2]
+
+        dungeon.pieces = [
+            [Plane(lambda x, y: ("🟫", "🟦")[(x + y) % 2])],
+            *dungeon.pieces,
+        ]
+        legacy = dungeon.render
+
+        dungeon.pieces = [
+            [Plane(checkered, vectorized=True, deterministic=True)],
+            *dungeon.pieces[1:],
+        ]
+
+        assert dungeon.render == legacy and len(calls) == 1
+        dungeon.renders.clear()
+        assert dungeon.render == legacy and len(calls) == 1
+        assert dungeon.pieces[0][0].skin.get_index(1, 0) == "🟦"
+
+    def test_animated(self, setup_room):
+        chara, dungeon = setup_room
+        dungeon.blind = "🌫️"
+        frame = [0]
+
+        dungeon.pieces = [
+            [Plane(lambda x, y: ("🟫", "🟦")[frame[0]])],
+            *dungeon.pieces,
+        ]
+        first = dungeon.render_str
+
+        # nothing moved, but the water flows anyway
+        frame[0] = 1
+        assert dungeon.animated and dungeon.render_str != first
+        assert dungeon.render_key("render") is None
+
+    def test_compose(self, setup_room):
+        chara, dungeon = setup_room
+        dungeon.blind = "🌫️"
+        dungeon.pieces = [[BoringPlane("🟫")], *dungeon.pieces]
+
+        board = dungeon.render
+
+        assert board[0][0] == "⬜" and board[1][1] == "🟫"
+        assert dungeon._compose(1, dungeon.pieces[1]) is dungeon._layers[1][1]
+        assert dungeon._compose(0, dungeon.pieces[0]) is None
+
+    def test_dynamic(self, setup_room):
+        chara, dungeon = setup_room
+        chara.skin = DefiniteSkin([["😀"]])
+        dungeon.blind = "🌫️"
+
+        assert dungeon.render[2][2] == "😀"
+
+        dungeon.move(Movement((1, 0), piece=chara, dungeon=dungeon))
+
+        assert dungeon.render[2][2] != "😀" and dungeon.render[2][3] == "😀"
+
+    def test_render_cache(self, setup_room):
+        chara, dungeon = setup_room
+        chara.skin = DefiniteSkin([["😀"]])
+        dungeon.blind = "🌫️"
+
+        board = dungeon.render
+        board[0][0] = None
+        assert dungeon.render_str == dungeon.render_str
+        assert dungeon.render[0][0] == "⬜" and dungeon.renders.hits == 3
+
+        with pytest.raises(InsufficientSpeed):
+            dungeon.move(Movement((0, -2), piece=chara, dungeon=dungeon))
+        assert dungeon.diff(board) == [0]
+
+        chara.apply_conditions(Condition.INVISIBLE)
+        assert dungeon.diff(board) == [0, 2]
+
+        dungeon.render_size = (5, 5)
+        assert dungeon.diff(board) == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.game
+class TestMaps:
+    maze = """
+        ###..
+        #...#
+        ##.##
+        """
+
+    def test_parse(self):
+        grid = parse_map([self.maze])
+
+        assert grid.tolist() == [
+            [True, True, False, True, True],
+            [True, False, False, False, True],
+            [True, True, True, False, False],
+        ]
+
+    def test_mesh(self):
+        grid = parse_map([self.maze])
+        rects = greedy_mesh(grid)
+        covered = numpy.zeros_like(grid, dtype=int)
+
+        for x0, y0, x1, y1 in rects:
+            covered[y0 : y1 + 1, x0 : x1 + 1] += 1
+
+        assert (covered == grid).all() and len(rects) == 5
+
+    def test_files(self, tmp_path):
+        (tmp_path / "maze.txt").write_text(self.maze)
+        grid = load_map(tmp_path / "maze.txt")
+        save_map(tmp_path / "maze.hmap", grid)
+
+        assert (load_map(tmp_path / "maze.hmap") == grid).all()
+        assert (MergedWalls.load(tmp_path / "maze.hmap").grid == grid).all()
+
+    def test_hitbox(self):
+        walls = MergedWalls(self.maze)
+        walls.loc = (1, 1)
+        cells = unary_union(
+            [
+                box(x + 0.5, y + 0.5, x + 1.5, y + 1.5)
+                for y, x in zip(*numpy.nonzero(walls.grid))
+            ]
+        )
+
+        assert walls.true_hitbox.symmetric_difference(cells).is_empty
+        assert walls.true_bounds == cells.bounds
+        assert walls.hitbox_near(Point(1, 3)).equals(box(0.5, 2.5, 3.5, 3.5))
+
+
+@pytest.mark.game
+class TestWorld:
+    maze = "\n".join(["#.#.#.#.", "........", "#......#", "...##..."] * 2)
+
+    @pytest.fixture
+    def setup_world(self):
+        grid = parse_map([self.maze])
+        world = World(lambda bounds: window(grid, bounds), chunk_size=4, capacity=3)
+        chara = Being(loc=(2, 2), speed=10)
+        dungeon = Dungeon(
+            [[chara]], world=world, blind="🌫️", render_size=(3, 3), render_origin=(2, 2)
+        )
+        dungeon.turns.put(Turn(chara))
+
+        return grid, world, chara, dungeon
+
+    def test_chunks(self, setup_world):
+        grid, world, chara, dungeon = setup_world
+
+        assert world.chunks((-1, 3, 4, 4)) == [
+            (-1, 0),
+            (0, 0),
+            (1, 0),
+            (-1, 1),
+            (0, 1),
+            (1, 1),
+        ]
+        assert dungeon.pieces[0] is world.pieces
+
+        world.ensure((0, 0, 7, 3))
+        world.ensure((0, 4, 3, 7))
+
+        world.ensure((0, 0, 0, 0))
+        world.ensure((4, 4, 4, 4))
+
+        assert list(world._chunks) == [(0, 1), (0, 0), (1, 1)] and world.loads == 4
+        assert len(world.pieces) == 3
+
+    def test_render(self, setup_world):
+        grid, world, chara, dungeon = setup_world
+        walls = MergedWalls(self.maze)
+        whole = Dungeon([[walls], [Being(loc=(2, 2))]], blind="🌫️", render_size=(3, 3))
+        whole.render_origin = (2, 2)
+        whole.turns.put(Turn(whole.pieces[1][0]))
+
+        # the chunks needed at once are kept even beyond the capacity
+        assert dungeon.render == whole.render and len(world) == 4
+
+    def test_collide(self, setup_world):
+        grid, world, chara, dungeon = setup_world
+        chara.loc = (6, 5)
+
+        assert not dungeon.preview(Movement((1, 0), piece=chara, dungeon=dungeon))
+        assert (1, 1) in world
+
+    def test_map_file(self, tmp_path):
+        grid = parse_map([self.maze])
+        save_map(tmp_path / "maze.hmap", grid)
+        source = MapFile(tmp_path / "maze.hmap")
+
+        for bounds in ((-2, -2, 9, 9), (3, 1, 6, 2), (9, 9, 10, 10)):
+            assert (source(bounds) == window(grid, bounds)).all()
+
+
+@pytest.mark.game
+class TestSnapshot:
+    maze = "\n".join(["#####", "#...#", "#.#.#", "#...#", "#####"])
+
+    @pytest.fixture
+    def setup_snapshot(self):
+        walls = MergedWalls(self.maze)
+        walls.loc = (-2, -2)
+        horse = Being(loc=(0, 0), speed=8, initiative=1)
+        chara = Being(loc=(0, 0), speed=5, mount=horse, initiative=3, data={"hp": 7})
+        rock = Wall(loc=(1, 1))
+        dungeon = Dungeon(
+            [[walls], [rock], [horse, chara]], blind="🌫️", render_size=(5, 5)
+        )
+
+        for piece in (chara, horse):
+            dungeon.turns.put(Turn(piece))
+        chara.speed = 2
+        horse.condition |= Condition.PRONE
+        chara.psychology[Relation.FRIGHTENED].append(horse)
+
+        return walls, rock, horse, chara, dungeon
+
+    def test_round_trip(self, setup_snapshot):
+        walls, rock, horse, chara, dungeon = setup_snapshot
+        restored = load(dump(dungeon))
+
+        walls2, rock2, (horse2, chara2) = (
+            restored.pieces[0][0],
+            restored.pieces[1][0],
+            restored.pieces[2],
+        )
+
+        assert type(chara2) is Being and type(walls2) is MergedWalls
+        assert (chara2.loc == chara.loc).all() and (walls2.loc == walls.loc).all()
+        assert (chara2.speed, chara2.max_speed) == (2, 5)
+        assert horse2.condition == Condition.PRONE
+        assert chara2.mount is horse2 and chara2.data == {"hp": 7}
+        assert chara2.psychology[Relation.FRIGHTENED] == [horse2]
+        assert chara2.hitbox is horse2.hitbox
+        assert (walls2.grid == walls.grid).all()
+        assert walls2.hitbox.equals(walls.hitbox)
+
+        assert restored.turns.turn.focus is chara2
+        assert restored.turns.next_turn().focus is horse2
+        assert restored.turns.next_turn().focus is chara2 and restored.turns.round == 1
+
+        assert restored.render_size == dungeon.render_size
+        assert restored.render_str == dungeon.render_str
+
+    def test_library(self, setup_snapshot):
+        walls, rock, horse, chara, dungeon = setup_snapshot
+        library = Library()
+        key = library.add(dungeon.pieces[0])
+        chara.mount = walls
+
+        data = dump(dungeon, library)
+        restored = load(data, library)
+
+        # the shared layer isn't copied, and restores as the very same pieces
+        assert len(data) < len(dump(dungeon))
+        assert restored.pieces[0] is library[key]
+        assert restored.pieces[2][1].mount is walls
+        assert library.add([MergedWalls(self.maze)]) != key
+
+        with pytest.raises(SnapshotError):
+            load(data)
+        with pytest.raises(SnapshotError):
+            load(b"HMAP" + data[4:])
+
+    def test_untrusted(self):
+        class Golem(Being):
+            ...
+
+        golem = Golem(loc=(0, 0))
+        dungeon = Dungeon([[golem]])
+
+        # only registered classes are written or read, and piece state is plain JSON
+        with pytest.raises(SnapshotError):
+            dump(dungeon)
+
+        register(Golem)
+        data = dump(dungeon)
+        assert type(load(data).pieces[0][0]) is Golem
+
+        del CLASSES[f"{Golem.__module__}:{Golem.__qualname__}"]
+        with pytest.raises(SnapshotError):
+            load(data)
+
+        with pytest.raises(SnapshotError):
+            dump(Dungeon([[Being(loc=(0, 0), data=object())]]))
+
+        # attributes are restored as plain data, never over the class's methods
+        register(Golem)
+        golem.on_wave = 1
+        assert load(dump(dungeon)).pieces[0][0].on_wave == 1
+        with pytest.raises(SnapshotError):
+            load(dump(dungeon).replace(b'"on_wave"', b'"on_move"'))
+
+        golem.on_wave = object()
+        with pytest.raises(SnapshotError):
+            dump(dungeon)
+
+    def test_merged_piece(self):
+        merged = MergedPiece(
+            [
+                Piece((0, 0), skin=DefiniteSkin([["😀"]])),
+                Piece((1, 0), skin=DefiniteSkin([["⬜"]])),
+            ],
+            loc=(1, 1),
+        )
+        dungeon = Dungeon([[merged]], render_size=(5, 5))
+
+        restored = load(dump(dungeon)).pieces[0][0]
+
+        assert type(restored) is MergedPiece
+        assert [p.loc.tolist() for p in restored._pieces] == [[0, 0], [1, 0]]
+        assert restored._pieces[0].skin.get_index(0, 0) == "😀"
+        assert restored.skin.get_bounds() == merged.skin.get_bounds()
+        assert restored.hitbox.equals(merged.hitbox)
+
+    def test_corrupt(self, setup_snapshot):
+        *_, dungeon = setup_snapshot
+        data = dump(dungeon)
+
+        # whatever is wrong with a snapshot, callers only have to catch one error
+        for corrupt in (data[:-10], data[:8], data[:30] + b"x" * 20 + data[50:]):
+            with pytest.raises(SnapshotError):
+                load(corrupt)
+
+
+@pytest.mark.game
+class TestSessions:
+    def test_spill(self, tmp_path, monkeypatch):
+        dumps = []
+        monkeypatch.setattr(
+            snapshot, "dump", lambda *args: dumps.append(1) or dump(*args)
+        )
+
+        walls = [MergedWalls("#.#\n...\n#.#")]
+        library = Library()
+        library.add(walls)
+
+        clock = types.SimpleNamespace(now=0)
+        sessions = SessionManager(
+            DiskStore(tmp_path), library=library, ttl=10, clock=lambda: clock.now
+        )
+
+        def session(x):
+            chara = Being(loc=(x, 0), speed=5)
+            dungeon = Dungeon([walls, [chara]])
+            dungeon.turns.put(Turn(chara))
+            return dungeon
+
+        async def play():
+            await sessions.put(1, session(1))
+            await sessions.put(2, session(2))
+            assert len(sessions) == 2 and sessions.size > 0
+
+            # the budget holds one session, so the least recently used one goes
+            sessions.budget = sessions.size // 2 + 1
+            assert (await sessions.get(1)).turns.turn.focus.loc[0] == 1
+            assert 1 in sessions and 2 not in sessions
+
+            restored = await sessions.get(2)
+            assert restored.turns.turn.focus.loc[0] == 2
+            assert restored.pieces[0] is walls and 1 not in sessions
+
+            # idle sessions are spilled too, however much room there is
+            sessions.budget = 2 ** 30
+            clock.now = 11
+            await sessions.put(3, session(3))
+            assert list(sessions._sessions) == [3]
+
+            assert await sessions.get(4) is None
+            await sessions.delete(1)
+            assert await sessions.get(1) is None
+
+        asyncio.run(play())
+
+        assert sessions.metrics == {
+            "live": 1,
+            "bytes": sessions.size,
+            "hits": 1,
+            "misses": 2,
+            "rehydrations": 1,
+            "spills": 3,
+        }
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["2.hdgn"]
+        # sizes are estimated, so the only snapshots taken are the spilled ones
+        assert len(dumps) == sessions.spills
+
+    def test_in_use(self, tmp_path):
+        class SlowStore(DiskStore):
+            async def save(self, key, data):
+                await asyncio.sleep(0.01)
+                await super().save(key, data)
+
+        def session():
+            chara = Being(loc=(0, 0), speed=5)
+            dungeon = Dungeon([[chara]])
+            dungeon.turns.put(Turn(chara))
+            return dungeon
+
+        sessions = SessionManager(SlowStore(tmp_path), budget=0)
+
+        async def play():
+            await sessions.put(1, session())
+
+            # a held session stays live however far over the budget things are
+            async with sessions.use(1) as held:
+                await sessions.put(2, session())
+                assert 1 in sessions and 2 in sessions
+
+            # a session asked for while it's being spilled comes back with the spilled state
+            spill = asyncio.ensure_future(sessions.spill(1))
+            await asyncio.sleep(0)
+            dungeon = await sessions.get(1)
+            await spill
+
+            assert dungeon is not held and sessions.rehydrations == 1
+
+        asyncio.run(play())
+
+
+@pytest.mark.game
+class TestTemplates:
+    def test_shared(self):
+        maze = MergedWalls(numpy.ones((64, 64), dtype=bool)).freeze()
+        walls = [maze]
+        dungeons = [Dungeon([walls, [Being(loc=(-1, -1))]]) for _ in range(2)]
+
+        # neither dungeon claims the maze, and neither indexes it cell by cell
+        assert maze.dungeon is None and not hasattr(maze, "raytracer")
+        assert all(len(d.index._buckets) == 1 for d in dungeons)
+        assert dungeons[0].query((0, 0, 1, 1))[0] is maze
+
+        with pytest.raises(FrozenPiece):
+            maze.loc = (1, 1)
+        maze.loc = (0, 0)
+        with pytest.raises(ValueError):
+            maze.loc += (1, 0)
+        assert tuple(maze.loc) == (0, 0)
+        with pytest.raises(FrozenPiece):
+            maze.condition |= Condition.INVISIBLE
+
+    def test_collide(self):
+        maze = MergedWalls("###\n#.#\n###").freeze()
+        chara = Being(loc=(1, 1), speed=5)
+        dungeon = Dungeon([[maze], [chara]])
+        dungeon.turns.put(Turn(chara))
+
+        # rolling back the bump leaves the template alone rather than setting it
+        with pytest.raises(InsufficientSpeed):
+            dungeon.move(Movement((-1, 0), piece=chara, dungeon=dungeon))
+
+        assert tuple(chara.loc) == (1, 1)
+        maze.restore(maze.snapshot())
+
+    def test_instance(self):
+        maze = MergedWalls("#.#\n...\n#.#").freeze()
+        walls = maze.instance((3, 0), condition=Condition.INVISIBLE)
+        dungeon = Dungeon([[walls]])
+
+        assert walls.dungeon is dungeon and not walls.frozen
+        assert walls.grid is maze.grid and walls.skin is maze.skin
+        assert not maze.grid.flags.writeable
+
+        # the hitbox isn't built by freezing, and once built by either, it's built for both
+        assert not maze._geometry
+        assert walls.hitbox is maze.hitbox
+        assert tuple(walls.loc) == (3, 0) and tuple(maze.loc) == (0, 0)
+        assert walls.condition == Condition.INVISIBLE and maze.condition == 0
+
+        walls.loc = (4, 0)
+        assert dungeon.query((5, 0, 5, 0)) == [walls]
+        assert load(dump(Dungeon([[maze]]))).pieces[0][0].frozen
+
+
+@pytest.mark.game
+class TestService:
+    def test_calls(self):
+        chara = Being(loc=(0, 0), speed=3)
+        dungeon = Dungeon([[chara]], blind="🌫️", render_size=(3, 3))
+        dungeon.turns.put(Turn(chara))
+        service = DungeonService(workers=4)
+        order = []
+
+        def step(i):
+            order.append(i)
+
+        async def play():
+            # calls on one dungeon keep their order even though the pool could run them at once
+            await asyncio.gather(*(service.call(dungeon, step, i) for i in range(20)))
+
+            await service.move(dungeon, Movement((2, 0), piece=chara, dungeon=dungeon))
+            with pytest.raises(InsufficientSpeed):
+                await service.move(
+                    dungeon, Movement((2, 0), piece=chara, dungeon=dungeon)
+                )
+
+            return await service.render_str(dungeon)
+
+        try:
+            board = asyncio.run(play())
+        finally:
+            service.close()
+
+        assert order == list(range(20)) and not service._locks
+        assert tuple(chara.loc) == (2, 0) and board == dungeon.render_str